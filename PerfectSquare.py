@@ -1,7 +1,13 @@
-from enums import Objects, is_box, is_perfect_square
+import bisect
+import heapq
+import numpy as np
+from enums import Objects, is_box, box_block_corner, perfect_square_extend
+from square_detection import SquareDetector
 
 class PerfectSquare:
-    def __init__(self, start, extend):
+    __slots__ = ("start", "start_i", "start_j", "extend", "birth")
+
+    def __init__(self, start, extend, birth=None):
         start_i, start_j = start
 
         self.start = start
@@ -9,7 +15,7 @@ class PerfectSquare:
         self.start_j = start_j
         self.extend = extend
 
-        self.age = 0
+        self.birth = birth # clock of the registry when the square was found, None until it is added
 
     def includes(self, position) -> bool:
         i,j = position
@@ -19,40 +25,41 @@ class PerfectSquare:
         
         return False
 
-    def exeeded_max_age(self, max_age):
-        if self.age >= max_age:
-            return True
-        return False
-    
-    def increase_age(self):
-        self.age += 1
+    def key(self):
+        return (self.start_i, self.start_j, self.extend)
+
+    def included_cells(self):
+        """ the cells includes() is true for """
+        for i in range(self.start_i, self.start_i + self.extend + 1):
+            for j in range(self.start_j, self.start_j + self.extend + 1):
+                yield (i, j)
 
-    def dissolute(self, map):
+    def dissolute(self, map, changed=None):
         start_i, start_j = self.start
         for i in range(1,self.extend):
             for j in range(1,self.extend):
-                map[start_i + i][start_j + j] = Objects.Empty.value
+                _write(map, start_i + i, start_j + j, Objects.Empty.value, changed)
         return map
 
-    def apply_barrier_maker(self, map):
+    def apply_barrier_maker(self, map, changed=None):
         start_i, start_j = self.start
         for i in range(1,self.extend-1):
             for j in range(1,self.extend-1):
-                map[start_i + i][start_j + j] = Objects.Barrier.value
+                _write(map, start_i + i, start_j + j, Objects.Barrier.value, changed)
         return map
     
-    def apply_hellify(self, map):
+    def apply_hellify(self, map, changed=None):
         start_i, start_j = self.start
 
         for i in range(1, self.extend-1):
-            map[start_i + i][start_j + 1] = Objects.Empty.value
-            map[start_i + i][start_j + self.extend-2] = Objects.Empty.value
-            map[start_i + 1][start_j + i] = Objects.Empty.value
-            map[start_i + self.extend-2][start_j + i] = Objects.Empty.value
+            _write(map, start_i + i, start_j + 1, Objects.Empty.value, changed)
+            _write(map, start_i + i, start_j + self.extend-2, Objects.Empty.value, changed)
+            _write(map, start_i + 1, start_j + i, Objects.Empty.value, changed)
+            _write(map, start_i + self.extend-2, start_j + i, Objects.Empty.value, changed)
         
         for i in range(2,self.extend-2):
             for j in range(2,self.extend-2):
-                map[start_i + i][start_j + j] = Objects.Lava.value
+                _write(map, start_i + i, start_j + j, Objects.Lava.value, changed)
         return map
 
     def __eq__(self, value):
@@ -66,22 +73,179 @@ class PerfectSquare:
     def find_new_perfect_squares(map:list[list], perviously_found_perfect_squares:list) -> list:
         res = []
 
+        starts_i, starts_j, extends = SquareDetector(map).find_all()
+        for k in np.lexsort((starts_j, starts_i)): # same order as scanning row by row
+            new_perf_sq = PerfectSquare((int(starts_i[k]), int(starts_j[k])), int(extends[k]))
+            if new_perf_sq not in perviously_found_perfect_squares:
+                res.append(new_perf_sq)
+        
+        return res
+
+    def find_new_perfect_squares_around(map:list[list], cells, perviously_found_perfect_squares:list) -> list:
+        """
+            Same as find_new_perfect_squares, but only looks at the squares that
+            could contain one of `cells`. A square that became perfect must contain
+            a changed cell, either inside (a box) or on its border (an empty cell
+            next to a box), so every candidate comes from a box block touching them.
+        """
         n = len(map)
         m = len(map[0])
-        for i in range(n):
-            for j in range(m):
-                extend = 4
-                while i + extend <= n and j + extend <= m:
-                    if is_perfect_square(map, (i,j), extend):
-                        new_perf_sq = PerfectSquare((i,j), extend)
-                        if new_perf_sq not in perviously_found_perfect_squares:
-                            res.append(new_perf_sq)
-                        
-                        break
-                    
-                    extend += 1
-        
+        starts = set()
+        for i, j in cells:
+            value = map[i][j]
+            if is_box(value):
+                starts.add(box_block_corner(map, (i,j)))
+            elif value == Objects.Empty.value:
+                for di in (-1, 0, 1):
+                    for dj in (-1, 0, 1):
+                        ni, nj = i + di, j + dj
+                        if 0 <= ni < n and 0 <= nj < m and is_box(map[ni][nj]):
+                            starts.add(box_block_corner(map, (ni,nj)))
+
+        res = []
+        for start in sorted(starts):
+            extend = perfect_square_extend(map, start)
+            if extend is None:
+                continue
+
+            new_perf_sq = PerfectSquare(start, extend)
+            if new_perf_sq not in perviously_found_perfect_squares:
+                res.append(new_perf_sq)
+
         return res
+
+class PerfectSquareRegistry:
+    """
+        The live perfect squares of an environment, iterated in the order they were added
+        (the order of the list it replaces).
+
+        - squares are indexed by (start, extend)
+        - a square keeps the clock it was found at, its age is clock - birth, so
+          ageing every square is a single clock increment
+        - an expiry min-heap of (birth, order, key) gives the squares to dissolve;
+          entries of squares removed earlier are skipped when they come up
+        - the squares of each birth are kept in adding order and the births sorted,
+          so the oldest square is found without sorting
+        - every cell a square includes points to it, for the removal on push
+
+        Squares are not changed once added, so copy() can share them.
+    """
+
+    def __init__(self, squares=(), clock=0):
+        self.clock = clock
+        self._next_order = 0
+        self._squares = {} # key -> (order, square)
+        self._births = [] # sorted births that have squares
+        self._by_birth = {} # birth -> {key: square} in adding order
+        self._expiry = [] # heap of (birth, order, key)
+        self._cover = {} # cell -> keys of the squares including it
+
+        for sq in squares: # squares without a birth are born now
+            self.add(sq, sq.birth)
+
+    def __len__(self):
+        return len(self._squares)
+
+    def __iter__(self):
+        return (sq for order, sq in self._squares.values())
+
+    def __contains__(self, sq):
+        return sq.key() in self._squares
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def age(self, sq):
+        return self.clock - sq.birth
+
+    def tick(self):
+        """ every square gets one step older """
+        self.clock += 1
+
+    def add(self, sq, birth=None):
+        """ adds a new square, born now unless a birth is given """
+        sq.birth = self.clock if birth is None else birth
+        key = sq.key()
+        order = self._next_order
+        self._next_order += 1
+
+        self._squares[key] = (order, sq)
+
+        group = self._by_birth.get(sq.birth)
+        if group is None:
+            group = self._by_birth[sq.birth] = {}
+            bisect.insort(self._births, sq.birth)
+        group[key] = sq
+
+        heapq.heappush(self._expiry, (sq.birth, order, key))
+
+        for cell in sq.included_cells():
+            self._cover[cell] = self._cover.get(cell, ()) + (key,)
+
+    def remove(self, sq):
+        key = sq.key()
+        order, sq = self._squares.pop(key)
+
+        group = self._by_birth[sq.birth]
+        del group[key]
+        if not group:
+            del self._by_birth[sq.birth]
+            self._births.remove(sq.birth)
+
+        for cell in sq.included_cells():
+            keys = tuple(k for k in self._cover[cell] if k != key)
+            if keys:
+                self._cover[cell] = keys
+            else:
+                del self._cover[cell]
+
+    def pop_expired(self, max_age):
+        """ removes and returns the squares whose age reached max_age """
+        expired = []
+        while self._expiry and self.clock - self._expiry[0][0] >= max_age:
+            birth, order, key = heapq.heappop(self._expiry)
+            entry = self._squares.get(key)
+            if entry is None or entry[0] != order: # removed before it expired
+                continue
+            expired.append(entry[1])
+            self.remove(entry[1])
+        return expired
+
+    def oldest(self, min_extend=0):
+        """
+            The oldest square with at least min_extend, of equally old squares the
+            one added last (like sorting by age and reversing). None if there is none.
+        """
+        for birth in self._births:
+            for sq in reversed(self._by_birth[birth].values()):
+                if sq.extend >= min_extend:
+                    return sq
+        return None
+
+    def first_including(self, position):
+        """ the first added square that includes position, None if there is none """
+        keys = self._cover.get((int(position[0]), int(position[1])))
+        if not keys:
+            return None
+        order, sq = min(self._squares[key] for key in keys)
+        return sq
+
+    def copy(self):
+        other = PerfectSquareRegistry.__new__(PerfectSquareRegistry)
+        other.clock = self.clock
+        other._next_order = self._next_order
+        other._squares = dict(self._squares)
+        other._births = list(self._births)
+        other._by_birth = {birth: dict(group) for birth, group in self._by_birth.items()}
+        other._expiry = list(self._expiry)
+        other._cover = dict(self._cover)
+        return other
+
+def _write(map, i, j, value, changed):
+    old = map[i][j]
+    if changed is not None and old != value:
+        changed.append((i, j, int(old), value))
+    map[i][j] = value
     
 if __name__ == "__main__":
     sq1 = PerfectSquare((1,1), extend=3)
@@ -0,0 +1,76 @@
+import numpy as np
+from enums import Objects, Actions, Move_to_delta, is_box
+from square_detection import box_mask
+
+MOVES = [Actions.MoveUp.value, Actions.MoveRight.value, Actions.MoveDown.value, Actions.MoveLeft.value]
+
+def _along(a, z):
+    """ view of the last two axes of `a` in which the move z goes along the last axis, forwards """
+    if z == Actions.MoveRight.value:
+        return a
+    if z == Actions.MoveLeft.value:
+        return a[..., ::-1]
+    if z == Actions.MoveDown.value:
+        return np.swapaxes(a, -1, -2)
+    return np.swapaxes(a, -1, -2)[..., ::-1]
+
+def push_ok(grid):
+    """
+        (..., H, W, 4) booleans, true where a box pushed with the move z = k + 1
+        would move: the first non box cell ahead of it is empty or lava.
+    """
+    grid = np.asarray(grid)
+    box = box_mask(grid)
+    free = (grid == Objects.Empty.value) | (grid == Objects.Lava.value)
+    ok = np.zeros((*grid.shape, len(MOVES)), dtype=bool)
+
+    for z in MOVES:
+        ok_z, box_z, free_z = _along(ok[..., z - 1], z), _along(box, z), _along(free, z)
+        for k in range(ok_z.shape[-1] - 2, -1, -1):
+            ok_z[..., k] = free_z[..., k + 1] | (box_z[..., k + 1] & ok_z[..., k + 1])
+    return ok
+
+def action_mask(grid):
+    """ (..., H, W, 6) mask of the moves, the special actions are left False """
+    grid = np.asarray(grid)
+    mask = np.zeros((*grid.shape, len(Actions)), dtype=bool)
+    mask[..., :len(MOVES)] = box_mask(grid)[..., None] & push_ok(grid)
+    return mask
+
+
+class ActionMask:
+    """
+        Mask of the moves of a grid, updated from the cells that changed.
+
+        Whether a push from a cell moves depends on the cells ahead of it, so a
+        changed cell can only change the cells behind it, up to the first one
+        whose result stays the same.
+    """
+
+    def __init__(self, grid):
+        grid = np.asarray(grid) # a ChunkedGrid is read densely once, then updated cell by cell
+        self.ok = push_ok(grid)
+        self.mask = np.zeros((*grid.shape, len(Actions)), dtype=bool)
+        self.mask[..., :len(MOVES)] = box_mask(grid)[..., None] & self.ok
+
+    def update(self, grid, cells):
+        n_rows, n_cols = grid.shape
+        cells = set(cells)
+        for z in MOVES:
+            di, dj = (int(d) for d in Move_to_delta[z])
+            ok = self.ok[..., z - 1]
+            mask = self.mask[..., z - 1]
+
+            # cells further ahead first, so the cells ahead of a cell are up to date when it is reached
+            for i, j in sorted(cells, key=lambda cell: -(cell[0]*di + cell[1]*dj)):
+                mask[i, j] = is_box(grid[i, j]) and ok[i, j]
+
+                x, y = i - di, j - dj
+                while 0 <= x < n_rows and 0 <= y < n_cols:
+                    ahead = grid[x + di, y + dj]
+                    new = ahead == Objects.Empty.value or ahead == Objects.Lava.value or (is_box(ahead) and ok[x + di, y + dj])
+                    if new == ok[x, y]:
+                        break
+                    ok[x, y] = new
+                    mask[x, y] = new and is_box(grid[x, y])
+                    x, y = x - di, y - dj
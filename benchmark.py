@@ -0,0 +1,295 @@
+"""
+    Benchmarks of ShoverWorldEnv: steps/sec, reset latency and per-step allocations,
+    over grid sizes, box densities, the shipped maps and a few action mixes.
+
+        python3 benchmark.py --output bench.json
+        python3 benchmark.py --quick --compare bench.json
+        python3 benchmark.py --startup 1 8 32   # start up of worker processes
+"""
+import argparse
+import contextlib
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import settings
+from environment import ShoverWorldEnv
+from enums import Actions, Move_to_delta
+
+GRID_SIZES = [6, 12, 32, 64, 128, 256]
+BOX_DENSITIES = [0.05, 0.2, 0.5]
+MAPS = ["map1.txt", "map2.txt"]
+ACTION_MIXES = ["random", "chain", "special"]
+
+QUICK_GRID_SIZES = [6, 32, 128]
+QUICK_BOX_DENSITIES = [0.2]
+
+# a result is a regression when it is worse than the baseline by more than this fraction
+DEFAULT_THRESHOLD = 0.15
+
+# what a worker process runs before its first step, with the simulation core or the gymnasium env
+WORKER_STARTUP = {
+    "core": "from core import ShoverWorldCore; ShoverWorldCore(map_name='map2.txt')",
+    "environment": "from environment import ShoverWorldEnv; ShoverWorldEnv(None, map_name='map2.txt')",
+}
+
+
+@contextlib.contextmanager
+def random_map_settings(size, density):
+    """ settings used by ShoverWorldEnv to generate a size x size random map """
+    env_vars = settings.EnvironmentVars
+    saved = (env_vars.n_rows, env_vars.n_cols, env_vars.number_of_boxes, env_vars.number_of_lavas, env_vars.number_of_barriers)
+
+    cells = size * size
+    env_vars.n_rows = env_vars.n_cols = size
+    env_vars.number_of_boxes = max(1, int(cells * density))
+    env_vars.number_of_lavas = max(1, cells // 50)
+    env_vars.number_of_barriers = max(1, cells // 50)
+    try:
+        yield
+    finally:
+        env_vars.n_rows, env_vars.n_cols, env_vars.number_of_boxes, env_vars.number_of_lavas, env_vars.number_of_barriers = saved
+
+
+def make_actions(env, mix, count, rng):
+    """
+        Actions drawn ahead of time from the current grid, so drawing them is not timed.
+            random:  any cell, any move
+            chain:   a box with another box ahead of it, pushed along the chain
+            special: half BarrierMaker/Hellify, half box pushes
+    """
+    n_rows, n_cols = env.map.shape
+    boxes = np.argwhere((env.map >= 1) & (env.map <= 10))
+    moves = [Actions.MoveUp.value, Actions.MoveRight.value, Actions.MoveDown.value, Actions.MoveLeft.value]
+
+    if mix == "random" or len(boxes) == 0:
+        positions = np.stack([rng.integers(0, n_rows, count), rng.integers(0, n_cols, count)], axis=1)
+        zs = rng.choice(moves, count)
+
+    elif mix == "chain":
+        chains = []
+        for z in moves:
+            ahead = boxes + Move_to_delta[z]
+            inside = (ahead[:, 0] >= 0) & (ahead[:, 0] < n_rows) & (ahead[:, 1] >= 0) & (ahead[:, 1] < n_cols)
+            ahead_box = np.zeros(len(boxes), dtype=bool)
+            value = env.map[ahead[inside, 0], ahead[inside, 1]]
+            ahead_box[inside] = (value >= 1) & (value <= 10)
+            chains.extend((tuple(cell), z) for cell in boxes[ahead_box])
+        if not chains:
+            chains = [(tuple(cell), z) for cell in boxes for z in moves]
+        picks = rng.integers(0, len(chains), count)
+        positions = np.array([chains[k][0] for k in picks])
+        zs = np.array([chains[k][1] for k in picks])
+
+    else:
+        positions = boxes[rng.integers(0, len(boxes), count)]
+        zs = rng.choice(moves, count)
+        special = rng.random(count) < 0.5
+        zs[special] = rng.choice([Actions.BarrierMaker.value, Actions.Hellify.value], special.sum())
+
+    return [{"position": positions[k], "z": int(zs[k])} for k in range(count)]
+
+
+def time_steps(env, mix, steps, rng):
+    actions = make_actions(env, mix, steps, rng)
+    step_time = 0.0
+    done_steps = 0
+    resets = 0
+    while done_steps < steps:
+        started = time.perf_counter()
+        for action in actions[done_steps:]:
+            _, _, terminated, truncated, _ = env.step(action)
+            done_steps += 1
+            if terminated or truncated:
+                break
+        step_time += time.perf_counter() - started
+
+        if done_steps < steps:
+            env.reset()
+            resets += 1
+            actions[done_steps:] = make_actions(env, mix, steps - done_steps, rng)
+
+    return done_steps / step_time, resets
+
+
+def run_case(make_env, mix, steps, seed, alloc_steps, repeats):
+    rng = np.random.default_rng(seed)
+
+    started = time.perf_counter()
+    env = make_env()
+    construct_s = time.perf_counter() - started
+    env.reset(seed=seed)
+
+    # reset latency, the fastest reset is the least disturbed by the rest of the machine
+    reset_times = []
+    for _ in range(20):
+        started = time.perf_counter()
+        env.reset()
+        reset_times.append(time.perf_counter() - started)
+
+    # throughput, resets are not counted. The best of a few repeats is kept,
+    # the first repeat also warms up the caches.
+    steps_per_sec = 0.0
+    resets = 0
+    for _ in range(repeats):
+        env.reset()
+        rate, episode_resets = time_steps(env, mix, steps, rng)
+        steps_per_sec = max(steps_per_sec, rate)
+        resets += episode_resets
+
+    # allocations of single steps
+    env.reset()
+    actions = make_actions(env, mix, alloc_steps, rng)
+    alloc = []
+    tracemalloc.start()
+    for action in actions:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        _, _, terminated, truncated, _ = env.step(action)
+        _, peak = tracemalloc.get_traced_memory()
+        alloc.append(peak - before)
+        if terminated or truncated:
+            break
+    tracemalloc.stop()
+
+    return {
+        "steps_per_sec": steps_per_sec,
+        "reset_ms": 1000 * min(reset_times),
+        "construct_ms": 1000 * construct_s,
+        "alloc_bytes_per_step": float(np.mean(alloc)) if alloc else 0.0,
+        "episodes_reset": resets,
+    }
+
+
+def cases(quick):
+    sizes = QUICK_GRID_SIZES if quick else GRID_SIZES
+    densities = QUICK_BOX_DENSITIES if quick else BOX_DENSITIES
+
+    for map_name in MAPS:
+        for mix in ACTION_MIXES:
+            yield f"{map_name}/{mix}", {"map": map_name, "mix": mix}, lambda map_name=map_name: ShoverWorldEnv(None, map_name=map_name)
+
+    for size in sizes:
+        for density in densities:
+            for mix in ACTION_MIXES:
+                def make_env(size=size, density=density):
+                    with random_map_settings(size, density):
+                        return ShoverWorldEnv(None)
+                yield f"{size}x{size}/d{density}/{mix}", {"grid": size, "density": density, "mix": mix}, make_env
+
+
+def run(quick=False, steps=2000, seed=0, alloc_steps=200, repeats=3, verbose=True):
+    # warm up the map library, zobrist tables and interpreter caches before timing anything
+    name, params, make_env = next(cases(quick))
+    run_case(make_env, params["mix"], min(steps, 200), seed, 10, 1)
+
+    results = {}
+    for name, params, make_env in cases(quick):
+        result = run_case(make_env, params["mix"], steps, seed, alloc_steps, repeats)
+        results[name] = {**params, **result}
+        if verbose:
+            print(f"{name:<28} {result['steps_per_sec']:>10.0f} steps/s  reset {result['reset_ms']:>8.3f} ms  "
+                  f"{result['alloc_bytes_per_step']:>8.0f} B/step", file=sys.stderr)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "steps": steps,
+            "seed": seed,
+            "repeats": repeats,
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def startup_seconds(name, workers):
+    """
+        Wall time of starting `workers` fresh interpreters at once (like a spawned
+        process pool) that each run WORKER_STARTUP[name] and exit.
+    """
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, "-c", WORKER_STARTUP[name]], cwd=settings.Paths.BASE_DIR)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        if process.wait() != 0:
+            raise RuntimeError(f"worker start up of {name!r} failed")
+    return time.perf_counter() - started
+
+def startup(workers=(1, 8), repeats=3, verbose=True):
+    """ best start up time of every WORKER_STARTUP for each number of workers """
+    results = {}
+    for n in workers:
+        for name in WORKER_STARTUP:
+            seconds = min(startup_seconds(name, n) for _ in range(repeats))
+            results[f"{name}/{n}"] = {"module": name, "workers": n, "startup_ms": 1000 * seconds}
+            if verbose:
+                print(f"{name:<12} {n:>4} workers  {1000 * seconds:>9.1f} ms", file=sys.stderr)
+    return results
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+        Returns the regressions of `current` against `baseline`: cases with fewer
+        steps/sec, or slower resets, by more than `threshold`.
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+
+        if result["steps_per_sec"] < base["steps_per_sec"] * (1 - threshold):
+            regressions.append({"case": name, "metric": "steps_per_sec", "baseline": base["steps_per_sec"], "current": result["steps_per_sec"]})
+        if result["reset_ms"] > base["reset_ms"] * (1 + threshold):
+            regressions.append({"case": name, "metric": "reset_ms", "baseline": base["reset_ms"], "current": result["reset_ms"]})
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ShoverWorldEnv benchmarks")
+    parser.add_argument("--quick", action="store_true", help="smaller sweep of grid sizes and densities")
+    parser.add_argument("--steps", type=int, default=2000, help="steps timed per case")
+    parser.add_argument("--repeats", type=int, default=3, help="timed repeats per case, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a stored result file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown fraction")
+    parser.add_argument("--startup", type=int, nargs="+", metavar="WORKERS", help="only time the start up of that many worker processes")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        json.dump(startup(args.startup, args.repeats), sys.stdout, indent=2)
+        print()
+        return 0
+
+    current = run(quick=args.quick, steps=args.steps, seed=args.seed, repeats=args.repeats)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+    elif not args.compare:
+        json.dump(current, sys.stdout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(baseline, current, args.threshold)
+        json.dump({"regressions": regressions}, sys.stdout, indent=2)
+        print()
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
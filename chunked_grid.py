@@ -0,0 +1,251 @@
+"""
+    Grids of very large, mostly empty maps, stored as fixed-size tiles.
+
+        grid = ChunkedGrid.from_dense(map, tile_size=64)
+        grid[i, j], grid[i][j]           # cell values, like a numpy grid
+        grid[i, j] = Objects.Box1.value
+
+    Only the tiles with a non empty cell are allocated, and every tile keeps the
+    number of its boxes, barriers and non empty cells, so counting objects and
+    finding the boxes only look at the allocated tiles. copy() shares the tiles,
+    a tile is copied the first time either grid writes to it.
+"""
+import numpy as np
+from enums import Objects
+
+
+class _Row:
+    """ grid[i], so that grid[i][j] works like on a numpy grid """
+    __slots__ = ("grid", "i")
+
+    def __init__(self, grid, i):
+        self.grid = grid
+        self.i = i
+
+    def __getitem__(self, j):
+        return self.grid[self.i, j]
+
+    def __setitem__(self, j, value):
+        self.grid[self.i, j] = value
+
+    def __len__(self):
+        return self.grid.shape[1]
+
+
+class ChunkedGrid:
+    def __init__(self, shape, tile_size=64, dtype=np.int8):
+        if tile_size <= 0 or tile_size & (tile_size - 1):
+            raise ValueError(f"tile_size must be a power of two, got {tile_size}")
+
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype)
+        self.tile_size = tile_size
+        self._shift = tile_size.bit_length() - 1
+        self._mask = tile_size - 1
+
+        self.tiles = {} # (ti, tj) -> (tile_size, tile_size) array, only the tiles with a non empty cell
+        self._owned = set() # tiles not shared with a copy, written in place
+
+        n_ti = -(-self.shape[0] // tile_size)
+        n_tj = -(-self.shape[1] // tile_size)
+        self.filled = np.zeros((n_ti, n_tj), dtype=np.int32) # non empty cells of every tile
+        self.boxes = np.zeros((n_ti, n_tj), dtype=np.int32)
+        self.barriers = np.zeros((n_ti, n_tj), dtype=np.int32)
+
+        # cells of every tile inside the grid (the tiles of the last row and column can be cut)
+        rows = np.minimum(tile_size, self.shape[0] - tile_size * np.arange(n_ti))
+        cols = np.minimum(tile_size, self.shape[1] - tile_size * np.arange(n_tj))
+        self.area = rows[:, None] * cols[None, :]
+
+    @classmethod
+    def from_dense(cls, grid, tile_size=64, dtype=np.int8):
+        grid = np.asarray(grid)
+        chunked = cls(grid.shape, tile_size, dtype)
+        for (ti, tj), _ in np.ndenumerate(chunked.filled):
+            block = grid[ti * tile_size:(ti + 1) * tile_size, tj * tile_size:(tj + 1) * tile_size]
+            filled = int(np.count_nonzero(block))
+            if filled == 0:
+                continue
+            tile = np.zeros((tile_size, tile_size), dtype=dtype)
+            tile[:block.shape[0], :block.shape[1]] = block
+            chunked.tiles[ti, tj] = tile
+            chunked._owned.add((ti, tj))
+            chunked.filled[ti, tj] = filled
+            chunked.boxes[ti, tj] = np.count_nonzero((block >= Objects.Box1.value) & (block <= Objects.Box10.value))
+            chunked.barriers[ti, tj] = np.count_nonzero(block == Objects.Barrier.value)
+        return chunked
+
+    @classmethod
+    def random(cls, shape, boxes, lavas, barriers, rng, tile_size=64, dtype=np.int8):
+        """
+            A grid with exactly that many objects on distinct cells drawn from rng,
+            without ever making the dense grid.
+        """
+        n_rows, n_cols = shape
+        cells = n_rows * n_cols
+        n_objects = boxes + lavas + barriers
+        if n_objects > cells:
+            raise ValueError(f"{n_objects} objects do not fit in a {n_rows}x{n_cols} map")
+
+        positions = np.unique(rng.integers(0, cells, n_objects))
+        while len(positions) < n_objects:
+            positions = np.unique(np.concatenate([positions, rng.integers(0, cells, n_objects - len(positions))]))
+        positions = rng.permutation(positions)
+
+        grid = cls(shape, tile_size, dtype)
+        values = [Objects.Barrier.value] * barriers + [Objects.Box1.value] * boxes + [Objects.Lava.value] * lavas
+        for position, value in zip(positions.tolist(), values):
+            grid[divmod(position, n_cols)] = value
+        return grid
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            return _Row(self, key)
+        i, j = key
+        tile = self.tiles.get((i >> self._shift, j >> self._shift))
+        if tile is None:
+            return Objects.Empty.value
+        return int(tile[i & self._mask, j & self._mask])
+
+    def __setitem__(self, key, value):
+        i, j = int(key[0]), int(key[1])
+        value = int(value)
+        t = (i >> self._shift, j >> self._shift)
+        tile = self.tiles.get(t)
+        if tile is None:
+            if value == Objects.Empty.value:
+                return
+            tile = self.tiles[t] = np.zeros((self.tile_size, self.tile_size), dtype=self.dtype)
+            self._owned.add(t)
+        elif t not in self._owned:
+            tile = self.tiles[t] = tile.copy()
+            self._owned.add(t)
+
+        ti, tj = i & self._mask, j & self._mask
+        old = int(tile[ti, tj])
+        if old == value:
+            return
+        tile[ti, tj] = value
+        self._count(t, old, -1)
+        self._count(t, value, 1)
+
+        if self.filled[t] == 0:
+            del self.tiles[t]
+            self._owned.discard(t)
+
+    def _count(self, t, value, delta):
+        if value == Objects.Empty.value:
+            return
+        self.filled[t] += delta
+        if Objects.Box1.value <= value <= Objects.Box10.value:
+            self.boxes[t] += delta
+        elif value == Objects.Barrier.value:
+            self.barriers[t] += delta
+
+    def __array__(self, dtype=None, copy=None):
+        grid = self.to_dense()
+        return grid if dtype is None else grid.astype(dtype)
+
+    def to_dense(self):
+        """ the (H, W) numpy grid, as large as the map """
+        grid = np.zeros(self.shape, dtype=self.dtype)
+        for (ti, tj), tile, _, _ in self.iter_tiles():
+            block = grid[ti * self.tile_size:(ti + 1) * self.tile_size, tj * self.tile_size:(tj + 1) * self.tile_size]
+            block[...] = tile[:block.shape[0], :block.shape[1]]
+        return grid
+
+    def copy(self):
+        other = ChunkedGrid.__new__(ChunkedGrid)
+        other.__dict__.update(self.__dict__)
+        other.tiles = dict(self.tiles)
+        other._owned = set()
+        other.filled = self.filled.copy()
+        other.boxes = self.boxes.copy()
+        other.barriers = self.barriers.copy()
+        self._owned = set() # the tiles are shared now, both grids copy them before writing
+        return other
+
+    def iter_tiles(self, skip_barrier=False):
+        """
+            (ti, tj), tile array, top row, left column of every allocated tile. With
+            skip_barrier, the tiles that are barriers only are left out too.
+        """
+        for t, tile in self.tiles.items():
+            if skip_barrier and self.barriers[t] == self.area[t]:
+                continue
+            yield t, tile, t[0] * self.tile_size, t[1] * self.tile_size
+
+    def nonzero(self, tiles=None):
+        """
+            rows, columns and values of the non empty cells of the allocated tiles
+            (of `tiles` if given), with one numpy pass over the stacked tiles
+        """
+        keys = list(self.tiles) if tiles is None else list(tiles)
+        if not keys:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty.astype(self.dtype)
+        stacked = np.stack([self.tiles[t] for t in keys])
+        k, rows, cols = np.nonzero(stacked)
+        origins = np.array(keys, dtype=np.int64) * self.tile_size
+        return rows + origins[k, 0], cols + origins[k, 1], stacked[k, rows, cols]
+
+    def box_cells(self):
+        """ (i, j) of every box, only the tiles with boxes are looked at """
+        rows, cols, values = self.nonzero(t for t in self.tiles if self.boxes[t])
+        boxes = (values >= Objects.Box1.value) & (values <= Objects.Box10.value)
+        return list(zip(rows[boxes].tolist(), cols[boxes].tolist()))
+
+    def count_objects(self):
+        """ boxes, lavas, barriers """
+        boxes = int(self.boxes.sum())
+        barriers = int(self.barriers.sum())
+        return boxes, int(self.filled.sum()) - boxes - barriers, barriers
+
+    def ray(self, i, j, di, dj):
+        """
+            Copy of the cells from (i, j) in the direction (di, dj), up to the first cell
+            that is not a box or the border. Enough for a push, as long as the chain.
+        """
+        n_rows, n_cols = self.shape
+        values = []
+        while 0 <= i < n_rows and 0 <= j < n_cols:
+            value = self[i, j]
+            values.append(value)
+            if not Objects.Box1.value <= value <= Objects.Box10.value:
+                break
+            i, j = i + di, j + dj
+        return np.array(values, dtype=self.dtype)
+
+    def put_ray(self, i, j, di, dj, values):
+        """ writes values from (i, j) in the direction (di, dj) """
+        for k, value in enumerate(values.tolist()):
+            self[i + k*di, j + k*dj] = value
+
+    def nbytes(self):
+        """ bytes of the allocated tiles and the tile summaries """
+        tile_bytes = self.tile_size * self.tile_size * self.dtype.itemsize
+        return len(self.tiles) * tile_bytes + self.filled.nbytes + self.boxes.nbytes + self.barriers.nbytes + self.area.nbytes
+
+
+def changed_cells(grid, before):
+    """
+        (n, 2) cells that differ between grid and an earlier copy() of it. Tiles that
+        were not written since the copy are still shared, so they are skipped
+        without comparing them.
+    """
+    changed = []
+    for t in grid.tiles.keys() | before.tiles.keys():
+        tile, old = grid.tiles.get(t), before.tiles.get(t)
+        if tile is old:
+            continue
+        if tile is None:
+            tile = np.zeros_like(old)
+        if old is None:
+            old = np.zeros_like(tile)
+        changed.append(np.argwhere(tile != old) + (t[0] * grid.tile_size, t[1] * grid.tile_size))
+    if not changed:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.concatenate(changed)
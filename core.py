@@ -0,0 +1,758 @@
+"""
+    Simulation core of Shover-World: the rules, the state API and the
+    observations, with numpy as the only third party import. ShoverWorldEnv
+    (environment.py) is the gymnasium wrapper of it; process pool workers that
+    only step envs (rollouts, the solver, the vec env workers) use it directly
+    and skip importing gymnasium.
+"""
+import numpy as np
+from enums import Objects, Actions, Move_to_delta
+import settings
+from PerfectSquare import PerfectSquare, PerfectSquareRegistry
+from map_library import get_library
+import zobrist
+from profiling import StepProfiler
+import observation
+from action_mask import ActionMask
+from map_generator import MapGenerator
+from chunked_grid import ChunkedGrid
+
+# enum values and move deltas as plain ints, looked up on every step
+EMPTY = Objects.Empty.value
+LAVA = Objects.Lava.value
+BARRIER = Objects.Barrier.value
+BOX_MIN = Objects.Box1.value
+BOX_MAX = Objects.Box10.value
+BARRIER_MAKER = Actions.BarrierMaker.value
+HELLIFY = Actions.Hellify.value
+MOVE_DELTAS = {z: (int(delta[0]), int(delta[1])) for z, delta in Move_to_delta.items()}
+
+def env_seeds(seed, count):
+    """
+        `count` distinct map seeds spawned from one seed, for pools of envs that
+        would otherwise all be seeded with EnvironmentVars.seed and draw the same maps
+    """
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(count)]
+
+class EnvState:
+    """
+        Snapshot of everything step() depends on, made by ShoverWorldEnv.get_state().
+        The grid is shared with the environment that made or restored it (the
+        environment copies it before its next write), so snapshots are cheap.
+    """
+    __slots__ = (
+        "grid", "stamina", "timestep", "moving_positions", "last_z", "perfect_squares",
+        "terminated", "truncated", "counts", "dirty_cells", "grid_hash", "writes",
+    )
+
+    def __init__(self, grid, stamina, timestep, moving_positions, last_z, perfect_squares,
+                 terminated, truncated, counts, dirty_cells, grid_hash):
+        self.grid = grid
+        self.stamina = stamina
+        self.timestep = timestep
+        self.moving_positions = moving_positions
+        self.last_z = last_z
+        self.perfect_squares = perfect_squares # copy of the PerfectSquareRegistry
+        self.terminated = terminated
+        self.truncated = truncated
+        self.counts = counts
+        self.dirty_cells = dirty_cells
+        self.grid_hash = grid_hash
+        self.writes = [] # cell writes of the step that follows it, only used by the undo log
+
+class ShoverWorldCore:
+    """
+        The rules of Shover-World with reset(), step() and the state API of
+        ShoverWorldEnv, without gymnasium: no spaces and no rendering. The
+        settings are read once, by the constructor.
+    """
+
+    _np_random = None
+    _np_random_seed = None
+
+    def __init__(self, map_name=None, obs_buffer=None):
+        self.n_rows = settings.EnvironmentVars.n_rows
+        self.n_cols = settings.EnvironmentVars.n_cols
+        self.max_timestep = settings.EnvironmentVars.max_timestep
+        self.number_of_boxes = settings.EnvironmentVars.number_of_boxes
+        self.number_of_barriers = settings.EnvironmentVars.number_of_barriers
+        self.number_of_lavas = settings.EnvironmentVars.number_of_lavas
+        self.initial_stamina = settings.EnvironmentVars.initial_stamina
+        self.stamina = self.initial_stamina
+        self.initial_force = settings.EnvironmentVars.initial_force
+        self.unit_force = settings.EnvironmentVars.unit_force
+        self.perf_sq_initial_age = settings.EnvironmentVars.perf_sq_initial_age
+        self.map_path = settings.Paths.maps_path
+        self.seed = settings.EnvironmentVars.seed
+        self.debug = settings.EnvironmentVars.debug
+        self.hash_stamina_bucket = settings.EnvironmentVars.hash_stamina_bucket
+        self.grid_dtype = np.int8 if settings.EnvironmentVars.compact else int
+        self.observation = settings.EnvironmentVars.observation
+        self.chunked = settings.EnvironmentVars.grid_backend == "chunked"
+        self.tile_size = settings.EnvironmentVars.tile_size
+        if settings.EnvironmentVars.grid_backend not in ("dense", "chunked"):
+            raise ValueError(f"grid_backend must be 'dense' or 'chunked', got {settings.EnvironmentVars.grid_backend!r}")
+        if self.chunked and self.observation in ("record", "tensor"):
+            raise ValueError(f"{self.observation} observations need a dense grid, use grid_backend = 'dense'")
+        self.tensor_dtype = np.dtype(settings.EnvironmentVars.tensor_dtype)
+        self.timestep = 0
+        
+        self.map_name = map_name
+
+        self.moving_positions = {} # stored as {position, direction}
+        self.new_moving_positions = {}
+        self.stationary_move = False
+        self.reward = 0
+
+        self.perfect_squares = []
+        self.last_z = None
+
+        # cells changed since the last perfect square detection
+        self.dirty_cells = []
+        # (i, j, old, new) of every cell written since the last flush
+        self.writes = []
+
+        # observation deltas: the cell writes and squares since the last reported delta
+        self.deltas = settings.EnvironmentVars.deltas
+        self.delta_keyframe_every = settings.EnvironmentVars.delta_keyframe_every
+        self.delta_writes = []
+        self.delta_squares = set()
+        self.delta_resync = True # the next delta is a keyframe
+
+        self.box_count = 0
+        self.lava_count = 0
+        self.barrier_count = 0
+
+        self.push_chain_length = 0 # number of boxes moved by the last push
+
+        # zobrist hash of the grid, updated on every cell write
+        self.zobrist = None
+        self.grid_hash = 0
+
+        self.action_masker = None # ActionMask kept up to date once action_mask() was called
+        self.generator = None # MapGenerator of the random maps
+
+        self.map_shared = False # the grid is also held by a snapshot and has to be copied before writing
+        self.undo_log = None # list of EnvState when undo is recorded
+
+        # StepProfiler timing each phase of step() and reset(), None when not profiling
+        self.profiler = StepProfiler() if settings.EnvironmentVars.profile else None
+
+        # observations are written into this 0-d record when self.observation is "record"
+        self.obs_buffer = obs_buffer
+        # TensorObservation of the "tensor" observations, made by the first one
+        self.tensor = None
+
+        self.reset(seed=self.seed)
+
+    def step(self, action):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin("step")
+
+        this_step_reward = self._advance(action["position"], action["z"], profiler)
+
+        info = {
+            "box_count": self.box_count,
+            "push_chain_length": self.push_chain_length,
+            "state_hash": self.state_hash(),
+        }
+        if self.deltas:
+            info["delta"] = self.delta()
+        obs = self._get_obs()
+
+        if profiler is not None:
+            profiler.mark("finish")
+            info["perf"] = {"record": profiler.end(), "histograms": profiler.histograms}
+
+        return obs, this_step_reward, self.terminated, self.truncated, info
+
+    def step_many(self, actions, obs="final"):
+        """
+            Runs the (T, 3) (i, j, z) actions one after the other, stopping after the
+            step that terminates the episode. Rewards and stamina are the same as
+            calling step() for each action, but no observation or info is built
+            in between and the steps are not profiled.
+
+            obs: "final" for the observation after the last step, "grids" for the
+            (T', H, W) grids after each step, None for no observation.
+            returns obs, rewards, terminated, truncated (T' each, T' <= T), info
+        """
+        if obs not in ("final", "grids", None):
+            raise ValueError(f"obs must be 'final', 'grids' or None, got {obs!r}")
+
+        actions = np.asarray(actions, dtype=np.int64).reshape(-1, 3)
+        n = len(actions)
+        rewards = np.zeros(n, dtype=np.float64)
+        terminated = np.zeros(n, dtype=bool)
+        truncated = np.zeros(n, dtype=bool)
+        grids = np.empty((n, self.n_rows, self.n_cols), dtype=self.map.dtype) if obs == "grids" else None
+
+        t = 0
+        while t < n:
+            action = actions[t]
+            rewards[t] = self._advance(action[:2], int(action[2]), None)
+            terminated[t] = self.terminated
+            truncated[t] = self.truncated
+            if grids is not None:
+                grids[t] = self.map
+            t += 1
+            if self.terminated or self.truncated:
+                break
+
+        info = {"steps": t, "box_count": self.box_count, "state_hash": self.state_hash()}
+        if self.deltas:
+            info["delta"] = self.delta()
+        if obs == "grids":
+            result = grids[:t]
+        elif obs == "final":
+            result = self._get_obs()
+        else:
+            result = None
+        return result, rewards[:t], terminated[:t], truncated[:t], info
+
+    def _advance(self, position, z, profiler):
+        """ the transition of step(), returns the reward """
+        if self.map_shared:
+            self.map = self.map.copy()
+            self.map_shared = False
+        if self.undo_log is not None:
+            self.undo_log.append(self._capture(None))
+
+        self.last_z = z
+        self.push_chain_length = 0
+
+        if z == BARRIER_MAKER:
+            self._apply_barrier_maker_action()
+            self.moving_positions = {}
+        
+        elif z == HELLIFY:
+            self._apply_hellify_action()
+            self.moving_positions = {}
+
+        else: # Action of moving
+            res = self._apply_move_action(position, z)
+
+            i, j = position[0], position[1]
+            
+            if res == 3: # the head box was moved
+                if self.moving_positions.get((i,j)) != z:
+                    self.stamina -= self.initial_force
+                
+                di, dj = MOVE_DELTAS[z]
+                self.moving_positions = {(int(i) + di, int(j) + dj): z}
+
+                sq = self.perfect_squares.first_including(position)
+                if sq is not None:
+                    self.perfect_squares.remove(sq)
+                    # it can still be perfect, so it has to be found again
+                    self.dirty_cells.append(sq.start)
+            
+            else:
+                self.moving_positions = {}
+                self.stamina -= 1
+
+        if profiler is not None:
+            profiler.mark("action")
+            profiler.count("push_chain_length", self.push_chain_length)
+
+        self._flush_writes(profiler)
+
+        if profiler is not None:
+            profiler.mark("flush")
+            profiler.count("dirty_cells", len(self.dirty_cells))
+
+        # increase the age of all perfect squares
+        self.perfect_squares.tick()
+
+        if profiler is not None:
+            profiler.mark("ageing")
+
+        # find new perfect squres (only around the cells that changed)
+        new_perf_sqs = PerfectSquare.find_new_perfect_squares_around(self.map, self.dirty_cells, self.perfect_squares)
+        for sq in new_perf_sqs:
+            self.perfect_squares.add(sq)
+        self.dirty_cells = []
+
+        if profiler is not None:
+            profiler.mark("detection")
+            profiler.count("squares_found", len(new_perf_sqs))
+
+        # Automatic Dissolution of Perfect Squares
+        dissolved = 0
+        for sq in self.perfect_squares.pop_expired(self.perf_sq_initial_age):
+            self.map = sq.dissolute(self.map, self.writes)
+            dissolved += 1
+        self._flush_writes(profiler)
+
+        if profiler is not None:
+            profiler.mark("dissolution")
+            profiler.count("squares_dissolved", dissolved)
+        
+        self.timestep += 1
+
+        if self.debug:
+            self._check_counters()
+
+        if self._check_termination():
+            self.terminated = True
+            self.truncated = True
+
+        this_step_reward = self.reward
+        self.reward = 0
+        return this_step_reward
+
+    def _apply_barrier_maker_action(self):
+        sq = self.perfect_squares.oldest()
+        if sq is None:
+            self.stamina -= 1
+            return 
+        
+        self.map = sq.apply_barrier_maker(self.map, self.writes)
+        self.perfect_squares.remove(sq)
+        self.stamina += (sq.extend - 2)**2
+        self.reward = 10*(sq.extend - 2)**2
+
+    def _apply_hellify_action(self):
+        sq = self.perfect_squares.oldest(min_extend=5) # n > 2
+        if sq is None:
+            self.stamina -= 1
+            return
+        
+        self.map = sq.apply_hellify(self.map, self.writes)
+        self.perfect_squares.remove(sq)
+        self.stamina += (sq.extend - 2)**2
+
+    def _apply_move_action(self, position, action):
+        """
+            returns:
+                1 if there is lava (with award)
+                2 if there is a barrier or out of bound (cannot move)
+                3 if there was a box that is being moved now so it is empty (chain move)
+                4 if it was empty (invalid move)
+        """
+        
+        i, j = int(position[0]), int(position[1])
+        if self._out_of_bound(i,j):
+            return 2
+
+        value = self.map[i][j]
+        if value == BARRIER:
+            return 2
+        
+        if value == LAVA:
+            return 1
+
+        # if there is no box...
+        if BOX_MIN > value or value > BOX_MAX:
+            return 4
+
+        # the cells from the selected one to the border, in the moving direction
+        di, dj = MOVE_DELTAS[action]
+        ray = self._ray(i, j, di, dj)
+
+        boxes = (ray >= BOX_MIN) & (ray <= BOX_MAX)
+        chain_length = int(np.argmin(boxes)) if not boxes.all() else len(ray)
+
+        if chain_length == len(ray) or ray[chain_length] == BARRIER: # if we cannot move shit :|
+            return 2
+        
+        old = ray[:chain_length + 1].copy()
+        
+        # every box of the chain is pushed one cell ahead, the selected cell becomes empty
+        self.stamina -= self.unit_force * chain_length
+        if ray[chain_length] == LAVA:
+            # the last box is pushed into the lava, so its position would be empty and agent gains stamina
+            ray[1:chain_length] = old[:chain_length - 1]
+            self.stamina += self.initial_force
+            self.reward = self.initial_force
+        else:
+            ray[1:chain_length + 1] = old[:chain_length]
+        ray[0] = EMPTY
+
+        if self.chunked: # the ray is a copy
+            self.map.put_ray(i, j, di, dj, ray[:chain_length + 1])
+        for k in np.flatnonzero(ray[:chain_length + 1] != old):
+            self.writes.append((i + int(k)*di, j + int(k)*dj, int(old[k]), int(ray[k])))
+
+        self.push_chain_length = chain_length
+        return 3 # the box is pushed ahead, so now its position is empty
+
+    def _ray(self, i, j, di, dj):
+        """
+            view of the grid from (i, j) to the border in the direction (di, dj),
+            a copy up to the end of the chain on chunked grids
+        """
+        if self.chunked:
+            return self.map.ray(i, j, di, dj)
+        if di == 0:
+            return self.map[i, j::dj]
+        return self.map[i::di, j]
+
+    @property
+    def np_random(self):
+        """ Generator of the random maps, seeded by reset(seed=...) like gymnasium's """
+        if self._np_random is None:
+            self._np_random = np.random.default_rng()
+        return self._np_random
+
+    @np_random.setter
+    def np_random(self, value):
+        self._np_random = value
+
+    def reset(self, *, seed=None):
+        if seed is not None:
+            self._np_random = np.random.default_rng(seed)
+            self._np_random_seed = seed
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin("reset")
+        
+        self._load_map(self.map_name)
+        self.terminated = False
+        self.truncated = False
+
+        self.stamina = self.initial_stamina
+        self.timestep = 0
+        self.moving_positions = {}
+        self.last_z = None
+        self.reward = 0
+
+        if self.chunked: # every square has boxes inside, so only the tiles with boxes are looked at
+            squares = PerfectSquare.find_new_perfect_squares_around(self.map, self.map.box_cells(), [])
+        else:
+            squares = PerfectSquare.find_new_perfect_squares(self.map, [])
+        self.perfect_squares = PerfectSquareRegistry(squares)
+        self.dirty_cells = []
+        self.writes = []
+
+        if profiler is not None:
+            profiler.mark("detection")
+            profiler.count("squares_found", len(self.perfect_squares))
+
+        self.recount_objects()
+
+        self.map_shared = False
+        if self.undo_log is not None:
+            self.undo_log = []
+
+        info = {}
+        if self.deltas:
+            info["delta"] = self.delta()
+
+        if profiler is not None:
+            profiler.mark("counters")
+            info["perf"] = {"record": profiler.end(), "histograms": profiler.histograms}
+
+        return self._get_obs(), info
+    
+    def get_state(self):
+        """
+            Snapshot of the current state, to be given back to set_state().
+            The grid is not copied, self.map must not be written to directly afterwards.
+        """
+        self.map_shared = True
+        return self._capture(self.map)
+
+    def set_state(self, state):
+        self.map = state.grid
+        self.map_shared = True
+        if state.grid.shape != (self.n_rows, self.n_cols):
+            self.n_rows, self.n_cols = state.grid.shape
+            self.zobrist = self._zobrist_table()
+        self._restore(state)
+        if self.undo_log is not None:
+            self.undo_log = []
+
+    def record_undo(self, enabled=True):
+        """
+            Starts (or stops) keeping an undo log: each step stores the scalar state
+            and the cell writes it did, so undo() reverts it without copying the grid.
+        """
+        self.undo_log = [] if enabled else None
+
+    def undo(self):
+        """ reverts the last recorded step """
+        if not self.undo_log:
+            raise RuntimeError("nothing to undo" + ("" if self.undo_log is not None else ", call record_undo() first"))
+        state = self.undo_log.pop()
+        if self.map_shared:
+            self.map = self.map.copy()
+            self.map_shared = False
+
+        for i, j, old, new in reversed(state.writes):
+            self.map[i][j] = old
+        self._restore(state)
+
+    def _capture(self, grid):
+        return EnvState(
+            grid,
+            self.stamina,
+            self.timestep,
+            dict(self.moving_positions),
+            self.last_z,
+            self.perfect_squares.copy(),
+            self.terminated,
+            self.truncated,
+            (self.box_count, self.lava_count, self.barrier_count),
+            tuple(self.dirty_cells),
+            self.grid_hash,
+        )
+
+    def _restore(self, state):
+        self.stamina = state.stamina
+        self.timestep = state.timestep
+        self.moving_positions = dict(state.moving_positions)
+        self.last_z = state.last_z
+        self.perfect_squares = state.perfect_squares.copy()
+        self.terminated = state.terminated
+        self.truncated = state.truncated
+        self.box_count, self.lava_count, self.barrier_count = state.counts
+        self.dirty_cells = list(state.dirty_cells)
+        self.grid_hash = state.grid_hash
+        self.writes = []
+        self.reward = 0
+        self.action_masker = None
+        self.delta_writes = []
+        self.delta_resync = True
+        if self.tensor is not None:
+            self.tensor.stale = True
+
+    @property
+    def perfect_squares(self):
+        return self._perfect_squares
+
+    @perfect_squares.setter
+    def perfect_squares(self, squares):
+        """ accepts a PerfectSquareRegistry or any iterable of squares (kept in its order) """
+        if not isinstance(squares, PerfectSquareRegistry):
+            clock = self._perfect_squares.clock if hasattr(self, "_perfect_squares") else 0
+            squares = PerfectSquareRegistry(squares, clock)
+        self._perfect_squares = squares
+
+    def _check_termination(self):
+        if self.stamina <= 0:
+            return True
+        
+        if self.timestep >= self.max_timestep:
+            return True
+
+        # if there is no box left, the episode is terminated
+        return self.box_count == 0
+
+    def _flush_writes(self, profiler=None):
+        """
+            Applies the cell writes since the last flush to everything that is
+            maintained from the grid (object counters, zobrist hash, cells to re-detect).
+        """
+        if self.undo_log:
+            self.undo_log[-1].writes.extend(self.writes)
+        if self.deltas:
+            self.delta_writes.extend(self.writes)
+        if self.tensor is not None and not self.tensor.stale:
+            self.tensor.write_cells(self.writes)
+        if profiler is not None:
+            profiler.count("cells_touched", len(self.writes))
+        if self.action_masker is not None and self.writes:
+            self.action_masker.update(self.map, [(i, j) for i, j, _, _ in self.writes])
+
+        table = self.zobrist.table
+        cell_key = self.zobrist.cell_key
+        index = zobrist.VALUE_INDEX
+        for i, j, old, new in self.writes:
+            self._count_object(old, -1)
+            self._count_object(new, 1)
+            if table is not None:
+                self.grid_hash ^= int(table[i, j, index[old]] ^ table[i, j, index[new]])
+            else:
+                self.grid_hash ^= cell_key(i, j, old) ^ cell_key(i, j, new)
+            self.dirty_cells.append((i,j))
+        self.writes = []
+
+    def _count_object(self, value, delta):
+        if BOX_MIN <= value <= BOX_MAX:
+            self.box_count += delta
+        elif value == LAVA:
+            self.lava_count += delta
+        elif value == BARRIER:
+            self.barrier_count += delta
+
+    def recount_objects(self):
+        """
+            Counts the objects and hashes the grid from scratch. Has to be called
+            after writing to self.map directly instead of through step().
+        """
+        self.zobrist = self._zobrist_table()
+        self.grid_hash = self.zobrist.grid_hash(self.map)
+        self.action_masker = None
+        self.delta_writes = []
+        self.delta_resync = True
+        if self.tensor is not None:
+            self.tensor.stale = True
+        if self.chunked:
+            self.box_count, self.lava_count, self.barrier_count = self.map.count_objects()
+            return
+        self.box_count = int(((self.map >= Objects.Box1.value) & (self.map <= Objects.Box10.value)).sum())
+        self.lava_count = int((self.map == Objects.Lava.value).sum())
+        self.barrier_count = int((self.map == Objects.Barrier.value).sum())
+
+    def _zobrist_table(self):
+        if self.chunked or self.n_rows * self.n_cols > zobrist.TABLE_MAX_CELLS:
+            return zobrist.get_hashed_table(self.seed)
+        return zobrist.get_table(self.n_rows, self.n_cols, self.seed)
+
+    def _check_counters(self):
+        counts = (self.box_count, self.lava_count, self.barrier_count)
+        grid_hash = self.grid_hash
+        masker = self.action_masker
+        self.recount_objects()
+        if masker is not None:
+            if not np.array_equal(masker.mask[..., :4], ActionMask(self.map).mask[..., :4]):
+                raise RuntimeError("action mask out of sync")
+            self.action_masker = masker
+        if counts != (self.box_count, self.lava_count, self.barrier_count):
+            raise RuntimeError(
+                f"object counters out of sync: (boxes, lavas, barriers) was {counts}, "
+                f"grid has {(self.box_count, self.lava_count, self.barrier_count)}"
+            )
+        if grid_hash != self.grid_hash:
+            raise RuntimeError("zobrist hash of the grid out of sync")
+
+    def action_mask(self):
+        """
+            (H, W, 6) booleans, mask[i, j, z - 1] is true when the action (i, j, z)
+            moves something: a box whose push is not blocked, or a special action
+            with a perfect square to apply it to. The array is updated in place by
+            the next steps.
+        """
+        if self.action_masker is None:
+            self.action_masker = ActionMask(self.map)
+        mask = self.action_masker.mask
+        mask[:, :, BARRIER_MAKER - 1] = len(self.perfect_squares) > 0
+        mask[:, :, HELLIFY - 1] = self.perfect_squares.oldest(min_extend=5) is not None
+        return mask
+
+    def delta(self):
+        """
+            What changed since the last delta (reported in info["delta"] by reset(),
+            step() and step_many() when EnvironmentVars.deltas is on):
+                "changes"          (n, 4) int32 (i, j, old, new), one row per changed cell
+                "squares_added"    (i, j, extend) of the squares found
+                "squares_removed"  (i, j, extend) of the squares pushed, used or dissolved
+                "keyframe"         a copy of the grid every delta_keyframe_every steps and
+                                   after reset(), set_state() or undo(), None otherwise
+                "squares"          with a keyframe, (i, j, extend) of every live square
+        """
+        net = {}
+        for i, j, old, new in self.delta_writes:
+            first = net.get((i, j))
+            net[(i, j)] = (old if first is None else first[0], new)
+        self.delta_writes = []
+        changes = np.array([(i, j, old, new) for (i, j), (old, new) in net.items() if old != new], dtype=np.int32).reshape(-1, 4)
+
+        # a square found again after it was pushed comes back with a new birth
+        squares = {(sq.start_i, sq.start_j, sq.extend, sq.birth) for sq in self.perfect_squares}
+        added = sorted(sq[:3] for sq in squares - self.delta_squares)
+        removed = sorted(sq[:3] for sq in self.delta_squares - squares)
+        self.delta_squares = squares
+
+        keyframe = self.delta_resync or self.timestep % self.delta_keyframe_every == 0
+        self.delta_resync = False
+        return {
+            "timestep": self.timestep,
+            "changes": changes,
+            "squares_added": added,
+            "squares_removed": removed,
+            "keyframe": np.array(self.map) if keyframe else None,
+            "squares": sorted(sq[:3] for sq in squares) if keyframe else None,
+        }
+
+    def state_hash(self):
+        """
+            64-bit zobrist hash of the state: the grid, the stamina bucket, the
+            previous move and the live perfect squares with their ages.
+        """
+        h = self.grid_hash ^ zobrist.stamina_key(self.stamina, self.hash_stamina_bucket)
+        for position, z in self.moving_positions.items():
+            h ^= zobrist.moving_key(position, z)
+        for sq in self.perfect_squares:
+            h ^= zobrist.square_key(sq.start, sq.extend, self.perfect_squares.age(sq))
+        return h
+    
+    def _out_of_bound(self, i, j):
+        if i < 0 or i >= self.n_rows or j < 0 or j >= self.n_cols:
+            return True
+        return False 
+
+    def _load_map(self, map_name=None):
+        grid = None
+        if map_name:
+            # maps are parsed once per process and served from the packed map library
+            grid = get_library(self.map_path).get(map_name)
+
+        if grid is not None:
+            self.n_rows, self.n_cols = grid.shape
+            if self.chunked:
+                self.map = ChunkedGrid.from_dense(grid, self.tile_size)
+            else:
+                self.map = grid.astype(self.grid_dtype)
+            if self.profiler is not None:
+                self.profiler.mark("load_map")
+            
+        else:
+            self._generate_random_map()
+            if self.profiler is not None:
+                self.profiler.mark("generate_map")
+
+    def _generate_random_map(self):
+        if self.chunked:
+            self.map = ChunkedGrid.random(
+                (self.n_rows, self.n_cols), self.number_of_boxes, self.number_of_lavas, self.number_of_barriers,
+                self.np_random, self.tile_size,
+            )
+            return
+
+        if self.generator is None or self.generator.shape != (self.n_rows, self.n_cols):
+            self.generator = MapGenerator(
+                self.n_rows, self.n_cols,
+                boxes=self.number_of_boxes, lavas=self.number_of_lavas, barriers=self.number_of_barriers,
+                dtype=self.grid_dtype,
+            )
+
+        # drawn from the generator seeded by reset(seed=...), settings.EnvironmentVars.seed at construction
+        self.map = self.generator.generate(1, self.np_random)[0]
+
+    def set_obs_buffer(self, buffer):
+        """ 0-d record (e.g. replay[t, ...]) the next observations are written into """
+        if buffer.shape != () or buffer.dtype != self._record_dtype():
+            raise ValueError(f"observation buffer must be a 0-d array of {self._record_dtype()}")
+        self.obs_buffer = buffer
+
+    def _record_dtype(self):
+        return observation.record_dtype(self.n_rows, self.n_cols, self.map.dtype)
+
+    def _get_obs(self):
+        if self.observation == "record":
+            if self.obs_buffer is None or self.obs_buffer.dtype["grid"].shape != self.map.shape:
+                self.obs_buffer = np.zeros((), dtype=self._record_dtype())
+            return observation.write_record(self.obs_buffer, self.map, self.stamina, self.moving_positions, self.last_z)
+
+        if self.observation == "tensor":
+            # the same planes are returned every step and updated in place
+            if self.tensor is None or self.tensor.planes.shape[1:] != self.map.shape:
+                self.tensor = observation.TensorObservation(self.map.shape, self.tensor_dtype, self.perf_sq_initial_age)
+            if self.tensor.stale:
+                self.tensor.rebuild(self.map, self.perfect_squares)
+            else:
+                self.tensor.sync_squares(self.perfect_squares)
+            return self.tensor.planes
+
+        obs = {
+            "grid": self.map,
+            "stamina": np.array(self.stamina, dtype=np.int64),
+            "previous_selected_position": np.array(next(iter(self.moving_positions), (-1, -1)), dtype=np.int64),
+            "previous_action": self.last_z or 0, # 0 stands for None
+        }
+
+        return obs
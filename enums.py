@@ -62,4 +62,46 @@ def is_perfect_square(map, start, extend):
             if not is_box(map[start_i+i][start_j+j]):
                 return False
     
-    return True
\ No newline at end of file
+    return True
+
+def box_block_corner(map, cell):
+    """
+        Walks up and left from a box to the corner of the box block it belongs to,
+        and returns the start of the perfect square that block would be the inside of.
+    """
+    i, j = cell
+
+    top = i
+    while top > 0 and is_box(map[top-1][j]):
+        top -= 1
+    
+    left = j
+    while left > 0 and is_box(map[i][left-1]):
+        left -= 1
+    
+    return (top-1, left-1)
+
+def perfect_square_extend(map, start):
+    """
+        The inside of a perfect square is a box block closed by empty cells, so the
+        only extend a square at `start` can have is 2 + the boxes right of (i+1, j+1).
+        returns that extend if it is a perfect square, None otherwise
+    """
+    n = len(map)
+    m = len(map[0])
+    start_i, start_j = start
+
+    if start_i < 0 or start_j < 0 or start_i + 1 >= n:
+        return None
+    
+    extend = 2
+    while start_j + extend - 1 < m and is_box(map[start_i+1][start_j+extend-1]):
+        extend += 1
+    
+    if extend < 4 or start_i + extend > n or start_j + extend > m:
+        return None
+
+    if is_perfect_square(map, start, extend):
+        return extend
+    return None
+
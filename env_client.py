@@ -0,0 +1,86 @@
+"""
+    Client of an EnvServer (env_server.py): one env of its pool with the
+    gymnasium step/reset API. Kept apart from the server so that hosting the
+    pool does not import gymnasium.
+"""
+import json
+import socket
+import gymnasium as gym
+from gymnasium import spaces
+import numpy as np
+from enums import Actions
+import observation
+import observation_spaces
+from env_server import HEADER, RESPONSE, STEP_PAYLOAD, RESET_PAYLOAD, SHAPE_PAYLOAD, OPEN, STEP, RESET, METRICS, ERROR
+
+
+class EnvClient(gym.Env):
+    """
+        Blocking client of one env of an EnvServer, with the gymnasium step/reset API.
+        Observations are records of observation.record_dtype(). step_async() and
+        step_wait() send a step without waiting for its response.
+    """
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self._file = self.sock.makefile("rb")
+
+        self.sock.sendall(HEADER.pack(OPEN, 0))
+        _, self.env_id, payload = self._receive()
+        n_rows, n_cols = SHAPE_PAYLOAD.unpack(payload)
+
+        self.observation_space = observation_spaces.RecordSpace(observation.record_dtype(n_rows, n_cols, np.int8))
+        self.action_space = spaces.Dict({
+            "position": spaces.MultiDiscrete([n_rows, n_cols]),
+            "z": spaces.Discrete(len(Actions), start=1)
+        })
+
+    def reset(self, *, seed=None, options=None):
+        self.sock.sendall(HEADER.pack(RESET, self.env_id) + RESET_PAYLOAD.pack(-1 if seed is None else seed))
+        (_, _, _), _, payload = self._receive()
+        return self._obs(payload), {}
+
+    def step(self, action):
+        self.step_async(action)
+        return self.step_wait()
+
+    def step_async(self, action):
+        i, j = action["position"]
+        self.sock.sendall(HEADER.pack(STEP, self.env_id) + STEP_PAYLOAD.pack(int(i), int(j), int(action["z"])))
+
+    def step_wait(self):
+        (reward, terminated, truncated), _, payload = self._receive()
+        return self._obs(payload), reward, bool(terminated), bool(truncated), {}
+
+    def metrics(self):
+        self.sock.sendall(HEADER.pack(METRICS, self.env_id))
+        _, _, payload = self._receive()
+        return json.loads(payload)
+
+    def close(self):
+        if self.sock is not None:
+            self._file.close()
+            self.sock.close()
+            self.sock = None
+
+    def _receive(self):
+        op, env_id, reward, terminated, truncated, size = RESPONSE.unpack(self._read(RESPONSE.size))
+        payload = self._read(size)
+        if op == ERROR:
+            raise RuntimeError(f"env server: {payload.decode()}")
+        return (reward, terminated, truncated), env_id, payload
+
+    def _read(self, size):
+        data = self._file.read(size)
+        if len(data) < size:
+            raise ConnectionError("env server closed the connection")
+        return data
+
+    def _obs(self, payload):
+        return np.frombuffer(payload, dtype=self.observation_space.dtype).reshape(())
@@ -0,0 +1,251 @@
+"""
+    A pool of ShoverWorldEnv served over a Unix socket or localhost TCP, so that
+    actor processes step shared environments instead of hosting their own.
+
+        python3 env_server.py --unix /tmp/shover.sock --num-envs 64 --map map2.txt
+
+        env = EnvClient("/tmp/shover.sock")     # env_client.py, or EnvClient(("127.0.0.1", 5555))
+        obs, info = env.reset(seed=0)
+        obs, reward, terminated, truncated, info = env.step({"position": (1, 2), "z": 3})
+
+    Frames are little endian:
+        request   op u8, env_id u32, then STEP: i i16, j i16, z i8 | RESET: seed i64 (-1 for none)
+        response  op u8, env_id u32, reward f32, terminated u8, truncated u8, payload size u32, payload
+    The payload of STEP and RESET is the observation as one record of
+    observation.record_dtype() with an int8 grid. OPEN claims a free env of the
+    pool (payload: rows i16, cols i16), RELEASE gives it back, METRICS returns the
+    server metrics as JSON and ERROR carries a message.
+
+    The requests of all clients go through one queue. Every batch takes what is
+    queued (up to max_batch), steps the envs one after the other and sends the
+    responses of each client with a single write. A client with max_pending
+    unanswered requests, or whose responses are not read, is not read from until
+    it catches up.
+"""
+import argparse
+import asyncio
+import json
+import struct
+import time
+import numpy as np
+import settings
+import observation
+from profiling import RollingHistogram
+
+OPEN, RELEASE, RESET, STEP, METRICS, ERROR = range(1, 7)
+
+HEADER = struct.Struct("<BI")
+STEP_PAYLOAD = struct.Struct("<hhb")
+RESET_PAYLOAD = struct.Struct("<q")
+SHAPE_PAYLOAD = struct.Struct("<hh")
+RESPONSE = struct.Struct("<BIfBBI")
+
+PAYLOAD_SIZE = {OPEN: 0, RELEASE: 0, RESET: RESET_PAYLOAD.size, STEP: STEP_PAYLOAD.size, METRICS: 0}
+
+
+class _Connection:
+    """ a client of the server, with its envs and latency metrics """
+
+    def __init__(self, writer, max_pending, window):
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.pending = asyncio.Semaphore(max_pending)
+        self.envs = set()
+        self.requests = 0
+        self.latency = RollingHistogram(window) # microseconds from reading a request to writing its response
+
+    def metrics(self):
+        return {"requests": self.requests, "envs": sorted(self.envs), "latency_us": self.latency.summary()}
+
+
+class EnvServer:
+    """
+        Hosts num_envs ShoverWorldEnv on map_name (random maps when None). Start it
+        with start_unix() or start_tcp() inside a running event loop, or use serve().
+    """
+
+    def __init__(self, num_envs, map_name=None, max_batch=256, max_pending=64, queue_size=4096, batch_window=0.0, window=1000):
+        from core import ShoverWorldCore, env_seeds
+
+        self.envs = [ShoverWorldCore(map_name=map_name) for _ in range(num_envs)]
+        for env, seed in zip(self.envs, env_seeds(settings.EnvironmentVars.seed, num_envs)):
+            env.reset(seed=seed)
+        self.owners = [None] * num_envs
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.queue_size = queue_size
+        self.batch_window = batch_window # seconds to wait for more requests before stepping a batch
+        self.window = window
+
+        n_rows, n_cols = self.envs[0].map.shape
+        self.record = np.zeros((), dtype=observation.record_dtype(n_rows, n_cols, np.int8))
+
+        self.connections = []
+        self.batches = 0
+        self.batched_requests = 0
+        self.batch_sizes = RollingHistogram(window, edges=np.array([0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, np.inf]))
+        self._queue = None
+        self._server = None
+        self._batcher = None
+
+    async def start_unix(self, path):
+        self._start()
+        self._server = await asyncio.start_unix_server(self._handle, path)
+        return self._server
+
+    async def start_tcp(self, host="127.0.0.1", port=0):
+        self._start()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    def _start(self):
+        self._queue = asyncio.Queue(self.queue_size)
+        self._batcher = asyncio.create_task(self._run_batches())
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # closing the transports ends the readers of the remaining clients
+        tasks = [connection.task for connection in self.connections]
+        for connection in self.connections:
+            connection.writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._batcher is not None:
+            self._batcher.cancel()
+
+    def metrics(self):
+        return {
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_sizes.summary(),
+            "envs_in_use": sum(owner is not None for owner in self.owners),
+            "clients": [connection.metrics() for connection in self.connections],
+        }
+
+    async def _handle(self, reader, writer):
+        connection = _Connection(writer, self.max_pending, self.window)
+        self.connections.append(connection)
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                op, env_id = HEADER.unpack(header)
+                payload = await reader.readexactly(PAYLOAD_SIZE.get(op, 0))
+
+                # backpressure: stop reading while the client's responses are not read or too many are pending
+                await writer.drain()
+                await connection.pending.acquire()
+                await self._queue.put((connection, op, env_id, payload, time.perf_counter()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for env_id in connection.envs:
+                self.owners[env_id] = None
+            connection.envs.clear()
+            self.connections.remove(connection)
+            writer.close()
+
+    async def _run_batches(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_window:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            self._process(batch)
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.batch_sizes.add(len(batch))
+            await asyncio.sleep(0) # let the readers queue the next requests
+
+    def _process(self, batch):
+        """ runs the requests of a batch in order, then writes the responses of every client at once """
+        responses = {}
+        for connection, op, env_id, payload, received in batch:
+            try:
+                frame = self._run(connection, op, env_id, payload)
+            except Exception as error:
+                message = f"{type(error).__name__}: {error}".encode()
+                frame = RESPONSE.pack(ERROR, env_id, 0.0, 0, 0, len(message)) + message
+            responses.setdefault(connection, []).append(frame)
+            connection.requests += 1
+
+        now = time.perf_counter()
+        for connection, frames in responses.items():
+            if not connection.writer.is_closing():
+                connection.writer.write(b"".join(frames))
+            for _ in frames:
+                connection.pending.release()
+        for connection, op, env_id, payload, received in batch:
+            connection.latency.add((now - received) * 1e6)
+
+    def _run(self, connection, op, env_id, payload):
+        if op == OPEN:
+            env_id = self.owners.index(None) if None in self.owners else None
+            if env_id is None:
+                raise RuntimeError(f"all {len(self.envs)} envs are in use")
+            self.owners[env_id] = connection
+            connection.envs.add(env_id)
+            shape = SHAPE_PAYLOAD.pack(*self.envs[env_id].map.shape)
+            return RESPONSE.pack(OPEN, env_id, 0.0, 0, 0, len(shape)) + shape
+
+        if op == METRICS:
+            metrics = json.dumps(self.metrics()).encode()
+            return RESPONSE.pack(METRICS, env_id, 0.0, 0, 0, len(metrics)) + metrics
+
+        if op not in PAYLOAD_SIZE:
+            raise ValueError(f"unknown op {op}")
+        if env_id >= len(self.envs) or self.owners[env_id] is not connection:
+            raise ValueError(f"env {env_id} is not open on this connection")
+        env = self.envs[env_id]
+
+        if op == RELEASE:
+            self.owners[env_id] = None
+            connection.envs.discard(env_id)
+            return RESPONSE.pack(RELEASE, env_id, 0.0, 0, 0, 0)
+
+        if op == RESET:
+            seed, = RESET_PAYLOAD.unpack(payload)
+            env.reset(seed=None if seed < 0 else seed)
+            reward = 0.0
+        else:
+            i, j, z = STEP_PAYLOAD.unpack(payload)
+            _, reward, _, _, _ = env.step({"position": np.array([i, j]), "z": z})
+
+        obs = observation.write_record(self.record, env.map, env.stamina, env.moving_positions, env.last_z).tobytes()
+        return RESPONSE.pack(op, env_id, reward, env.terminated, env.truncated, len(obs)) + obs
+
+
+def serve(num_envs, unix=None, host="127.0.0.1", port=0, map_name=None, **kwargs):
+    """ runs an EnvServer until interrupted """
+    async def main():
+        server = EnvServer(num_envs, map_name, **kwargs)
+        listener = await (server.start_unix(unix) if unix else server.start_tcp(host, port))
+        for sock in listener.sockets:
+            print(f"serving {num_envs} envs on {sock.getsockname()}", flush=True)
+        try:
+            await listener.serve_forever()
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ShoverWorldEnv pool server")
+    parser.add_argument("--unix", help="Unix socket path (default: localhost TCP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--num-envs", type=int, default=64)
+    parser.add_argument("--map", dest="map_name", help="map file for every env (default: random maps)")
+    parser.add_argument("--max-batch", type=int, default=256, help="requests stepped per batch")
+    parser.add_argument("--max-pending", type=int, default=64, help="unanswered requests per client before it is not read")
+    args = parser.parse_args(argv)
+
+    serve(args.num_envs, args.unix, args.host, args.port, args.map_name, max_batch=args.max_batch, max_pending=args.max_pending)
+
+
+if __name__ == "__main__":
+    main()
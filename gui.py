@@ -4,12 +4,11 @@ from typing import Tuple
 import numpy as np
 import settings
 from environment import ShoverWorldEnv
-from enums import Actions, is_box
+from enums import Actions, Objects
+from rendering import tile_color
+from chunked_grid import ChunkedGrid, changed_cells
+from rollout import legal_policy
 
-COLOR_EMPTY = settings.GuiVars.COLOR_EMPTY
-COLOR_BARRIER = settings.GuiVars.COLOR_BARRIER
-COLOR_LAVA = settings.GuiVars.COLOR_LAVA
-BOX_COLORS = settings.GuiVars.BOX_COLORS
 HUD_BG = settings.GuiVars.HUD_BG
 HUD_TEXT = settings.GuiVars.HUD_TEXT
 GRID_LINE = settings.GuiVars.GRID_LINE
@@ -53,9 +52,16 @@ class GuiRenderer:
         # flag: whether the user requested quit
         self._quit = False
 
-        # font sizes will be set after knowing cell size
-        self.font = pygame.font.SysFont("Arial", 18)
-        self.big_font = pygame.font.SysFont("Arial", 20, bold=True)
+        # fonts are created once, the number font per cell size
+        hud_font_size = max(14, min(28, HUD_HEIGHT - 8))
+        self.big_font = pygame.font.SysFont("Arial", hud_font_size, bold=True)
+        self._fonts = {}
+        self.font = None
+
+        self.cell_size = None
+        self._tiles = {} # (cell value, cell size) -> pre-rendered tile surface
+        self._drawn = None # grid as it is on the screen, None when the screen has to be redrawn
+        self._hud_text = None
 
     def _ensure_screen(self, grid_shape):
         """
@@ -77,76 +83,113 @@ class GuiRenderer:
         win_w = cell_size * ncols
         win_h = cell_size * nrows + HUD_HEIGHT
 
-        # create or update screen
-        if self.screen is None:
+        # create or update screen, everything is drawn again on a new one
+        if self.screen is None or self.screen.get_width() != win_w or self.screen.get_height() != win_h:
             self.screen = pygame.display.set_mode((win_w, win_h))
-        else:
-            # if size changed, recreate window surface
-            if self.screen.get_width() != win_w or self.screen.get_height() != win_h:
-                self.screen = pygame.display.set_mode((win_w, win_h))
+            self._drawn = None
 
         self.cell_size = cell_size
         self.grid_origin = (0, HUD_HEIGHT)
         self.grid_size_px = (win_w, win_h - HUD_HEIGHT)
 
-        # set fonts sized relative to cell
         # number font should be readable inside a cell
         num_font_size = max(12, min(24, cell_size // 2))
-        hud_font_size = max(14, min(28, HUD_HEIGHT - 8))
-        self.font = pygame.font.SysFont("Arial", num_font_size)
-        self.big_font = pygame.font.SysFont("Arial", hud_font_size, bold=True)
+        if num_font_size not in self._fonts:
+            self._fonts[num_font_size] = pygame.font.SysFont("Arial", num_font_size)
+        self.font = self._fonts[num_font_size]
+
+    def _tile(self, value):
+        """ surface of a cell, rendered once per value and cell size """
+        key = (int(value), self.cell_size)
+        tile = self._tiles.get(key)
+        if tile is None:
+            cs = self.cell_size
+            tile = pygame.Surface((cs, cs))
+            tile.fill(tile_color(value))
+            # optional grid lines
+            if self.show_grid_lines:
+                pygame.draw.rect(tile, GRID_LINE, tile.get_rect(), 1)
+            tile = self._tiles[key] = tile.convert()
+        return tile
+
+    def _block(self, value, tile_size):
+        """ surface of a whole grid tile of one value, rendered once per value and cell size """
+        key = (int(value), self.cell_size, tile_size)
+        block = self._tiles.get(key)
+        if block is None:
+            cs = self.cell_size
+            tile = self._tile(value)
+            block = pygame.Surface((tile_size * cs, tile_size * cs)).convert()
+            block.blits([(tile, (c * cs, r * cs)) for r in range(tile_size) for c in range(tile_size)], doreturn=False)
+            self._tiles[key] = block
+        return block
+
+    def _draw_chunked(self, grid):
+        """
+            Full frame of a ChunkedGrid, as rendering.render_chunked() does it: every
+            tile starts as empty cells, the tiles that are barriers only are one
+            blit, and the cells to draw one by one (returned) are the objects of
+            the other allocated tiles.
+        """
+        cs = self.cell_size
+        gx, gy = self.grid_origin
+        size = grid.tile_size * cs
+        empty = self._block(0, grid.tile_size)
+        barrier = self._block(Objects.Barrier.value, grid.tile_size)
+
+        n_ti, n_tj = grid.area.shape
+        self.screen.blits([(empty, (gx + tj * size, gy + ti * size)) for ti in range(n_ti) for tj in range(n_tj)], doreturn=False)
+        self.screen.blits([(barrier, (gx + left * cs, gy + top * cs)) for t, _, top, left in grid.iter_tiles()
+                           if grid.barriers[t] == grid.area[t]], doreturn=False)
+
+        rows, cols, _ = grid.nonzero(t for t, _, _, _ in grid.iter_tiles(skip_barrier=True))
+        return zip(rows.tolist(), cols.tolist())
 
     def render(self, env) -> None:
         grid = env.map
-        if not isinstance(grid, np.ndarray) or grid.ndim != 2:
-            raise ValueError("env.grid must be a 2D numpy array")
+        chunked = isinstance(grid, ChunkedGrid)
+        if not chunked and (not isinstance(grid, np.ndarray) or grid.ndim != 2):
+            raise ValueError("env.grid must be a 2D numpy array or a ChunkedGrid")
 
-        self._ensure_screen(grid.shape)
+        full = self._drawn is None or self._drawn.shape != grid.shape
+        if full:
+            self._ensure_screen(grid.shape)
         surf = self.screen
-        surf.fill((0, 0, 0))  # background
-
-        # Draw HUD background
-        pygame.draw.rect(
-            surf, HUD_BG, pygame.Rect(0, 0, surf.get_width(), HUD_HEIGHT)
-        )
+        rects = []
 
-        # Draw HUD text (stamina, timestep)
+        # HUD (stamina, timestep), drawn again only when its text changes
         stamina_text = f"Stamina: {getattr(env, 'stamina', '?')}"
         timestep_text = f"Timestep: {getattr(env, 'timestep', '?')}"
-        
-        hud_surface = self.big_font.render(stamina_text + "   |   " + timestep_text, True, HUD_TEXT)
-        surf.blit(hud_surface, (8, (HUD_HEIGHT - hud_surface.get_height()) // 2))
-
-        # draw grid cells
-        nrows, ncols = grid.shape
+        hud_text = stamina_text + "   |   " + timestep_text
+        if full or hud_text != self._hud_text:
+            hud_rect = pygame.Rect(0, 0, surf.get_width(), HUD_HEIGHT)
+            pygame.draw.rect(surf, HUD_BG, hud_rect)
+            hud_surface = self.big_font.render(hud_text, True, HUD_TEXT)
+            surf.blit(hud_surface, (8, (HUD_HEIGHT - hud_surface.get_height()) // 2))
+            self._hud_text = hud_text
+            rects.append(hud_rect)
+
+        # grid cells, only the ones that changed since the last frame
         cs = self.cell_size
         gx, gy = self.grid_origin
+        if full and chunked:
+            cells = self._draw_chunked(grid)
+        elif full:
+            surf.fill((0, 0, 0), pygame.Rect(gx, gy, *self.grid_size_px))  # background
+            cells = np.argwhere(np.ones(grid.shape, dtype=bool))
+        elif chunked:
+            cells = changed_cells(grid, self._drawn)
+        else:
+            cells = np.argwhere(grid != self._drawn)
 
-        for r in range(nrows):
-            for c in range(ncols):
-                val = grid[r, c]
-                rect = pygame.Rect(gx + c * cs, gy + r * cs, cs, cs)
-                # choose color based on tile value
-                if val == 0:
-                    color = COLOR_EMPTY
-                elif val == 100:
-                    color = COLOR_BARRIER
-                elif val == -100:
-                    color = COLOR_LAVA
-                elif 1 <= val <= 1000:  # treat 1..10 and others as boxes (use modulo palette)
-                    # box index might be >10; map it
-                    idx = int(val - 1) % len(BOX_COLORS)
-                    color = BOX_COLORS[idx]
-                else:
-                    color = COLOR_EMPTY
-
-                pygame.draw.rect(surf, color, rect)
-
-                # optional grid lines
-                if self.show_grid_lines:
-                    pygame.draw.rect(surf, GRID_LINE, rect, 1)
+        for r, c in cells:
+            rects.append(surf.blit(self._tile(grid[r, c]), (gx + c * cs, gy + r * cs)))
+        self._drawn = grid.copy()
 
-        pygame.display.flip()
+        if full:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
         # tick FPS
         self.clock.tick(self.fps)
 
@@ -209,6 +252,7 @@ class GuiRenderer:
 def main():
     env = ShoverWorldEnv("human", map_name="map2.txt")
     env.reset()
+    rng = np.random.default_rng()
     
     renderer = GuiRenderer(window_max_size=(900, 700), fps=30, grid_h=env.n_rows, grid_w=env.n_cols)
 
@@ -227,11 +271,8 @@ def main():
                 print(action)
                 obs, reward, terminated, truncated, info = env.step(action)
             
-            elif agent_control: # random agent
-                while True:
-                    action = env.action_space.sample()
-                    if is_box(env.map[action["position"][0]][action["position"][1]]):
-                        break
+            elif agent_control: # random agent, among the actions that move something
+                action = legal_policy(env, rng)
                 print(action)
                 obs, reward, terminated, truncated, info = env.step(action)
             
@@ -0,0 +1,211 @@
+"""
+    Seeded, vectorized generation of random maps.
+
+        generator = MapGenerator(32, 32, boxes=0.2, lavas=0.02, barriers=0.02, require_push=True)
+        grids = generator.generate(100_000, np.random.default_rng(0)) # (100000, 32, 32) int8
+        generator.write_pack("generated.pack", 1_000_000, np.random.default_rng(0))
+"""
+import numpy as np
+from enums import Objects
+from square_detection import box_mask
+from map_library import write_pack
+
+LUT_SIZE = 1 << 16 # resolution of the densities
+
+
+class MapGenerator:
+    """
+        Generates batches of n_rows x n_cols maps from a np.random.Generator.
+
+        `boxes`, `lavas` and `barriers` are exact counts when they are all ints:
+        every map gets that many of each object. Otherwise they are densities
+        (an int is turned into count / cells) and each cell is drawn on its own,
+        which is a single table lookup per cell.
+
+        Boxes are drawn uniformly from `box_types`. `squares` perfect square
+        candidates per map are planted too: an empty border around a block of
+        boxes, with an extend drawn from `square_extends` (4 is the smallest
+        square the env detects). With exact counts the squares are planted first
+        and the counted objects go around them, so the counts stay exact; the
+        boxes of the squares come on top. With densities they are planted over
+        the drawn cells. With `require_push`, maps where no box can be pushed
+        are drawn again.
+    """
+
+    def __init__(
+            self,
+            n_rows,
+            n_cols,
+            boxes=2,
+            lavas=2,
+            barriers=2,
+            box_types=(Objects.Box1.value,),
+            squares=0,
+            square_extends=(4, 5),
+            require_push=False,
+            dtype=np.int8,
+            chunk_size=16384
+        ):
+        self.shape = (n_rows, n_cols)
+        self.box_types = np.asarray(box_types, dtype=dtype)
+        self.squares = squares
+        self.square_extends = square_extends
+        self.require_push = require_push
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+
+        cells = n_rows * n_cols
+        counts = (barriers, boxes, lavas)
+        self.exact = all(isinstance(count, (int, np.integer)) for count in counts)
+        if self.exact:
+            self.counts = tuple(int(count) for count in counts)
+            if sum(self.counts) > cells:
+                raise ValueError(f"{sum(self.counts)} objects do not fit in a {n_rows}x{n_cols} map")
+        else:
+            densities = [count / cells if isinstance(count, (int, np.integer)) else count for count in counts]
+            if sum(densities) > 1:
+                raise ValueError(f"densities {densities} add up to more than 1")
+
+            # cell value of every 16-bit random number
+            bounds = np.round(np.cumsum(densities) * LUT_SIZE).astype(int)
+            self.lut = np.zeros(LUT_SIZE, dtype=dtype)
+            self.lut[:bounds[0]] = Objects.Barrier.value
+            self.lut[bounds[0]:bounds[1]] = -1 # box, its type is drawn after
+            self.lut[bounds[1]:bounds[2]] = Objects.Lava.value
+            if len(self.box_types) == 1:
+                self.lut[self.lut == -1] = self.box_types[0]
+
+        if squares and max(square_extends) > min(self.shape):
+            raise ValueError(f"square extends {square_extends} do not fit in a {n_rows}x{n_cols} map")
+        if squares and self.exact and sum(self.counts) + squares * max(square_extends) ** 2 > cells:
+            raise ValueError(f"{sum(self.counts)} objects and {squares} squares do not fit in a {n_rows}x{n_cols} map")
+
+    def generate(self, count, rng):
+        """ (count, n_rows, n_cols) array of maps """
+        if count <= self.chunk_size:
+            return self._generate(count, rng)
+        return np.concatenate(list(self.iter_chunks(count, rng)))
+
+    def iter_chunks(self, count, rng):
+        """ the maps of generate(), in batches of at most chunk_size """
+        for start in range(0, count, self.chunk_size):
+            yield self._generate(min(self.chunk_size, count - start), rng)
+
+    def write_pack(self, pack_path, count, rng, prefix="map"):
+        """
+            Streams `count` generated maps into a map pack (the format of the map library),
+            named prefix_0000000, prefix_0000001, ...; read them back with map_library.MapPack.
+        """
+        n_rows, n_cols = self.shape
+        width = max(7, len(str(count - 1)))
+        index = {
+            f"{prefix}_{k:0{width}d}": {"rows": n_rows, "cols": n_cols, "offset": k * n_rows * n_cols}
+            for k in range(count)
+        }
+        write_pack(pack_path, index, (chunk.astype(np.int8) for chunk in self.iter_chunks(count, rng)))
+
+    def _generate(self, count, rng):
+        grids = self._draw(count, rng)
+        if self.require_push:
+            for _ in range(100):
+                stuck = np.flatnonzero(~has_push(grids))
+                if stuck.size == 0:
+                    break
+                grids[stuck] = self._draw(stuck.size, rng)
+            else:
+                raise ValueError("could not generate maps with a legal push, the map settings leave boxes no room")
+        return grids
+
+    def _draw(self, count, rng):
+        n_rows, n_cols = self.shape
+        if self.exact:
+            grids = np.zeros((count, n_rows, n_cols), dtype=self.dtype)
+            reserved = np.zeros(grids.shape, dtype=bool)
+            for _ in range(self.squares):
+                reserved |= self._plant_square(grids, rng)
+            self._place_exact(grids.reshape(count, -1), reserved.reshape(count, -1) if self.squares else None, rng)
+            return grids
+
+        grids = self.lut[rng.integers(0, LUT_SIZE, (count, n_rows * n_cols), dtype=np.uint16)]
+        if len(self.box_types) > 1:
+            boxes = grids == -1
+            grids[boxes] = rng.choice(self.box_types, boxes.sum())
+        grids = grids.reshape(count, n_rows, n_cols)
+
+        for _ in range(self.squares):
+            self._plant_square(grids, rng)
+        return grids
+
+    def _place_exact(self, grids, reserved, rng):
+        """
+            exact counts: the cells of the objects of every map of the (count, cells)
+            grids are drawn without replacement, among the cells not `reserved`
+        """
+        n_barriers, n_boxes, n_lavas = self.counts
+        n_objects = n_barriers + n_boxes + n_lavas
+        count, cells = grids.shape
+        rows = np.arange(count)[:, None]
+
+        if reserved is None and 2 * n_objects * n_objects <= cells:
+            # few objects: draw with replacement, and draw again the maps where a cell came twice
+            positions = rng.integers(0, cells, (count, n_objects))
+            while n_objects > 1:
+                ordered = np.sort(positions, axis=1)
+                repeated = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+                if repeated.size == 0:
+                    break
+                positions[repeated] = rng.integers(0, cells, (repeated.size, n_objects))
+        else:
+            # the cells with the smallest random keys, in random order
+            keys = rng.random((count, cells), dtype=np.float32)
+            if reserved is not None:
+                keys[reserved] = 2 # after every free cell
+            positions = np.argpartition(keys, n_objects - 1, axis=1)[:, :n_objects] if n_objects < cells else np.argsort(keys, axis=1)
+            positions = rng.permuted(positions, axis=1)
+
+        grids[rows, positions[:, :n_barriers]] = Objects.Barrier.value
+        grids[rows, positions[:, n_barriers + n_boxes:]] = Objects.Lava.value
+        box_positions = positions[:, n_barriers:n_barriers + n_boxes]
+        if len(self.box_types) > 1:
+            grids[rows, box_positions] = rng.choice(self.box_types, box_positions.shape)
+        else:
+            grids[rows, box_positions] = self.box_types[0]
+
+    def _plant_square(self, grids, rng):
+        """
+            writes one perfect square candidate per map: an empty border around a
+            block of boxes. Returns the (count, n_rows, n_cols) cells it covers.
+        """
+        count, n_rows, n_cols = grids.shape
+        low, high = self.square_extends
+        extend = rng.integers(low, high + 1, count)[:, None, None]
+        si = rng.integers(0, n_rows - extend[:, 0, 0] + 1)[:, None, None]
+        sj = rng.integers(0, n_cols - extend[:, 0, 0] + 1)[:, None, None]
+
+        rr = np.arange(n_rows)[None, :, None] - si
+        cc = np.arange(n_cols)[None, None, :] - sj
+        inside = (rr >= 0) & (rr < extend) & (cc >= 0) & (cc < extend)
+        interior = (rr >= 1) & (rr < extend - 1) & (cc >= 1) & (cc < extend - 1)
+
+        grids[inside & ~interior] = Objects.Empty.value
+        if len(self.box_types) > 1:
+            grids[interior] = rng.choice(self.box_types, interior.sum())
+        else:
+            grids[interior] = self.box_types[0]
+        return inside
+
+
+def has_push(grids):
+    """
+        (N,) booleans, true for the maps of a (N, H, W) batch where some box can be pushed.
+        A push moves when the last box of its chain has an empty or lava cell ahead,
+        so it is enough to look for a box next to such a cell.
+    """
+    box = box_mask(grids)
+    free = (grids == Objects.Empty.value) | (grids == Objects.Lava.value)
+    return (
+        (box[:, :, :-1] & free[:, :, 1:]).any(axis=(1, 2))
+        | (box[:, :, 1:] & free[:, :, :-1]).any(axis=(1, 2))
+        | (box[:, :-1, :] & free[:, 1:, :]).any(axis=(1, 2))
+        | (box[:, 1:, :] & free[:, :-1, :]).any(axis=(1, 2))
+    )
@@ -0,0 +1,225 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+MAGIC = b"SHOVMAP1"
+PACK_NAME = ".maps.pack"
+
+def read_map(file_path):
+    with open(file_path, 'r') as file:
+        lines = file.readlines()
+
+    lines = [i.split() for i in lines]
+
+    n_rows = len(lines)
+    n_cols = len(lines[0])
+
+    grid = np.zeros((n_rows, n_cols), dtype=int)
+
+    for i in range(n_rows):
+        for j in range(n_cols):
+            grid[i][j] = int(lines[i][j])
+
+    return grid
+
+
+def write_pack(pack_path, index, chunks):
+    """
+        Writes a pack file from its index and an iterable of int8 chunks
+        (written in order, so the grids can be streamed), atomically.
+    """
+    pack_path = Path(pack_path)
+    header = json.dumps(index).encode()
+    tmp_path = pack_path.with_name(f"{pack_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(np.uint64(len(header)).tobytes())
+        file.write(header)
+        for chunk in chunks:
+            file.write(np.ascontiguousarray(chunk, dtype=np.int8).tobytes())
+    os.replace(tmp_path, pack_path)
+
+def read_pack(pack_path):
+    """ (index, grids) of a pack file, the grids are a flat read-only memory map """
+    with open(pack_path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{pack_path} is not a map pack")
+        header_size = int(np.frombuffer(file.read(8), dtype=np.uint64)[0])
+        index = json.loads(file.read(header_size))
+
+    data_offset = len(MAGIC) + 8 + header_size
+    if os.path.getsize(pack_path) > data_offset:
+        grids = np.memmap(pack_path, dtype=np.int8, mode='r', offset=data_offset)
+    else:
+        grids = np.zeros(0, dtype=np.int8)
+    return index, grids
+
+
+class MapPack:
+    """ read-only maps of a pack file that has no source directory, e.g. generated maps """
+
+    def __init__(self, pack_path):
+        self.pack_path = Path(pack_path)
+        self._index, self._grids = read_pack(self.pack_path)
+
+    def __len__(self):
+        return len(self._index)
+
+    def names(self):
+        return self._index.keys()
+
+    def get(self, name):
+        entry = self._index.get(name)
+        if entry is None:
+            return None
+        rows, cols, offset = entry["rows"], entry["cols"], entry["offset"]
+        return self._grids[offset:offset + rows * cols].reshape(rows, cols)
+
+
+class MapLibrary:
+    """
+        Every map of a directory converted once into int8 grids packed in one file:
+
+            MAGIC | index size (uint64) | index (json) | grids
+
+        The index keeps the shape and offset of each grid together with the mtime
+        and size of its source file. A map is parsed when it is first asked for
+        or its source changed, the other packed maps are copied over as they are.
+        Other files of the directory are only a problem for get() of their name.
+        The grids are read through a memory map, get() returns a read-only view.
+    """
+
+    def __init__(self, maps_path, pack_path=None):
+        self.maps_path = Path(maps_path)
+        self.pack_path = Path(pack_path) if pack_path else self.maps_path / PACK_NAME
+
+        self._listing = None
+        self._listing_mtime = None
+        self._index = {}
+        self._grids = np.zeros(0, dtype=np.int8)
+
+        self._open_pack()
+
+    def names(self):
+        """ map files of the directory, listed again only when the directory changes """
+        mtime = os.stat(self.maps_path).st_mtime_ns
+        if self._listing is None or mtime != self._listing_mtime:
+            self._listing = frozenset(
+                entry.name for entry in os.scandir(self.maps_path)
+                if entry.is_file() and not entry.name.startswith('.')
+            )
+            self._listing_mtime = mtime
+        return self._listing
+
+    def get(self, name):
+        """ the grid of a map as an int8 view, None if there is no such map """
+        if name not in self.names():
+            return None
+
+        entry = self._index.get(name)
+        if entry is None or self._is_stale(name, entry):
+            self.update([name])
+            entry = self._index[name]
+
+        return self._view(entry)
+
+    def _view(self, entry):
+        rows, cols, offset = entry["rows"], entry["cols"], entry["offset"]
+        return self._grids[offset:offset + rows * cols].reshape(rows, cols)
+
+    def _is_stale(self, name, entry):
+        try:
+            stat = os.stat(self.maps_path / name)
+        except FileNotFoundError:
+            return True
+        return stat.st_mtime_ns != entry["mtime"] or stat.st_size != entry["size"]
+
+    def _parse(self, name):
+        """ (grid, stat) of a source map, ValueError if the file is not a map """
+        file_path = self.maps_path / name
+        stat = os.stat(file_path)
+        try:
+            grid = read_map(file_path)
+        except (ValueError, IndexError) as error:
+            raise ValueError(f"{name} is not a map: {error}") from error
+        if grid.min() < np.iinfo(np.int8).min or grid.max() > np.iinfo(np.int8).max:
+            raise ValueError(f"{name} has values that do not fit in int8")
+        return grid, stat
+
+    def update(self, names):
+        """
+            Parses the source maps `names` and rewrites the pack file with them and
+            the packed maps whose source did not change, which are not parsed
+            again. Maps whose source is gone are dropped.
+        """
+        self._repack({name: self._parse(name) for name in names})
+
+    def _repack(self, parsed):
+        """ writes the pack of the parsed {name: (grid, stat)} and the unchanged packed maps """
+        listing = self.names()
+        kept = {
+            name: entry for name, entry in self._index.items()
+            if name not in parsed and name in listing and not self._is_stale(name, entry)
+        }
+
+        index = {}
+        chunks = []
+        offset = 0
+        for name in sorted(kept.keys() | parsed.keys()):
+            if name in parsed:
+                grid, stat = parsed[name]
+                mtime, size = stat.st_mtime_ns, stat.st_size
+            else:
+                grid = self._view(kept[name])
+                mtime, size = kept[name]["mtime"], kept[name]["size"]
+
+            rows, cols = grid.shape
+            index[name] = {"rows": rows, "cols": cols, "offset": offset, "mtime": mtime, "size": size}
+            chunks.append(grid.astype(np.int8).ravel())
+            offset += rows * cols
+
+        grids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int8)
+
+        try:
+            write_pack(self.pack_path, index, [grids])
+        except OSError:
+            # read-only maps directory, keep the grids of this process in memory
+            self._index = index
+            self._grids = grids
+            return
+
+        self._open_pack()
+
+    def rebuild(self):
+        """
+            Parses every source map again and rewrites the pack file. Files that
+            are not maps are left out, returns {name: error} of them.
+        """
+        parsed = {}
+        skipped = {}
+        for name in sorted(self.names()):
+            try:
+                parsed[name] = self._parse(name)
+            except ValueError as error:
+                skipped[name] = str(error)
+        self._index = {}
+        self._repack(parsed)
+        return skipped
+
+    def _open_pack(self):
+        try:
+            self._index, self._grids = read_pack(self.pack_path)
+        except (FileNotFoundError, ValueError, IndexError):
+            return
+
+
+_libraries = {}
+
+def get_library(maps_path):
+    """ one MapLibrary per maps directory and process """
+    key = os.path.realpath(maps_path)
+    library = _libraries.get(key)
+    if library is None:
+        library = _libraries[key] = MapLibrary(maps_path)
+    return library
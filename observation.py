@@ -0,0 +1,124 @@
+"""
+    Flat structured observation: one numpy record holding the grid, the stamina,
+    the previous selected position and the previous action.
+
+        replay = np.zeros(1_000_000, dtype=env.observation_space.dtype)
+        env.set_obs_buffer(replay[t, ...]) # the next observation is written into replay[t]
+
+    Tensor observation: (C, H, W) planes of TENSOR_CHANNELS for convolutional
+    policies, one hot planes of the cell values plus the boxes inside a perfect
+    square and the age of that square.
+
+    The gymnasium spaces of these observations are in observation_spaces.py,
+    this module only needs numpy.
+"""
+import numpy as np
+from enums import Objects
+
+OBJECT_VALUES = np.array([obj.value for obj in Objects])
+
+# the cell value of every one hot plane, in channel order
+PLANE_VALUES = np.array(
+    [Objects.Empty.value, Objects.Lava.value, Objects.Barrier.value]
+    + list(range(Objects.Box1.value, Objects.Box10.value + 1))
+)
+TENSOR_CHANNELS = (
+    "empty", "lava", "barrier", *(f"box{k}" for k in range(1, 11)),
+    "square", # 1 on the boxes inside a perfect square
+    "square_age", # age of that square
+)
+SQUARE = len(PLANE_VALUES)
+SQUARE_AGE = SQUARE + 1
+CHANNEL_OF = {int(value): channel for channel, value in enumerate(PLANE_VALUES)}
+
+
+def record_dtype(n_rows, n_cols, grid_dtype):
+    return np.dtype([
+        ("grid", grid_dtype, (n_rows, n_cols)),
+        ("stamina", np.int32),
+        ("previous_selected_position", np.int16, (2,)), # -1, -1 when there is none
+        ("previous_action", np.int8), # 0 stands for None
+    ])
+
+def write_record(record, grid, stamina, moving_positions, last_z):
+    """ writes the observation fields into a 0-d record array, in place """
+    record["grid"] = grid
+    record["stamina"] = stamina
+    if moving_positions:
+        record["previous_selected_position"] = next(iter(moving_positions))
+    else:
+        record["previous_selected_position"] = -1
+    record["previous_action"] = last_z or 0
+    return record
+
+
+def apply_delta(grid, squares, delta):
+    """
+        Brings a copy of the previous grid and set of (i, j, extend) squares up to
+        date with an env delta (info["delta"]), in place, in O(changes).
+    """
+    if delta["keyframe"] is not None:
+        grid[...] = delta["keyframe"]
+        squares.clear()
+        squares.update(delta["squares"])
+        return grid, squares
+
+    changes = delta["changes"]
+    grid[changes[:, 0], changes[:, 1]] = changes[:, 3]
+    squares.difference_update(delta["squares_removed"])
+    squares.update(delta["squares_added"])
+    return grid, squares
+
+
+def object_planes(grid, dtype=np.uint8):
+    """ (..., H, W) grids -> (..., SQUARE, H, W) one hot planes of the cell values """
+    grid = np.asarray(grid)
+    return (grid[..., None, :, :] == PLANE_VALUES[:, None, None]).astype(dtype)
+
+def max_square_age(max_age, dtype):
+    """ the largest square_age value, squares dissolve when their age reaches max_age """
+    high = max(1, max_age - 1)
+    if np.issubdtype(dtype, np.integer):
+        high = min(high, np.iinfo(dtype).max)
+    return high
+
+class TensorObservation:
+    """
+        (C, H, W) planes of an env, updated from the cells written by each step
+        and the squares that were found or removed since the last observation,
+        instead of rebuilt from the grid. rebuild() starts over from the grid,
+        it has to be called after the grid or the squares were replaced.
+    """
+
+    def __init__(self, shape, dtype, max_age):
+        self.planes = np.zeros((len(TENSOR_CHANNELS), *shape), dtype=dtype)
+        self.max_age = max_square_age(max_age, dtype)
+        self.squares = {} # (i, j, extend) -> birth of the squares painted on the planes
+        self.stale = True
+
+    def rebuild(self, grid, registry):
+        self.planes[:SQUARE] = object_planes(grid, self.planes.dtype)
+        self.planes[SQUARE:] = 0
+        self.squares = {}
+        self.stale = False
+        self.sync_squares(registry)
+
+    def write_cells(self, writes):
+        """ (i, j, old, new) cell writes """
+        planes = self.planes
+        for i, j, old, new in writes:
+            planes[CHANNEL_OF[old], i, j] = 0
+            planes[CHANNEL_OF[new], i, j] = 1
+
+    def sync_squares(self, registry):
+        """ clears the squares gone from the registry, paints the live ones with their age """
+        live = {sq.key(): sq.birth for sq in registry}
+        for (i, j, extend), birth in self.squares.items():
+            if live.get((i, j, extend)) != birth:
+                self.planes[SQUARE:, i + 1:i + extend - 1, j + 1:j + extend - 1] = 0
+
+        for sq in registry:
+            inside = (slice(sq.start_i + 1, sq.start_i + sq.extend - 1), slice(sq.start_j + 1, sq.start_j + sq.extend - 1))
+            self.planes[(SQUARE, *inside)] = 1
+            self.planes[(SQUARE_AGE, *inside)] = min(registry.age(sq), self.max_age)
+        self.squares = live
@@ -0,0 +1,50 @@
+"""
+    gymnasium spaces of the observations built by observation.py
+"""
+import numpy as np
+from gymnasium import spaces
+from enums import Actions
+from observation import OBJECT_VALUES, TENSOR_CHANNELS, max_square_age
+
+
+def dict_space(shape, grid_dtype):
+    """ Dict of the dict observations (grid, stamina, previous position and action) of a shape (H, W) grid """
+    return spaces.Dict({
+        "grid": spaces.Box(low=-100, high=100, shape=shape, dtype=grid_dtype),
+        "stamina": spaces.Box(low=-np.inf, high=np.inf, shape=(), dtype=np.int64),
+        "previous_selected_position": spaces.Box(low=-1, high=max(shape), shape=(2,), dtype=np.int64),
+        "previous_action": spaces.Discrete(len(Actions) + 1), # 0 before the first action
+    })
+
+def tensor_space(shape, dtype, max_age):
+    """ Box of the (C, H, W) tensor observations of a shape (H, W) grid """
+    return spaces.Box(low=0, high=max_square_age(max_age, dtype), shape=(len(TENSOR_CHANNELS), *shape), dtype=dtype)
+
+
+class RecordSpace(spaces.Space):
+    """ space of the 0-d records of a record_dtype() """
+
+    def __init__(self, dtype, seed=None):
+        super().__init__(shape=(), dtype=dtype, seed=seed)
+
+    @property
+    def is_np_flattenable(self):
+        return False
+
+    def sample(self, mask=None, probability=None):
+        record = np.zeros((), dtype=self.dtype)
+        n_rows, n_cols = self.dtype["grid"].shape
+        record["grid"] = self.np_random.choice(OBJECT_VALUES, size=(n_rows, n_cols))
+        record["stamina"] = self.np_random.integers(0, np.iinfo(np.int32).max)
+        record["previous_selected_position"] = self.np_random.integers(-1, (n_rows, n_cols))
+        record["previous_action"] = self.np_random.integers(0, len(Actions) + 1)
+        return record
+
+    def contains(self, x):
+        return isinstance(x, np.ndarray) and x.shape == () and x.dtype == self.dtype
+
+    def __repr__(self):
+        return f"RecordSpace({self.dtype})"
+
+    def __eq__(self, other):
+        return isinstance(other, RecordSpace) and self.dtype == other.dtype
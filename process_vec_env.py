@@ -0,0 +1,145 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import VectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+from enums import Actions
+import settings
+from map_library import get_library
+import observation_spaces
+from vec_worker import OBS_KEYS, shared_layout, block_size, block_views, run_worker
+from core import env_seeds
+
+class ShoverWorldProcVecEnv(VectorEnv):
+    """
+        Steps `num_envs` ShoverWorldEnv instances in `num_workers` processes,
+        each worker owning a contiguous shard of the batch.
+
+        Grids, stamina, rewards and flags are written by the workers into one
+        shared memory block, so the batch is read as (N, H, W) arrays without
+        pickling. Actions go the other way through the same block and each
+        worker gets a single command per step for its whole shard.
+
+        With copy=False the observations are views of the shared block that
+        the next step overwrites.
+
+        Finished envs are reset in the same step; the last observation of
+        the finished episode is returned in info["final_obs"].
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(
+            self,
+            num_envs,
+            num_workers=None,
+            render_mode=None,
+            map_name=None,
+            copy=True,
+            context=None
+        ):
+        self.num_envs = num_envs
+        self.num_workers = min(num_workers or multiprocessing.cpu_count(), num_envs)
+        self.render_mode = render_mode
+        self.map_name = map_name
+        self.copy = copy
+        self.closed = False
+
+        self.n_rows = settings.EnvironmentVars.n_rows
+        self.n_cols = settings.EnvironmentVars.n_cols
+        if map_name:
+            grid = get_library(settings.Paths.maps_path).get(map_name)
+            if grid is not None:
+                self.n_rows, self.n_cols = grid.shape
+
+        N, H, W = num_envs, self.n_rows, self.n_cols
+        self.grid_dtype = np.int8 if settings.EnvironmentVars.compact else np.int64
+        layout = shared_layout(N, H, W, self.grid_dtype)
+        self._shm = SharedMemory(create=True, size=block_size(layout))
+        self._views = block_views(self._shm.buf, layout)
+
+        env_vars = {key: value for key, value in vars(settings.EnvironmentVars).items() if not key.startswith("_")}
+        bounds = np.linspace(0, N, self.num_workers + 1).astype(int)
+        seeds = env_seeds(settings.EnvironmentVars.seed, N)
+
+        ctx = multiprocessing.get_context(context)
+        self._remotes = []
+        self._processes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            remote, child_remote = ctx.Pipe()
+            process = ctx.Process(
+                target=run_worker,
+                args=(child_remote, remote, self._shm.name, layout, int(start), int(stop), map_name, env_vars, seeds[start:stop]),
+                daemon=True,
+            )
+            process.start()
+            child_remote.close()
+            self._remotes.append(remote)
+            self._processes.append(process)
+        self._wait()
+
+        self.single_action_space = spaces.Dict({
+            "position": spaces.MultiDiscrete([H, W]),
+            "z": spaces.Discrete(len(Actions), start=1)
+        })
+        self.single_observation_space = observation_spaces.dict_space((H, W), self.grid_dtype)
+        self.action_space = batch_space(self.single_action_space, N)
+        self.observation_space = batch_space(self.single_observation_space, N)
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        self._send("reset", seed)
+        return self._get_obs(""), {}
+
+    def step(self, actions):
+        N = self.num_envs
+        self._views["actions"][:, :2] = np.asarray(actions["position"]).reshape(N, 2)
+        self._views["actions"][:, 2] = np.asarray(actions["z"]).reshape(N)
+        self._send("step", None)
+
+        terminated = self._views["terminated"].copy()
+        truncated = self._views["truncated"].copy()
+        infos = {}
+
+        done = terminated | truncated
+        if done.any():
+            infos["final_obs"] = {key: self._views["final_" + key].copy() for key in OBS_KEYS}
+            infos["_final_obs"] = done
+
+        return self._get_obs(""), self._views["reward"].copy(), terminated, truncated, infos
+
+    def _send(self, command, arg):
+        for remote in self._remotes:
+            remote.send((command, arg))
+        self._wait()
+
+    def _wait(self):
+        errors = [error for error in (remote.recv() for remote in self._remotes) if error is not None]
+        if errors:
+            raise RuntimeError("a ShoverWorldProcVecEnv worker failed:\n" + errors[0])
+
+    def _get_obs(self, prefix):
+        if self.copy:
+            return {key: self._views[prefix + key].copy() for key in OBS_KEYS}
+        return {key: self._views[prefix + key] for key in OBS_KEYS}
+
+    def close_extras(self, **kwargs):
+        for remote in self._remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for remote in self._remotes:
+            remote.close()
+
+        self._views = None
+        self._shm.unlink()
+        try:
+            self._shm.close()
+        except BufferError:
+            pass # observations handed out with copy=False still use the block, it is freed with them
@@ -0,0 +1,125 @@
+"""
+    Opt-in instrumentation of ShoverWorldEnv.step() and reset().
+
+        env.profiler = StepProfiler(sinks=[JsonDump("perf.json", every=1000)])
+
+    When env.profiler is None (the default) the environment only pays a None check per phase.
+"""
+import collections
+import json
+import time
+import numpy as np
+
+# histogram bin edges of phase durations, in microseconds
+BIN_EDGES_US = np.array([0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, np.inf])
+
+
+class RollingHistogram:
+    """ histogram of the last `window` samples, updated in O(1) per sample """
+
+    def __init__(self, window, edges=BIN_EDGES_US):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+        self.samples = collections.deque(maxlen=window)
+
+    def add(self, value):
+        if len(self.samples) == self.samples.maxlen:
+            self.counts[np.searchsorted(self.edges, self.samples[0], side="right") - 1] -= 1
+        self.samples.append(value)
+        self.counts[np.searchsorted(self.edges, value, side="right") - 1] += 1
+
+    def summary(self):
+        if not self.samples:
+            return {"count": 0}
+        values = np.fromiter(self.samples, dtype=np.float64)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {
+            "count": len(values),
+            "mean": float(values.mean()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "max": float(values.max()),
+            "histogram": self.counts.tolist(),
+        }
+
+
+class StepProfiler:
+    """
+        Times the phases of each step/reset and counts what they did.
+
+        The environment calls begin() when a step or reset starts, mark(phase) at the
+        end of each phase and count(name, n) for the work done; end() closes the record,
+        adds it to the rolling histograms and hands it to every sink.
+        A record looks like {"kind": "step", "phases": {phase: us}, "counts": {name: n}}.
+    """
+
+    def __init__(self, window=1000, sinks=()):
+        self.window = window
+        self.sinks = list(sinks)
+        self.histograms = {} # (kind, phase) -> RollingHistogram of microseconds
+        self.totals = collections.Counter() # (kind, count name) -> total over all records
+        self.records = collections.Counter() # kind -> number of records
+        self._record = None
+        self._last = 0.0
+
+    def begin(self, kind):
+        self._record = {"kind": kind, "phases": {}, "counts": {}}
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        phases = self._record["phases"]
+        phases[phase] = phases.get(phase, 0.0) + (now - self._last) * 1e6
+        self._last = now
+
+    def count(self, name, n):
+        counts = self._record["counts"]
+        counts[name] = counts.get(name, 0) + n
+
+    def end(self):
+        record = self._record
+        kind = record["kind"]
+        record["phases"]["total"] = sum(record["phases"].values())
+
+        for phase, us in record["phases"].items():
+            histogram = self.histograms.get((kind, phase))
+            if histogram is None:
+                histogram = self.histograms[(kind, phase)] = RollingHistogram(self.window)
+            histogram.add(us)
+        for name, n in record["counts"].items():
+            self.totals[(kind, name)] += n
+        self.records[kind] += 1
+
+        for sink in self.sinks:
+            sink(self, record)
+
+        self._record = None
+        return record
+
+    def summary(self):
+        """ rolling statistics of every phase, and the totals of every count """
+        res = {}
+        for (kind, phase), histogram in self.histograms.items():
+            res.setdefault(kind, {"phases": {}, "totals": {}, "records": self.records[kind]})
+            res[kind]["phases"][phase] = histogram.summary()
+        for (kind, name), total in self.totals.items():
+            res.setdefault(kind, {"phases": {}, "totals": {}, "records": self.records[kind]})
+            res[kind]["totals"][name] = total
+        res["bin_edges_us"] = BIN_EDGES_US.tolist()[:-1] + ["inf"]
+        return res
+
+
+class JsonDump:
+    """ sink writing the profiler summary to a JSON file every `every` records """
+
+    def __init__(self, path, every=1000):
+        self.path = path
+        self.every = every
+        self._seen = 0
+
+    def __call__(self, profiler, record):
+        self._seen += 1
+        if self._seen % self.every == 0:
+            with open(self.path, "w") as file:
+                json.dump(profiler.summary(), file, indent=2)
@@ -0,0 +1,70 @@
+"""
+    Frames of the grid as numpy arrays, without pygame (e.g. to record videos in training workers).
+
+        frame = render_rgb(env.map, cell_size=16) # (H*16, W*16, 3) uint8
+"""
+import numpy as np
+import settings
+from enums import Objects
+from chunked_grid import ChunkedGrid
+
+COLOR_EMPTY = settings.GuiVars.COLOR_EMPTY
+COLOR_BARRIER = settings.GuiVars.COLOR_BARRIER
+COLOR_LAVA = settings.GuiVars.COLOR_LAVA
+BOX_COLORS = settings.GuiVars.BOX_COLORS
+GRID_LINE = settings.GuiVars.GRID_LINE
+
+def tile_color(value):
+    """ color of a cell value, the same as the GUI """
+    if value == Objects.Barrier.value:
+        return COLOR_BARRIER
+    if value == Objects.Lava.value:
+        return COLOR_LAVA
+    if 1 <= value <= 1000: # box index might be >10; map it
+        return BOX_COLORS[int(value - 1) % len(BOX_COLORS)]
+    return COLOR_EMPTY
+
+# color of every cell value, indexed by the value as uint8
+PALETTE = np.array([tile_color(k - 256 if k >= 128 else k) for k in range(256)], dtype=np.uint8)
+
+
+def render_rgb(grid, cell_size=8, grid_lines=True):
+    """
+        (..., H*cell_size, W*cell_size, 3) uint8 frame of a (..., H, W) grid or batch
+        of grids: a palette lookup per cell, upscaled with np.repeat.
+    """
+    if isinstance(grid, ChunkedGrid):
+        return render_chunked(grid, cell_size, grid_lines)
+    grid = np.asarray(grid)
+    frame = PALETTE[grid.astype(np.uint8)]
+    if cell_size > 1:
+        frame = np.repeat(np.repeat(frame, cell_size, axis=-3), cell_size, axis=-2)
+
+    if grid_lines and cell_size > 2:
+        # the one pixel border of every cell
+        border = np.zeros(cell_size, dtype=bool)
+        border[[0, -1]] = True
+        frame[..., np.tile(border, grid.shape[-2]), :, :] = GRID_LINE
+        frame[..., np.tile(border, grid.shape[-1]), :] = GRID_LINE
+    return frame
+
+
+def render_chunked(grid, cell_size=8, grid_lines=True):
+    """
+        render_rgb() of a ChunkedGrid: the frame starts as empty cells, the tiles
+        that are barriers only are filled with one color, and only the other
+        allocated tiles are drawn cell by cell.
+    """
+    empty = render_rgb(np.zeros((1, 1), dtype=np.int8), cell_size, grid_lines)
+    barrier = render_rgb(np.full((1, 1), Objects.Barrier.value, dtype=np.int8), cell_size, grid_lines)
+    n_rows, n_cols = grid.shape
+    frame = np.tile(empty, (n_rows, n_cols, 1))
+
+    size = grid.tile_size * cell_size
+    for t, tile, top, left in grid.iter_tiles():
+        block = frame[top * cell_size:top * cell_size + size, left * cell_size:left * cell_size + size]
+        if grid.barriers[t] == grid.area[t]:
+            block[...] = np.tile(barrier, (block.shape[0] // cell_size, block.shape[1] // cell_size, 1))
+        else:
+            block[...] = render_rgb(tile[:block.shape[0] // cell_size, :block.shape[1] // cell_size], cell_size, grid_lines)
+    return frame
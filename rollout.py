@@ -0,0 +1,242 @@
+"""
+    Headless rollouts of fixed policies over many (map, seed, policy) jobs.
+
+        python3 rollout.py --maps map1.txt map2.txt --seeds 0:10000 --policies random legal --output runs/eval.jsonl
+
+    Jobs are cut into shards that a process pool runs; each worker keeps one
+    ShoverWorldEnv and resets it for every episode. Episode results are written
+    as JSON lines as soon as their shard is done, and aggregated per (map, policy).
+    Workers step a core.ShoverWorldCore, so they never import gymnasium.
+
+    A policy is a function (env, rng) -> action. Built in policies are named in
+    POLICIES, any other "module:function" name is imported in the workers.
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import sys
+import time
+import numpy as np
+import settings
+from enums import Actions
+
+RANDOM_MAP = "random" # map name of the jobs on generated maps
+
+
+def random_policy(env, rng):
+    """ any cell, any action """
+    i, j, z = rng.integers((0, 0, 1), (env.n_rows, env.n_cols, len(Actions) + 1))
+    return {"position": np.array([i, j]), "z": int(z)}
+
+def legal_policy(env, rng):
+    """
+        a random action among the ones that move something (the GUI's random agent):
+        the pushes that move a box, and Barrier Maker and Hellify once each since
+        they do the same at every position
+    """
+    mask = env.action_mask()
+    moves = np.flatnonzero(mask[..., :Actions.BarrierMaker.value - 1])
+    specials = [z for z in (Actions.BarrierMaker.value, Actions.Hellify.value) if mask[0, 0, z - 1]]
+    if len(moves) + len(specials) == 0:
+        return random_policy(env, rng)
+    k = rng.integers(len(moves) + len(specials))
+    if k >= len(moves):
+        return {"position": np.array([0, 0]), "z": specials[k - len(moves)]}
+    i, j, z = np.unravel_index(moves[k], (env.n_rows, env.n_cols, Actions.BarrierMaker.value - 1))
+    return {"position": np.array([i, j]), "z": int(z) + 1}
+
+POLICIES = {
+    "random": random_policy,
+    "legal": legal_policy,
+}
+
+def get_policy(name):
+    policy = POLICIES.get(name)
+    if policy is None:
+        if ":" not in name:
+            raise ValueError(f"unknown policy {name!r}, expected one of {sorted(POLICIES)} or module:function")
+        module, function = name.split(":", 1)
+        policy = POLICIES[name] = getattr(importlib.import_module(module), function)
+    return policy
+
+
+def make_jobs(maps, seeds, policies):
+    """ every (map, seed, policy) combination """
+    return [(map_name, int(seed), policy) for map_name in maps for policy in policies for seed in seeds]
+
+def shard(jobs, shard_size):
+    return [jobs[k:k + shard_size] for k in range(0, len(jobs), shard_size)]
+
+
+_env = None
+
+def _init_worker(env_vars):
+    global _env
+    for key, value in env_vars.items():
+        setattr(settings.EnvironmentVars, key, value)
+
+    from core import ShoverWorldCore
+    _env = ShoverWorldCore()
+
+def run_episode(env, map_name, seed, policy_name, max_steps=None):
+    """ plays one episode on env (reset to the map and seed) and returns its result """
+    policy = get_policy(policy_name)
+    if map_name == RANDOM_MAP:
+        # the size of the previous map is kept by the env, random maps use the configured one
+        env.map_name = None
+        env.n_rows, env.n_cols = settings.EnvironmentVars.n_rows, settings.EnvironmentVars.n_cols
+    else:
+        env.map_name = map_name
+    env.reset(seed=seed)
+    rng = np.random.default_rng(seed)
+
+    total = 0.0
+    length = 0
+    terminated = truncated = False
+    started = time.perf_counter()
+    while not (terminated or truncated) and (max_steps is None or length < max_steps):
+        _, reward, terminated, truncated, _ = env.step(policy(env, rng))
+        total += reward
+        length += 1
+
+    return {
+        "map": map_name,
+        "seed": seed,
+        "policy": policy_name,
+        "return": total,
+        "length": length,
+        "stamina": int(env.stamina),
+        "boxes_left": env.box_count,
+        "terminated": bool(terminated),
+        "truncated": bool(truncated),
+        "seconds": time.perf_counter() - started,
+    }
+
+def _run_shard(args):
+    jobs, max_steps = args
+    return [run_episode(_env, map_name, seed, policy, max_steps) for map_name, seed, policy in jobs]
+
+
+class RolloutStats:
+    """ running sums of the episode results, per (map, policy) and overall """
+
+    FIELDS = ("return", "length")
+
+    def __init__(self):
+        self.groups = {}
+        self.episodes = 0
+        self.steps = 0
+        self.step_seconds = 0.0
+
+    def add(self, result):
+        self.episodes += 1
+        self.steps += result["length"]
+        self.step_seconds += result["seconds"]
+
+        group = self.groups.get((result["map"], result["policy"]))
+        if group is None:
+            group = self.groups[(result["map"], result["policy"])] = {
+                "episodes": 0,
+                **{field: [0.0, 0.0, np.inf, -np.inf] for field in self.FIELDS}, # sum, sum of squares, min, max
+            }
+        group["episodes"] += 1
+        for field in self.FIELDS:
+            value = result[field]
+            acc = group[field]
+            acc[0] += value
+            acc[1] += value * value
+            acc[2] = min(acc[2], value)
+            acc[3] = max(acc[3], value)
+
+    def summary(self, seconds):
+        """
+            mean/std/min/max of the returns and lengths of every group. steps_per_sec
+            is over the wall time, worker_steps_per_sec over the time spent stepping
+            in each worker.
+        """
+        groups = {}
+        for (map_name, policy), group in sorted(self.groups.items()):
+            n = group["episodes"]
+            stats = {"episodes": n}
+            for field in self.FIELDS:
+                total, squares, low, high = group[field]
+                mean = total / n
+                stats[field] = {"mean": mean, "std": max(0.0, squares / n - mean * mean) ** 0.5, "min": low, "max": high}
+            groups[f"{map_name}/{policy}"] = stats
+
+        return {
+            "episodes": self.episodes,
+            "steps": self.steps,
+            "seconds": seconds,
+            "episodes_per_min": 60 * self.episodes / seconds if seconds > 0 else 0.0,
+            "steps_per_sec": self.steps / seconds if seconds > 0 else 0.0,
+            "worker_steps_per_sec": self.steps / self.step_seconds if self.step_seconds > 0 else 0.0,
+            "groups": groups,
+        }
+
+
+def run(jobs, output=None, workers=None, shard_size=64, max_steps=None, context=None):
+    """
+        Runs the jobs in `workers` processes (in this process when workers is 1)
+        and returns the summary of RolloutStats. Results are appended to the
+        `output` JSON lines file in the order their shards finish.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    env_vars = {key: value for key, value in vars(settings.EnvironmentVars).items() if not key.startswith("_")}
+    shards = [(jobs, max_steps) for jobs in shard(jobs, shard_size)]
+
+    stats = RolloutStats()
+    file = open(output, "a") if output else None
+    started = time.perf_counter()
+    try:
+        if workers > 1:
+            with multiprocessing.get_context(context).Pool(workers, _init_worker, (env_vars,)) as pool:
+                for results in pool.imap_unordered(_run_shard, shards):
+                    _collect(results, stats, file)
+        else:
+            _init_worker(env_vars)
+            for results in map(_run_shard, shards):
+                _collect(results, stats, file)
+    finally:
+        if file is not None:
+            file.close()
+
+    return stats.summary(time.perf_counter() - started)
+
+def _collect(results, stats, file):
+    for result in results:
+        stats.add(result)
+    if file is not None:
+        file.writelines(json.dumps(result) + "\n" for result in results)
+        file.flush()
+
+
+def parse_seeds(text):
+    """ "0:1000" -> range(0, 1000), "1,5,9" -> [1, 5, 9] """
+    if ":" in text:
+        start, stop = text.split(":")
+        return range(int(start), int(stop))
+    return [int(seed) for seed in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="headless ShoverWorldEnv rollouts")
+    parser.add_argument("--maps", nargs="+", default=[RANDOM_MAP], help=f"map files, or {RANDOM_MAP!r} for generated maps")
+    parser.add_argument("--seeds", default="0:100", help="start:stop range or comma separated seeds")
+    parser.add_argument("--policies", nargs="+", default=["random"], help=f"{sorted(POLICIES)} or module:function")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=64, help="episodes per task sent to a worker")
+    parser.add_argument("--max-steps", type=int, help="cut episodes after this many steps")
+    parser.add_argument("--output", help="append the episode results to this JSON lines file")
+    args = parser.parse_args(argv)
+
+    jobs = make_jobs(args.maps, parse_seeds(args.seeds), args.policies)
+    summary = run(jobs, args.output, args.workers, args.shard_size, args.max_steps)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,21 @@ class EnvironmentVars:
 
     seed = 42
 
+    hash_stamina_bucket = 1 # stamina values hashed alike by the zobrist state hash (1 = exact)
+
+    debug = False # cross-check the maintained counters against the grid every step
+
+    compact = False # keep grids as int8 instead of int64
+    grid_backend = "dense" # "dense" numpy grid, or "chunked" for very large, mostly empty maps (see chunked_grid.py)
+    tile_size = 64 # cells per side of the tiles of the chunked grids, a power of two
+    observation = "dict" # "dict", "record" for one flat numpy record written into a preallocated buffer, or "tensor" for (C, H, W) planes
+    tensor_dtype = "uint8" # dtype of the "tensor" observations, e.g. "float32"
+
+    deltas = False # report the cells and squares each step changed in info["delta"]
+    delta_keyframe_every = 100 # steps between the full grids sent with the deltas
+
+    profile = False # time the phases of step() and reset(), reported in info["perf"]
+
 class GuiVars:
     COLOR_EMPTY = (255, 255, 255)
     COLOR_BARRIER = (19, 36, 64)
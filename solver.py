@@ -0,0 +1,327 @@
+"""
+    Best-first optimal solver for Shover-World maps, on the rules of ShoverWorldEnv.
+
+        python3 solver.py map2.txt --workers 4 --max-memory 512M
+
+    Objectives:
+        "reward"   the highest episode return within max_timestep steps. Rewards are
+                   never negative, so every state reached is a candidate.
+        "stamina"  the most stamina left when the last box is gone.
+
+    Nodes are states packed by trajectory.pack_state(). The closed set maps the
+    zobrist hash of the grid, the previous move and the squares with their ages
+    to the (score, stamina, timestep) of the nodes reached with that hash that
+    no other one dominates. A node is dropped when one of them has at least its
+    score and stamina in no more steps, since whatever it can still do, that
+    node can do too: only paths that are worse on every count are pruned.
+
+    Nodes are expanded best bound first, the fewest steps first among equal
+    bounds, in batches split over worker processes.
+    The search stops once no open node has a bound above the best score found,
+    which is then optimal, or when the nodes it holds exceed the memory budget.
+"""
+import argparse
+import heapq
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import numpy as np
+import settings
+from enums import Actions
+from core import ShoverWorldCore
+from trajectory import pack_state, unpack_state
+import zobrist
+
+OBJECTIVES = ("reward", "stamina")
+
+# estimated bytes held per open node (on top of its packed state), per closed set key and
+# per (score, stamina, timestep) kept for a key
+NODE_BYTES = 240
+CLOSED_BYTES = 120
+FRONT_BYTES = 80
+
+# the smallest square Hellify applies to has 3x3 boxes inside
+HELLIFY_BOXES = 9
+
+
+class Solution:
+    """ result of solve(), the actions are (i, j, z) triples """
+    __slots__ = (
+        "status", "score", "bound", "reward", "stamina", "actions",
+        "nodes_expanded", "nodes_generated", "seconds", "nodes_per_sec",
+        "memory_bytes", "peak_rss_bytes",
+    )
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    @property
+    def optimal(self):
+        return self.status == "optimal"
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return (f"Solution(status={self.status}, score={self.score}, reward={self.reward}, "
+                f"stamina={self.stamina}, steps={len(self.actions)}, nodes={self.nodes_expanded})")
+
+
+def reward_bound(env):
+    """
+        Upper bound of the reward still to be collected. A box gives initial_force
+        when pushed into lava, one per step, and 10 when Barrier Maker turns it into
+        a barrier. Without lava, lava only appears by Hellify, which takes 9 boxes.
+    """
+    boxes = env.box_count
+    lava_boxes = boxes if env.lava_count else max(0, boxes - HELLIFY_BOXES)
+    steps_left = max(0, env.max_timestep - env.timestep)
+    return 10 * boxes + max(0, env.initial_force - 10) * min(lava_boxes, steps_left)
+
+def stamina_bound(env):
+    """
+        Upper bound of the stamina gained until the last box is gone: at most
+        initial_force - unit_force for a box pushed into lava, 1 for a box of a
+        square that Barrier Maker or Hellify is applied to.
+    """
+    return env.box_count * max(env.initial_force - env.unit_force, 1)
+
+def legal_actions(env):
+    """
+        The pushes that move a box, the special actions when there is a square
+        to apply them to, and one action doing nothing (only useful to let the
+        squares age, so only given when there are squares).
+    """
+    mask = env.action_mask()
+    actions = [(int(i), int(j), int(k) + 1) for i, j, k in zip(*np.nonzero(mask[..., :Actions.BarrierMaker.value - 1]))]
+
+    if len(env.perfect_squares):
+        actions.append((0, 0, Actions.BarrierMaker.value))
+        if mask[0, 0, Actions.Hellify.value - 1]:
+            actions.append((0, 0, Actions.Hellify.value))
+
+        idle = np.argwhere(~mask[..., :Actions.BarrierMaker.value - 1].any(axis=-1))
+        if len(idle):
+            actions.append((int(idle[0][0]), int(idle[0][1]), Actions.MoveUp.value))
+    return actions
+
+def state_key(env):
+    """ zobrist hash of the state, without the stamina """
+    return env.state_hash() ^ zobrist.stamina_key(env.stamina, env.hash_stamina_bucket)
+
+
+_env = None
+
+def _init_worker(env_vars, map_name):
+    global _env
+    for key, value in env_vars.items():
+        setattr(settings.EnvironmentVars, key, value)
+    _env = ShoverWorldCore(map_name=map_name)
+
+def _expand(job):
+    """
+        Children of the nodes of a batch, as
+        (parent, action, packed state, key, score, bound, stamina, timestep, leaf) tuples.
+    """
+    objective, nodes = job
+    env = _env
+    children = []
+    for node, score, blob in nodes:
+        unpack_state(env, blob)
+        actions = legal_actions(env)
+        state = env.get_state()
+
+        for i, j, z in actions:
+            env.set_state(state)
+            _, reward, terminated, truncated, _ = env.step({"position": np.array([i, j]), "z": z})
+
+            if objective == "reward":
+                child_score = score + reward
+                leaf = terminated or truncated
+                bound = child_score if leaf else child_score + reward_bound(env)
+            else:
+                child_score = env.stamina
+                leaf = env.box_count == 0
+                if (terminated or truncated) and not leaf:
+                    continue # ran out of stamina or steps
+                bound = child_score + stamina_bound(env)
+
+            children.append((node, (i, j, z), pack_state(env), state_key(env), child_score, bound, env.stamina, env.timestep, leaf))
+    return children
+
+
+def solve(map_name, objective="reward", workers=1, batch_size=64, max_memory=1 << 30, context=None, verbose=False):
+    """
+        Searches the map for the best score of the objective. workers > 1 expands
+        each batch of nodes in that many processes. The search gives up once the
+        estimated memory of its nodes exceeds max_memory bytes; the solution is
+        then the best one found, with status "memory" and the best bound left.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {OBJECTIVES}, got {objective!r}")
+
+    env_vars = {key: value for key, value in vars(settings.EnvironmentVars).items() if not key.startswith("_")}
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context(context).Pool(workers, _init_worker, (env_vars, map_name))
+    else:
+        _init_worker(env_vars, map_name)
+
+    try:
+        return _search(map_name, objective, workers, pool, batch_size, max_memory, verbose)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+def _search(map_name, objective, workers, pool, batch_size, max_memory, verbose):
+    start = time.perf_counter()
+
+    root = ShoverWorldCore(map_name=map_name)
+    root_score = 0 if objective == "reward" else root.stamina
+    root_bound = root_score + (reward_bound(root) if objective == "reward" else stamina_bound(root))
+
+    # per node: parent and action, the path is followed back from the best node
+    parents = [-1]
+    actions = [None]
+    staminas = [root.stamina]
+    scores = [root_score]
+
+    open_ = [(-root_bound, -root_score, root.timestep, 0, pack_state(root))]
+    open_bytes = len(open_[0][4])
+    closed = {state_key(root): [(root_score, root.stamina, root.timestep)]}
+    front_entries = 1
+
+    if objective == "reward" or root.box_count == 0:
+        best = 0
+    else:
+        best = None
+
+    expanded = 0
+    status = "optimal"
+    memory = 0
+    last_report = start
+
+    while open_:
+        best_score = -np.inf if best is None else scores[best]
+        if -open_[0][0] <= best_score:
+            break
+
+        memory = open_bytes + NODE_BYTES * len(open_) + CLOSED_BYTES * len(closed) + FRONT_BYTES * front_entries
+        if memory > max_memory:
+            status = "memory"
+            break
+
+        batch = []
+        while open_ and len(batch) < batch_size * max(workers, 1):
+            neg_bound, neg_score, _, neg_node, blob = heapq.heappop(open_)
+            open_bytes -= len(blob)
+            if -neg_bound <= best_score:
+                continue
+            batch.append((-neg_node, -neg_score, blob))
+        if not batch:
+            continue
+        expanded += len(batch)
+
+        jobs = [(objective, batch[k::max(workers, 1)]) for k in range(max(workers, 1))]
+        if pool is None:
+            results = map(_expand, jobs)
+        else:
+            results = pool.map(_expand, jobs)
+
+        for children in results:
+            for parent, action, blob, key, score, bound, stamina, timestep, leaf in children:
+                front = closed.get(key, ())
+                if any(s >= score and st >= stamina and t <= timestep for s, st, t in front):
+                    continue
+                kept = [e for e in front if not (score >= e[0] and stamina >= e[1] and timestep <= e[2])]
+                kept.append((score, stamina, timestep))
+                front_entries += len(kept) - len(front)
+                closed[key] = kept
+
+                node = len(parents)
+                parents.append(parent)
+                actions.append(action)
+                staminas.append(stamina)
+                scores.append(score)
+
+                if (objective == "reward" or leaf) and (best is None or (score, stamina) > (scores[best], staminas[best])):
+                    best = node
+                if not leaf and (best is None or bound > scores[best]):
+                    heapq.heappush(open_, (-bound, -score, timestep, -node, blob)) # fewest steps, then newest first among ties
+                    open_bytes += len(blob)
+
+        if verbose and time.perf_counter() - last_report > 5:
+            last_report = time.perf_counter()
+            print(f"{expanded} nodes, {expanded / (last_report - start):.0f} nodes/s, open {len(open_)}, "
+                  f"closed {len(closed)}, best {None if best is None else scores[best]}, "
+                  f"bound {-open_[0][0] if open_ else None}", file=sys.stderr)
+
+    seconds = time.perf_counter() - start
+    memory = max(memory, open_bytes + NODE_BYTES * len(open_) + CLOSED_BYTES * len(closed) + FRONT_BYTES * front_entries)
+
+    path = []
+    node = best
+    while node is not None and node > 0:
+        path.append(actions[node])
+        node = parents[node]
+    path.reverse()
+
+    score = None if best is None else scores[best]
+    if status == "optimal":
+        bound = score
+    else:
+        bound = max(-open_[0][0], -np.inf if score is None else score)
+
+    return Solution(
+        status=status,
+        score=score,
+        bound=bound,
+        reward=None if best is None else (score if objective == "reward" else replay(map_name, path)[0]),
+        stamina=None if best is None else staminas[best],
+        actions=path,
+        nodes_expanded=expanded,
+        nodes_generated=len(parents),
+        seconds=seconds,
+        nodes_per_sec=expanded / seconds if seconds > 0 else 0.0,
+        memory_bytes=memory,
+        peak_rss_bytes=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    )
+
+
+def replay(map_name, path):
+    """ (return, stamina) of playing the actions of a solution in a fresh env """
+    env = ShoverWorldCore(map_name=map_name)
+    _, rewards, _, _, _ = env.step_many(path, obs=None)
+    return int(rewards.sum()), env.stamina
+
+
+def parse_bytes(text):
+    """ "512M", "2G", "100000" -> bytes """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="optimal Shover-World solver")
+    parser.add_argument("map_name", help="map file in the maps directory, e.g. map2.txt")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="reward")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="processes expanding the frontier")
+    parser.add_argument("--batch-size", type=int, default=64, help="nodes expanded per worker and batch")
+    parser.add_argument("--max-memory", default="1G", help="memory budget of the search nodes, e.g. 512M")
+    args = parser.parse_args(argv)
+
+    solution = solve(args.map_name, args.objective, args.workers, args.batch_size, parse_bytes(args.max_memory), verbose=True)
+    json.dump(solution.as_dict(), sys.stdout, indent=2)
+    print()
+    return 0 if solution.optimal else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import numpy as np
+from enums import Objects
+
+def integral(mask):
+    """
+        Summed-area table of a (..., H, W) mask, shaped (..., H+1, W+1)
+        so that table[..., i, j] is the number of set cells above and left of (i, j)
+    """
+    *batch, H, W = mask.shape
+    table = np.zeros((*batch, H + 1, W + 1), dtype=np.int64)
+    np.cumsum(mask, axis=-2, out=table[..., 1:, 1:])
+    np.cumsum(table[..., 1:, 1:], axis=-1, out=table[..., 1:, 1:])
+    return table
+
+def window_sums(table, size, offset, extend):
+    """
+        Sum of the size x size window at (i + offset, j + offset),
+        for every start (i, j) a square with `extend` can have
+    """
+    H, W = table.shape[-2] - 1, table.shape[-1] - 1
+    n_i = H - extend + 1
+    n_j = W - extend + 1
+    top, left = offset, offset
+    bottom, right = offset + size, offset + size
+
+    return (
+        table[..., bottom:bottom + n_i, right:right + n_j]
+        - table[..., top:top + n_i, right:right + n_j]
+        - table[..., bottom:bottom + n_i, left:left + n_j]
+        + table[..., top:top + n_i, left:left + n_j]
+    )
+
+def box_mask(grid):
+    return (grid >= Objects.Box1.value) & (grid <= Objects.Box10.value)
+
+def empty_mask(grid):
+    return grid == Objects.Empty.value
+
+
+class SquareDetector:
+    """
+        Perfect square detection over summed-area tables of the empty and box masks.
+        A square is perfect when its border holds 4*(extend-1) empty cells and its
+        inside holds (extend-2)**2 boxes, and both counts are four table lookups.
+
+        The grid can be a single (H, W) map or a (N, H, W) batch of maps.
+    """
+
+    def __init__(self, grid):
+        self.update(grid)
+
+    def update(self, grid):
+        grid = np.asarray(grid)
+        self.shape = grid.shape
+        self.empty = integral(empty_mask(grid))
+        self.box = integral(box_mask(grid))
+
+    def _count(self, table, i, j, size):
+        return table[..., i + size, j + size] - table[..., i, j + size] - table[..., i + size, j] + table[..., i, j]
+
+    def is_perfect_square(self, start, extend):
+        """ same as enums.is_perfect_square, for a single map """
+        i, j = start
+        border = self._count(self.empty, i, j, extend) - self._count(self.empty, i + 1, j + 1, extend - 2)
+        inside = self._count(self.box, i + 1, j + 1, extend - 2)
+        return bool(border == 4*(extend - 1) and inside == (extend - 2)**2)
+
+    def perfect_starts(self, extend):
+        """
+            Boolean (..., H-extend+1, W-extend+1) array telling which starts
+            hold a perfect square of the given extend
+        """
+        border = window_sums(self.empty, extend, 0, extend) - window_sums(self.empty, extend - 2, 1, extend)
+        inside = window_sums(self.box, extend - 2, 1, extend)
+        return (border == 4*(extend - 1)) & (inside == (extend - 2)**2)
+
+    def find_all(self):
+        """
+            All perfect squares as (batch index..., i, j, extend) arrays.
+            A start can only hold one perfect square (its inside ends where
+            the border begins), so there is one extend per start at most.
+        """
+        H, W = self.shape[-2:]
+        found = []
+        for extend in range(4, min(H, W) + 1):
+            where = np.nonzero(self.perfect_starts(extend))
+            found.append(np.stack(where + (np.full(where[0].size, extend),)))
+
+        if not found:
+            return tuple(np.zeros(0, dtype=np.int64) for _ in range(len(self.shape) + 1))
+
+        return tuple(np.concatenate(found, axis=1))
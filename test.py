@@ -74,14 +74,9 @@ def test_barrier_maker_action(env):
     initial_stamina = env.stamina
 
     # FORCE one perfect square so behavior is deterministic
-    class DummySq:
-        extend = 3
-        age = 10
+    from PerfectSquare import PerfectSquare
 
-        def apply_barrier_maker(self, grid):
-            return grid  # No-op
-
-    env.perfect_squares = [DummySq()]
+    env.perfect_squares = [PerfectSquare((0, 0), 3)]
 
     action = {
         "position": np.array([0, 0]),
@@ -148,3 +143,818 @@ def test_step_returns_correct_format(env):
     assert isinstance(terminated, bool)
     assert isinstance(truncated, bool)
     assert isinstance(info, dict)
+
+
+def test_vec_env_matches_independent_envs():
+    """ShoverWorldVecEnv should give the same rewards and grids as separate envs."""
+    from vec_env import ShoverWorldVecEnv
+
+    n = 4
+    vec = ShoverWorldVecEnv(n, map_name="map2.txt")
+    vec.reset(seed=0)
+    envs = [ShoverWorldEnv(render_mode=None, map_name="map2.txt") for _ in range(n)]
+
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        positions = rng.integers(0, [vec.n_rows, vec.n_cols], size=(n, 2))
+        zs = rng.integers(1, len(Actions) + 1, size=n)
+        obs, rewards, terminated, _, _ = vec.step({"position": positions, "z": zs})
+
+        for k, e in enumerate(envs):
+            _, reward, term, _, _ = e.step({"position": positions[k], "z": int(zs[k])})
+            assert reward == rewards[k]
+            assert term == terminated[k]
+            assert e.stamina == obs["stamina"][k]
+            assert (e.map == obs["grid"][k]).all()
+
+
+def test_push_completes_perfect_square(env):
+    """A push that closes a box block inside an empty ring creates a perfect square."""
+    from PerfectSquare import PerfectSquare
+
+    env.map = np.zeros((6, 6), dtype=int)
+    env.map[1][1] = env.map[1][2] = env.map[2][1] = Objects.Box1.value
+    env.map[3][2] = Objects.Box1.value
+    env.perfect_squares = []
+
+    env.step({"position": np.array([3, 2]), "z": Actions.MoveUp.value})
+
+    assert list(env.perfect_squares) == [PerfectSquare((0, 0), 4)]
+    assert PerfectSquare.find_new_perfect_squares(env.map, []) == list(env.perfect_squares)
+
+
+def test_square_detector_matches_cell_scan():
+    """The summed-area table check agrees with enums.is_perfect_square everywhere."""
+    from enums import is_perfect_square
+    from map_library import read_map
+    from square_detection import SquareDetector
+
+    grid = read_map(settings.Paths.maps_path / "map2.txt")
+    detector = SquareDetector(grid)
+    n, m = grid.shape
+
+    for extend in range(4, min(n, m) + 1):
+        sweep = detector.perfect_starts(extend)
+        for i in range(n - extend + 1):
+            for j in range(m - extend + 1):
+                expected = is_perfect_square(grid, (i, j), extend)
+                assert detector.is_perfect_square((i, j), extend) == expected
+                assert sweep[i, j] == expected
+
+
+def test_object_counters_follow_steps(env):
+    """Box/lava/barrier counters stay in sync with the grid while stepping."""
+    env.map = np.zeros((6, 6), dtype=int)
+    env.map[2][2] = env.map[2][3] = Objects.Box1.value
+    env.map[2][4] = Objects.Lava.value
+    env.map[0][0] = Objects.Barrier.value
+    env.recount_objects()
+    env.debug = True
+
+    _, _, terminated, _, info = env.step({"position": np.array([2, 2]), "z": Actions.MoveRight.value})
+
+    assert (env.box_count, env.lava_count, env.barrier_count) == (1, 1, 1)
+    assert info["box_count"] == 1
+    assert not terminated
+
+    _, _, terminated, _, info = env.step({"position": np.array([2, 3]), "z": Actions.MoveRight.value})
+
+    assert info["box_count"] == 0
+    assert terminated
+
+
+def test_long_chain_push_into_lava(env):
+    """A chain longer than the recursion limit is pushed in one go."""
+    import sys
+
+    length = sys.getrecursionlimit() + 10
+    env.map = np.zeros((1, length + 2), dtype=int)
+    env.map[0][:length] = Objects.Box2.value
+    env.map[0][length] = Objects.Lava.value
+    env.n_rows, env.n_cols = env.map.shape
+    env.perfect_squares = []
+    env.recount_objects()
+    initial_stamina = env.stamina
+
+    _, reward, _, _, info = env.step({"position": np.array([0, 0]), "z": Actions.MoveRight.value})
+
+    assert info["push_chain_length"] == length
+    assert reward == settings.EnvironmentVars.initial_force
+    assert env.stamina == (
+        initial_stamina
+        - settings.EnvironmentVars.unit_force * length
+        + settings.EnvironmentVars.initial_force
+        - settings.EnvironmentVars.initial_force
+    )
+    assert env.map[0][0] == Objects.Empty.value
+    assert env.box_count == length - 1
+
+
+def test_map_library_packs_and_invalidates(tmp_path):
+    """Maps are served from the packed file and re-packed when a source changes."""
+    import os
+    from map_library import MapLibrary, PACK_NAME
+
+    source = tmp_path / "small.txt"
+    source.write_text("0 1\n-100 100\n")
+
+    library = MapLibrary(tmp_path)
+    grid = library.get("small.txt")
+
+    assert grid.dtype == np.int8
+    assert grid.tolist() == [[0, 1], [-100, 100]]
+    assert (tmp_path / PACK_NAME).exists()
+    assert library.get("missing.txt") is None
+
+    source.write_text("5 5 5\n")
+    os.utime(source, ns=(0, 10**9))
+
+    assert library.get("small.txt").tolist() == [[5, 5, 5]]
+    assert MapLibrary(tmp_path).get("small.txt").tolist() == [[5, 5, 5]]
+
+
+def test_state_snapshot_and_undo():
+    """set_state() and undo() bring back the exact state after a few steps."""
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+
+    def signature():
+        squares = [(sq.start, sq.extend, env.perfect_squares.age(sq)) for sq in env.perfect_squares]
+        return env.map.tolist(), env.stamina, env.timestep, dict(env.moving_positions), squares, env.box_count
+
+    actions = [
+        {"position": np.array([1, 2]), "z": Actions.MoveDown.value},
+        {"position": np.array([2, 9]), "z": Actions.MoveLeft.value},
+        {"position": np.array([0, 0]), "z": Actions.BarrierMaker.value},
+    ]
+
+    before = signature()
+    state = env.get_state()
+    for action in actions:
+        env.step(action)
+    env.set_state(state)
+    assert signature() == before
+
+    env.record_undo()
+    for action in actions:
+        env.step(action)
+    for _ in actions:
+        env.undo()
+    assert signature() == before
+    with pytest.raises(RuntimeError, match="nothing to undo"):
+        env.undo() # the log is empty
+
+    env.record_undo(False)
+    env.step(actions[0])
+    with pytest.raises(RuntimeError, match="nothing to undo"):
+        env.undo() # not recording
+
+
+def test_state_hash_tracks_cell_writes():
+    """The incremental zobrist hash matches a fresh hash of the same state."""
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    other = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    start_hash = env.state_hash()
+    assert start_hash == other.state_hash()
+
+    action = {"position": np.array([3, 9]), "z": Actions.MoveDown.value}
+    _, _, _, _, info = env.step(action)
+    assert info["state_hash"] != start_hash
+
+    other.step(action)
+    grid_hash = env.grid_hash
+    env.recount_objects()
+    assert env.grid_hash == grid_hash
+    assert other.state_hash() == info["state_hash"]
+
+
+def test_benchmark_compare_flags_regressions():
+    """Only slowdowns beyond the threshold are reported as regressions."""
+    from benchmark import compare
+
+    baseline = {"results": {
+        "a": {"steps_per_sec": 1000.0, "reset_ms": 1.0},
+        "b": {"steps_per_sec": 1000.0, "reset_ms": 1.0},
+    }}
+    current = {"results": {
+        "a": {"steps_per_sec": 950.0, "reset_ms": 1.05},
+        "b": {"steps_per_sec": 500.0, "reset_ms": 3.0},
+        "new": {"steps_per_sec": 1.0, "reset_ms": 100.0},
+    }}
+
+    regressions = compare(baseline, current, threshold=0.1)
+
+    assert [(r["case"], r["metric"]) for r in regressions] == [("b", "steps_per_sec"), ("b", "reset_ms")]
+
+
+def test_profiler_reports_step_phases(tmp_path):
+    """An attached profiler times every phase and feeds its sinks; without one info has no perf."""
+    from profiling import StepProfiler, JsonDump
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    action = {"position": np.array([3, 9]), "z": Actions.MoveDown.value}
+    _, _, _, _, info = env.step(action)
+    assert "perf" not in info
+
+    records = []
+    dump_path = tmp_path / "perf.json"
+    env.profiler = StepProfiler(window=4, sinks=[lambda profiler, record: records.append(record), JsonDump(dump_path, every=2)])
+    _, info = env.reset()
+    assert info["perf"]["record"]["kind"] == "reset"
+    assert "load_map" in info["perf"]["record"]["phases"]
+
+    for _ in range(6):
+        _, _, _, _, info = env.step(action)
+
+    record = info["perf"]["record"]
+    assert set(record["phases"]) == {"action", "flush", "ageing", "detection", "dissolution", "finish", "total"}
+    assert records[-1] is record and len(records) == 7
+    assert env.profiler.histograms[("step", "total")].counts.sum() == 4
+    assert env.profiler.totals[("step", "cells_touched")] == sum(r["counts"]["cells_touched"] for r in records[1:]) > 0
+    assert dump_path.exists()
+
+
+def test_process_vec_env_matches_independent_envs():
+    """Workers writing into shared memory produce the same batch as stepping the envs in process."""
+    from process_vec_env import ShoverWorldProcVecEnv
+
+    num_envs = 4
+    vec = ShoverWorldProcVecEnv(num_envs, num_workers=2, map_name="map2.txt")
+    envs = [ShoverWorldEnv(render_mode=None, map_name="map2.txt") for _ in range(num_envs)]
+    try:
+        obs, _ = vec.reset(seed=0)
+        rng = np.random.default_rng(0)
+        n_rows, n_cols = obs["grid"].shape[1:]
+        for _ in range(30):
+            position = np.stack([rng.integers(0, n_rows, num_envs), rng.integers(0, n_cols, num_envs)], axis=1)
+            z = rng.integers(1, len(Actions) + 1, num_envs)
+            obs, rewards, terminated, _, _ = vec.step({"position": position, "z": z})
+
+            for k, env in enumerate(envs):
+                _, reward, done, _, _ = env.step({"position": position[k], "z": int(z[k])})
+                assert reward == rewards[k] and done == terminated[k]
+                np.testing.assert_array_equal(obs["grid"][k], env.map)
+                assert obs["stamina"][k] == env.stamina
+    finally:
+        vec.close()
+
+
+def test_compact_record_observation(monkeypatch):
+    """Compact envs keep int8 grids and write their observations into the caller's record."""
+    monkeypatch.setattr(settings.EnvironmentVars, "compact", True)
+    monkeypatch.setattr(settings.EnvironmentVars, "observation", "record")
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    monkeypatch.setattr(settings.EnvironmentVars, "compact", False)
+    monkeypatch.setattr(settings.EnvironmentVars, "observation", "dict")
+    reference = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+
+    assert env.map.dtype == np.int8
+    replay = np.zeros(4, dtype=env.observation_space.dtype)
+    action = {"position": np.array([3, 9]), "z": Actions.MoveDown.value}
+    for t in range(4):
+        env.set_obs_buffer(replay[t, ...])
+        obs, _, _, _, _ = env.step(action)
+        ref_obs, _, _, _, _ = reference.step(action)
+
+        assert env.observation_space.contains(obs)
+        assert np.shares_memory(obs, replay)
+        np.testing.assert_array_equal(replay[t]["grid"], ref_obs["grid"])
+        assert replay[t]["stamina"] == ref_obs["stamina"]
+        assert replay[t]["previous_action"] == Actions.MoveDown.value
+
+    assert tuple(replay[0]["previous_selected_position"]) == (4, 9)
+    assert tuple(replay[1]["previous_selected_position"]) == (-1, -1)
+
+
+def test_action_mask_follows_steps():
+    """The incrementally updated mask matches a fresh one, and masked moves always push a box."""
+    from action_mask import action_mask
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    rng = np.random.default_rng(0)
+    for _ in range(40):
+        mask = env.action_mask()
+        np.testing.assert_array_equal(mask[..., :4], action_mask(env.map)[..., :4])
+
+        legal = np.argwhere(mask[..., :4])
+        i, j, k = legal[rng.integers(len(legal))]
+        _, _, terminated, _, info = env.step({"position": np.array([i, j]), "z": int(k) + 1})
+        assert info["push_chain_length"] > 0
+        if terminated:
+            env.reset()
+
+
+def test_map_generator_is_seeded_and_streams_packs(tmp_path):
+    """Generated maps depend only on the generator, keep exact counts and round-trip through a pack."""
+    from map_generator import MapGenerator, has_push
+    from map_library import MapPack
+
+    generator = MapGenerator(8, 8, boxes=5, lavas=2, barriers=3, box_types=(1, 2, 3), squares=1, require_push=True, chunk_size=16)
+    grids = generator.generate(40, np.random.default_rng(0))
+    np.testing.assert_array_equal(grids, generator.generate(40, np.random.default_rng(0)))
+    assert grids.shape == (40, 8, 8) and grids.dtype == np.int8
+    assert has_push(grids).all()
+    assert set(np.unique(grids)) <= {Objects.Lava.value, Objects.Empty.value, 1, 2, 3, Objects.Barrier.value}
+
+    exact = MapGenerator(8, 8, boxes=5, lavas=2, barriers=3).generate(20, np.random.default_rng(1))
+    assert ((exact >= 1) & (exact <= 10)).sum(axis=(1, 2)).tolist() == [5] * 20
+    assert (exact == Objects.Barrier.value).sum(axis=(1, 2)).tolist() == [3] * 20
+
+    generator.write_pack(tmp_path / "generated.pack", 40, np.random.default_rng(0))
+    pack = MapPack(tmp_path / "generated.pack")
+    assert len(pack) == 40
+    np.testing.assert_array_equal(pack.get("map_0000039"), grids[39])
+
+    # random maps of the environment follow the seed given to reset
+    env = ShoverWorldEnv(render_mode=None)
+    other = ShoverWorldEnv(render_mode=None)
+    np.testing.assert_array_equal(env.map, other.map)
+    env.reset(seed=7)
+    other.reset(seed=7)
+    np.testing.assert_array_equal(env.map, other.map)
+
+
+def test_map_generator_keeps_counts_with_squares_planted():
+    """Planted squares are detected and the counted objects are placed around them, not over them."""
+    from map_generator import MapGenerator
+    from square_detection import SquareDetector
+
+    grids = MapGenerator(10, 10, boxes=5, lavas=2, barriers=3, squares=1).generate(50, np.random.default_rng(2))
+    assert (grids == Objects.Barrier.value).sum(axis=(1, 2)).tolist() == [3] * 50
+    assert (grids == Objects.Lava.value).sum(axis=(1, 2)).tolist() == [2] * 50
+    assert set(((grids >= 1) & (grids <= 10)).sum(axis=(1, 2)).tolist()) <= {5 + 2 * 2, 5 + 3 * 3} # plus the square's boxes
+    assert set(SquareDetector(grids).find_all()[0].tolist()) == set(range(50))
+
+    with pytest.raises(ValueError):
+        MapGenerator(6, 6, boxes=10, lavas=2, barriers=3, squares=1)
+
+
+def test_trajectory_replay_is_bit_exact(tmp_path):
+    """Recorded episodes replay to the same rewards, and any step can be rebuilt from the keyframes."""
+    from trajectory import TrajectoryRecorder, TrajectoryReplayer, pack_state
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    recorder = TrajectoryRecorder(tmp_path, chunk_steps=7, keyframe_every=4, buffer_steps=5)
+    rng = np.random.default_rng(0)
+    states = []
+    for _ in range(2):
+        env.reset()
+        recorder.begin_episode(env)
+        for _ in range(15):
+            legal = np.argwhere(env.action_mask())
+            i, j, k = legal[rng.integers(len(legal))]
+            recorder.step(env, {"position": np.array([i, j]), "z": int(k) + 1})
+            states.append(pack_state(env))
+    recorder.close()
+
+    replayer = TrajectoryReplayer(tmp_path)
+    assert len(replayer) == 2
+    assert replayer.verify() == 30
+    assert pack_state(replayer.state_at(1, 10)) == states[15 + 9]
+    assert pack_state(replayer.state_at(0, 15)) == states[14]
+
+    steps = np.memmap(tmp_path / "steps_00000.bin", dtype=replayer.steps(0).dtype, mode="r+")
+    steps[3]["reward"] += 1
+    steps.flush()
+    with pytest.raises(RuntimeError):
+        TrajectoryReplayer(tmp_path).verify()
+
+
+def test_trajectory_recorder_refuses_steps_outside_an_episode(tmp_path):
+    """A step recorded after end_episode() and before begin_episode() raises and is not logged."""
+    from trajectory import TrajectoryRecorder, TrajectoryReplayer
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    recorder = TrajectoryRecorder(tmp_path)
+    env.reset()
+    recorder.begin_episode(env)
+    i, j, k = np.argwhere(env.action_mask())[0]
+    recorder.step(env, {"position": np.array([i, j]), "z": int(k) + 1})
+    recorder.end_episode()
+
+    i, j, k = np.argwhere(env.action_mask())[0]
+    with pytest.raises(RuntimeError, match="outside an episode"):
+        recorder.step(env, {"position": np.array([i, j]), "z": int(k) + 1})
+    recorder.close()
+
+    replayer = TrajectoryReplayer(tmp_path)
+    assert len(replayer) == 1 and replayer.verify() == 1
+
+
+def test_rgb_array_render_uses_the_palette():
+    """rgb_array frames are built without pygame, one palette color per cell."""
+    from rendering import PALETTE
+
+    env = ShoverWorldEnv(render_mode="rgb_array", map_name="map2.txt")
+    frame = env.render()
+    size = env.render_cell_size
+    assert frame.shape == (env.n_rows * size, env.n_cols * size, 3) and frame.dtype == np.uint8
+
+    centers = frame[size // 2::size, size // 2::size]
+    np.testing.assert_array_equal(centers, PALETTE[env.map.astype(np.uint8)])
+
+
+def test_solver_finds_the_best_return():
+    """The solver proves the best return of map1 in one or two processes, and its actions replay to it."""
+    from solver import solve, replay
+
+    solution = solve("map1.txt")
+    assert solution.optimal and solution.score == solution.bound == 40
+    assert replay("map1.txt", solution.actions) == (solution.reward, solution.stamina)
+
+    parallel = solve("map1.txt", workers=2, batch_size=8)
+    assert parallel.optimal and parallel.score == 40
+
+    budget = solve("map2.txt", max_memory=1 << 20)
+    assert budget.status == "memory" and budget.score <= budget.bound
+
+
+def test_solver_keeps_shorter_paths_to_a_seen_state(tmp_path, monkeypatch):
+    """A state reached again with the same score in fewer steps is still expanded when steps are the limit."""
+    from solver import solve
+
+    (tmp_path / "tight.txt").write_text(
+        "0 -100 0 0 100\n"
+        "0 1 0 0 1\n"
+        "0 0 0 0 0\n"
+        "0 1 0 0 0\n"
+        "0 0 1 0 0\n"
+    )
+    monkeypatch.setattr(settings.Paths, "maps_path", tmp_path)
+    monkeypatch.setattr(settings.EnvironmentVars, "max_timestep", 5)
+
+    solution = solve("tight.txt")
+    assert solution.optimal and solution.score == 120 # three boxes into the lava
+
+
+def test_rollouts_are_sharded_and_aggregated(tmp_path):
+    """Workers reusing one env give the same episodes as a single process, streamed and aggregated."""
+    import json
+    from rollout import make_jobs, run
+
+    jobs = make_jobs(["map1.txt", "map2.txt", "random"], range(6), ["random", "legal"])
+    output = tmp_path / "episodes.jsonl"
+    summary = run(jobs, output, workers=2, shard_size=5, max_steps=50)
+    single = run(jobs, workers=1, shard_size=5, max_steps=50)
+
+    assert summary["episodes"] == len(jobs) == 36
+    assert summary["groups"] == single["groups"]
+    assert summary["steps"] == single["steps"] <= 50 * len(jobs)
+
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted((r["map"], r["seed"], r["policy"]) for r in results) == sorted(jobs)
+    lengths = [r["length"] for r in results if r["map"] == "map2.txt" and r["policy"] == "legal"]
+    assert summary["groups"]["map2.txt/legal"]["length"]["mean"] == pytest.approx(np.mean(lengths))
+
+
+def test_legal_policy_counts_each_special_action_once():
+    """Barrier Maker and Hellify are drawn as one action each, not once per cell of the mask."""
+    from rollout import legal_policy
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    env.reset(seed=0)
+    mask = env.action_mask()
+    n_moves = int(mask[..., :Actions.BarrierMaker.value - 1].sum())
+    assert len(env.perfect_squares) and mask[0, 0, Actions.BarrierMaker.value - 1] and mask[0, 0, Actions.Hellify.value - 1]
+
+    rng = np.random.default_rng(0)
+    actions = [legal_policy(env, rng) for _ in range(2000)]
+    assert all(mask[a["position"][0], a["position"][1], a["z"] - 1] for a in actions)
+    specials = [a["z"] for a in actions if a["z"] >= Actions.BarrierMaker.value]
+    assert set(specials) == {Actions.BarrierMaker.value, Actions.Hellify.value}
+    assert len(specials) / len(actions) == pytest.approx(2 / (n_moves + 2), abs=0.01)
+
+
+def test_step_many_matches_sequential_steps():
+    """step_many gives the rewards, stamina and grids of calling step() for each action, and stops at termination."""
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    other = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    rng = np.random.default_rng(1)
+    actions = np.stack([rng.integers(0, env.n_rows, 60), rng.integers(0, env.n_cols, 60), rng.integers(1, len(Actions) + 1, 60)], axis=1)
+    actions[::3, 2] = Actions.MoveDown.value
+
+    grids, rewards, terminated, _, info = env.step_many(actions, obs="grids")
+    assert info["steps"] == len(rewards) == len(grids) == 60
+    for t, (i, j, z) in enumerate(actions):
+        _, reward, done, _, step_info = other.step({"position": np.array([i, j]), "z": int(z)})
+        assert reward == rewards[t] and done == terminated[t]
+        np.testing.assert_array_equal(grids[t], other.map)
+    assert env.stamina == other.stamina and info["state_hash"] == step_info["state_hash"]
+
+    env.stamina = 5
+    obs, rewards, terminated, _, info = env.step_many(np.tile([0, 0, Actions.BarrierMaker.value], (20, 1)))
+    assert info["steps"] == len(rewards) < 20 and terminated[-1] and not terminated[:-1].any()
+    assert obs["stamina"] == env.stamina <= 0
+
+
+def test_chunked_grid_steps_like_the_dense_grid(monkeypatch):
+    """A chunked env follows the dense one step for step; a 4096x4096 board only allocates its non empty tiles."""
+    from chunked_grid import ChunkedGrid, changed_cells
+    from rendering import render_rgb
+
+    dense = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    monkeypatch.setattr(settings.EnvironmentVars, "grid_backend", "chunked")
+    monkeypatch.setattr(settings.EnvironmentVars, "tile_size", 4)
+    monkeypatch.setattr(settings.EnvironmentVars, "debug", True)
+    chunked = ShoverWorldEnv(render_mode="rgb_array", map_name="map2.txt")
+    assert isinstance(chunked.map, ChunkedGrid)
+
+    rng = np.random.default_rng(0)
+    for _ in range(80):
+        legal = np.argwhere(dense.action_mask())
+        i, j, k = legal[rng.integers(len(legal))]
+        action = {"position": np.array([i, j]), "z": int(k) + 1}
+        before = chunked.map.copy()
+        _, reward, _, _, _ = dense.step(action)
+        assert chunked.step(action)[1] == reward and chunked.stamina == dense.stamina
+        np.testing.assert_array_equal(np.asarray(chunked.map), dense.map)
+        assert len(changed_cells(chunked.map, before)) == np.count_nonzero(np.asarray(before) != dense.map)
+        assert [sq.key() for sq in chunked.perfect_squares] == [sq.key() for sq in dense.perfect_squares]
+        np.testing.assert_array_equal(chunked.action_mask(), dense.action_mask())
+    np.testing.assert_array_equal(chunked.render(), render_rgb(dense.map, chunked.render_cell_size))
+
+    monkeypatch.setattr(settings.EnvironmentVars, "n_rows", 4096)
+    monkeypatch.setattr(settings.EnvironmentVars, "n_cols", 4096)
+    monkeypatch.setattr(settings.EnvironmentVars, "tile_size", 64)
+    large = ShoverWorldEnv(render_mode=None)
+    assert large.map.shape == (4096, 4096) and large.box_count == settings.EnvironmentVars.number_of_boxes
+    assert large.map.nbytes() < 200_000 # a dense int8 grid would take 16 MB
+    i, j = large.map.box_cells()[0]
+    large.step({"position": np.array([i, j]), "z": Actions.MoveUp.value if i > 0 else Actions.MoveDown.value})
+    assert large.box_count == large.map.count_objects()[0] and large.timestep == 1
+
+
+def test_pooled_envs_draw_different_random_maps():
+    """Envs of a process vec env or a server pool are seeded apart, so their random maps differ."""
+    from process_vec_env import ShoverWorldProcVecEnv
+    from env_server import EnvServer
+
+    vec = ShoverWorldProcVecEnv(4, num_workers=2)
+    try:
+        obs, _ = vec.reset()
+        grids = [grid.tobytes() for grid in obs["grid"]]
+        assert len(set(grids)) == 4
+    finally:
+        vec.close()
+
+    server = EnvServer(3)
+    assert len({np.asarray(env.map).tobytes() for env in server.envs}) == 3
+
+
+def test_env_server_batches_clients(tmp_path):
+    """Clients stepping pooled envs through the server see the same episodes as local envs."""
+    import asyncio
+    import threading
+    from env_server import EnvServer
+    from env_client import EnvClient
+
+    path = str(tmp_path / "envs.sock")
+    loop = asyncio.new_event_loop()
+    server = EnvServer(3, map_name="map2.txt", max_pending=4)
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start_unix(path))
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(10)
+    try:
+        clients = [EnvClient(path, timeout=10) for _ in range(3)]
+        with pytest.raises(RuntimeError):
+            EnvClient(path, timeout=10) # the pool is full
+
+        local = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+        rng = np.random.default_rng(0)
+        for client in clients:
+            obs, _ = client.reset(seed=0)
+            np.testing.assert_array_equal(obs["grid"], local.reset(seed=0)[0]["grid"])
+            actions = [{"position": np.array([rng.integers(8), rng.integers(12)]), "z": int(rng.integers(1, 7))} for _ in range(20)]
+            for action in actions: # pipelined past max_pending
+                client.step_async(action)
+            for action in actions:
+                obs, reward, terminated, _, _ = client.step_wait()
+                _, local_reward, local_terminated, _, _ = local.step(action)
+                assert reward == local_reward and terminated == local_terminated
+                assert obs["stamina"] == local.stamina
+            np.testing.assert_array_equal(obs["grid"], local.map)
+
+        metrics = clients[0].metrics()
+        assert metrics["requests"] == 3 * 22 + 1 and metrics["envs_in_use"] == 3 # open, reset and 20 steps each, the failed open
+        assert [c["latency_us"]["count"] for c in metrics["clients"]] == [22, 22, 22]
+        for client in clients:
+            client.close()
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(10)
+
+
+def test_deltas_rebuild_the_grid_and_squares(monkeypatch):
+    """Applying the deltas of every step to the first keyframe gives the env's grid and squares."""
+    from observation import apply_delta
+
+    monkeypatch.setattr(settings.EnvironmentVars, "deltas", True)
+    monkeypatch.setattr(settings.EnvironmentVars, "delta_keyframe_every", 25)
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    _, info = env.reset()
+    grid = np.zeros_like(env.map)
+    squares = set()
+    apply_delta(grid, squares, info["delta"])
+
+    rng = np.random.default_rng(3)
+    keyframes = 0
+    changed = 0
+    for _ in range(60):
+        legal = np.argwhere(env.action_mask())
+        i, j, k = legal[rng.integers(len(legal))] if rng.random() < 0.8 else (0, 0, Actions.BarrierMaker.value - 1)
+        _, _, _, _, info = env.step({"position": np.array([i, j]), "z": int(k) + 1})
+        delta = info["delta"]
+        assert delta["changes"].dtype == np.int32 # coordinates of chunked maps go past int16
+        keyframes += delta["keyframe"] is not None
+        if delta["keyframe"] is None:
+            changed += len(delta["changes"])
+            apply_delta(grid, squares, delta)
+        else:
+            keyframe_squares = set(delta["squares"])
+            apply_delta(grid.copy(), squares, {**delta, "keyframe": None})
+            assert squares == keyframe_squares
+            apply_delta(grid, squares, delta)
+        np.testing.assert_array_equal(grid, env.map)
+        assert squares == {sq.key() for sq in env.perfect_squares}
+
+    assert keyframes == 2 and changed > 0
+
+    env.step_many([[0, 0, Actions.BarrierMaker.value]] * 3)
+    apply_delta(grid, squares, env.step({"position": np.array([0, 0]), "z": Actions.MoveUp.value})[4]["delta"])
+    np.testing.assert_array_equal(grid, env.map)
+
+
+@pytest.mark.parametrize("mode", ["dict", "record", "tensor"])
+def test_observations_are_in_the_observation_space(monkeypatch, mode):
+    """Every observation mode returns what its observation_space declares, before and after pushes."""
+    monkeypatch.setattr(settings.EnvironmentVars, "observation", mode)
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    obs, _ = env.reset(seed=0)
+    assert env.observation_space.contains(obs)
+
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        legal = np.argwhere(env.action_mask()[..., :Actions.BarrierMaker.value - 1])
+        i, j, k = legal[rng.integers(len(legal))]
+        obs, _, _, _, _ = env.step({"position": np.array([i, j]), "z": int(k) + 1})
+        assert env.observation_space.contains(obs)
+
+
+def test_tensor_observations_are_kept_up_to_date(monkeypatch):
+    """The incrementally updated planes equal planes rebuilt from the grid, for an env and the vec env."""
+    from observation import TensorObservation, SQUARE
+    from vec_env import ShoverWorldVecEnv
+
+    monkeypatch.setattr(settings.EnvironmentVars, "observation", "tensor")
+    n = 3
+    envs = [ShoverWorldEnv(render_mode=None, map_name="map2.txt") for _ in range(n)]
+    vec = ShoverWorldVecEnv(n, map_name="map2.txt")
+    vec_obs, _ = vec.reset(seed=0)
+    assert vec.observation_space.contains(vec_obs)
+    np.testing.assert_array_equal(vec_obs[0], envs[0].reset()[0])
+
+    rng = np.random.default_rng(5)
+    squares_seen = int(vec_obs[0, SQUARE].any())
+    for t in range(80):
+        positions, zs = np.zeros((n, 2), dtype=int), np.zeros(n, dtype=int)
+        for k, e in enumerate(envs):
+            legal = np.argwhere(e.action_mask()[..., :Actions.BarrierMaker.value - 1])
+            i, j, z = legal[rng.integers(len(legal))] if len(legal) and rng.random() < 0.9 else (0, 0, Actions.BarrierMaker.value - 1)
+            positions[k], zs[k] = (i, j), z + 1
+        vec_obs, _, vec_terminated, _, _ = vec.step({"position": positions, "z": zs})
+
+        for k, e in enumerate(envs):
+            obs, _, terminated, truncated, _ = e.step({"position": positions[k], "z": int(zs[k])})
+            assert e.observation_space.contains(obs)
+            reference = TensorObservation(e.map.shape, obs.dtype, e.perf_sq_initial_age)
+            reference.rebuild(e.map, e.perfect_squares)
+            np.testing.assert_array_equal(obs, reference.planes)
+            if not vec_terminated[k]:
+                np.testing.assert_array_equal(vec_obs[k], obs)
+            squares_seen += int(obs[SQUARE].any())
+            if terminated or truncated:
+                e.reset()
+
+        if t == 40: # restoring a snapshot rebuilds the planes
+            state = envs[0].get_state()
+            envs[0].step({"position": np.array([0, 0]), "z": Actions.BarrierMaker.value})
+            envs[0].set_state(state)
+
+    assert squares_seen > 1
+
+
+def test_core_steps_like_the_env_without_gymnasium():
+    """ShoverWorldCore gives the env's transitions and random maps, and imports neither gymnasium nor pygame."""
+    import subprocess
+    import sys
+    from core import ShoverWorldCore
+
+    code = "import sys, core, rollout, solver, vec_worker, env_server; print(sorted({'gymnasium', 'pygame'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=settings.Paths.BASE_DIR)
+    assert result.stdout.strip() == "[]"
+
+    for map_name in ("map2.txt", None):
+        core, env = ShoverWorldCore(map_name=map_name), ShoverWorldEnv(None, map_name=map_name)
+        core.reset(seed=7)
+        env.reset(seed=7)
+        np.testing.assert_array_equal(core.map, env.map)
+
+        rng = np.random.default_rng(7)
+        for _ in range(50):
+            i, j, z = rng.integers((0, 0, 1), (env.n_rows, env.n_cols, len(Actions) + 1))
+            action = {"position": np.array([i, j]), "z": int(z)}
+            _, reward, terminated, _, info = env.step(action)
+            _, core_reward, core_terminated, _, core_info = core.step(action)
+            assert (core_reward, core_terminated, core.stamina) == (reward, terminated, env.stamina)
+            assert core_info["state_hash"] == info["state_hash"]
+            if terminated:
+                break
+
+
+def test_large_dense_grids_hash_without_a_table(monkeypatch):
+    """Above TABLE_MAX_CELLS the cell keys are computed, and the incremental hash still matches a fresh one."""
+    import zobrist
+
+    monkeypatch.setattr(settings.EnvironmentVars, "n_rows", 520)
+    monkeypatch.setattr(settings.EnvironmentVars, "n_cols", 520)
+    monkeypatch.setattr(settings.EnvironmentVars, "number_of_boxes", 2000)
+    monkeypatch.setattr(settings.EnvironmentVars, "debug", True) # recounts and rehashes after every step
+    env = ShoverWorldEnv(render_mode=None, map_name=None)
+    assert isinstance(env.zobrist, zobrist.HashedZobristTable)
+
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        legal = np.argwhere(env.action_mask()[..., :Actions.BarrierMaker.value - 1])
+        i, j, k = legal[rng.integers(len(legal))]
+        env.step({"position": np.array([i, j]), "z": int(k) + 1})
+    assert env.grid_hash == env.zobrist.grid_hash(env.map)
+
+
+def test_step_many_runs_with_profiling_on(monkeypatch):
+    """step_many does not profile its steps, and does not break the profiler of step()."""
+    monkeypatch.setattr(settings.EnvironmentVars, "profile", True)
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    reference = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+
+    actions = [[3, 9, Actions.MoveDown.value], [0, 0, Actions.BarrierMaker.value]]
+    _, rewards, _, _, info = env.step_many(actions)
+    assert "perf" not in info
+    assert list(rewards) == [reference.step({"position": np.array(a[:2]), "z": a[2]})[1] for a in actions]
+    assert env.profiler.records["step"] == 0
+
+    _, _, _, _, info = env.step({"position": np.array([3, 9]), "z": Actions.MoveDown.value})
+    assert info["perf"]["record"]["kind"] == "step"
+
+
+def test_map_library_parses_only_the_maps_asked_for(tmp_path, monkeypatch):
+    """Files that are not maps do not break the others, and an unchanged map is not parsed again."""
+    import os
+    import map_library
+    from map_library import MapLibrary
+
+    (tmp_path / "a.txt").write_text("1 0\n0 0\n")
+    (tmp_path / "b.txt").write_text("100 100\n")
+    (tmp_path / "notes.txt").write_text("not a map\n")
+    (tmp_path / "empty.txt").write_text("")
+
+    parsed = []
+    read_map = map_library.read_map
+    monkeypatch.setattr(map_library, "read_map", lambda path: parsed.append(path.name) or read_map(path))
+
+    library = MapLibrary(tmp_path)
+    assert library.get("a.txt").tolist() == [[1, 0], [0, 0]]
+    assert library.get("b.txt").tolist() == [[100, 100]]
+    with pytest.raises(ValueError, match="notes.txt is not a map"):
+        library.get("notes.txt")
+
+    (tmp_path / "b.txt").write_text("5\n")
+    os.utime(tmp_path / "b.txt", ns=(0, 10**9))
+    assert library.get("b.txt").tolist() == [[5]]
+    assert library.get("a.txt").tolist() == [[1, 0], [0, 0]]
+    assert parsed == ["a.txt", "b.txt", "notes.txt", "b.txt"]
+
+    assert set(library.rebuild()) == {"notes.txt", "empty.txt"}
+    assert MapLibrary(tmp_path).get("b.txt").tolist() == [[5]]
+
+
+def test_assigned_squares_start_at_age_zero():
+    """Squares assigned to perfect_squares without a birth are born at the current clock."""
+    from PerfectSquare import PerfectSquare
+
+    env = ShoverWorldEnv(render_mode=None, map_name="map2.txt")
+    for _ in range(15):
+        env.step({"position": np.array([0, 0]), "z": Actions.MoveUp.value})
+    square = next(iter(env.perfect_squares), None) or PerfectSquare((0, 1), 5)
+    env.perfect_squares = [PerfectSquare(square.start, square.extend)]
+
+    assert [env.perfect_squares.age(sq) for sq in env.perfect_squares] == [0]
+    env.step({"position": np.array([0, 0]), "z": Actions.MoveUp.value})
+    assert [env.perfect_squares.age(sq) for sq in env.perfect_squares] == [1]
@@ -0,0 +1,300 @@
+"""
+    Compact episode logs and their deterministic replay.
+
+        recorder = TrajectoryRecorder("runs/traj")
+        obs, info = env.reset()
+        recorder.begin_episode(env)
+        obs, reward, terminated, truncated, info = recorder.step(env, action)
+        ...
+        recorder.close()
+
+        replayer = TrajectoryReplayer("runs/traj")
+        env = replayer.state_at(episode=3, t=120) # the env after 120 steps of episode 3
+        replayer.verify()
+
+    A directory holds:
+        trajectory.json        format, chunk size and the rule settings of the recording
+        steps_00000.bin, ...   (i, j, z) int16, reward float32, flags uint8 per step, chunk_steps per file
+        episodes.bin           first step, length and keyframes of every episode
+        keyframes.bin          full states every keyframe_every steps (the first one is the initial map)
+        keyframe_index.bin     step, offset and size of every keyframe
+    Every file is a flat array of fixed size records, so they are read through memory maps.
+"""
+import json
+import os
+from pathlib import Path
+import numpy as np
+import settings
+from PerfectSquare import PerfectSquare, PerfectSquareRegistry
+
+STEP_DTYPE = np.dtype([("action", np.int16, (3,)), ("reward", np.float32), ("flags", np.uint8)])
+EPISODE_DTYPE = np.dtype([("first_step", np.int64), ("length", np.int64), ("first_keyframe", np.int64), ("keyframes", np.int64)])
+KEYFRAME_DTYPE = np.dtype([("step", np.int64), ("offset", np.int64), ("size", np.int64)])
+
+TERMINATED = 1
+TRUNCATED = 2
+
+# settings a replay depends on, they have to match the recording
+RULE_SETTINGS = ("initial_stamina", "initial_force", "unit_force", "perf_sq_initial_age", "max_timestep")
+
+HEAD_SIZE = 13
+
+
+def pack_state(env):
+    """ the state of a ShoverWorldEnv as bytes """
+    squares = np.array([(sq.start_i, sq.start_j, sq.extend, sq.birth) for sq in env.perfect_squares], dtype=np.int64).reshape(-1, 4)
+    dirty = np.array(env.dirty_cells, dtype=np.int64).reshape(-1, 2)
+    if env.moving_positions:
+        (mi, mj), mz = next(iter(env.moving_positions.items()))
+    else:
+        (mi, mj), mz = (-1, -1), 0
+
+    head = np.array([
+        env.n_rows, env.n_cols, env.stamina, env.timestep, env.last_z or 0, mi, mj, mz,
+        env.perfect_squares.clock, len(squares), len(dirty), env.terminated, env.truncated,
+    ], dtype=np.int64)
+    return head.tobytes() + squares.tobytes() + dirty.tobytes() + np.asarray(env.map, dtype=np.int8).tobytes()
+
+def unpack_state(env, blob):
+    """ puts a ShoverWorldEnv in the state packed by pack_state() """
+    head = np.frombuffer(blob, dtype=np.int64, count=HEAD_SIZE)
+    n_rows, n_cols, stamina, timestep, last_z, mi, mj, mz, clock, n_squares, n_dirty, terminated, truncated = (int(v) for v in head)
+
+    offset = HEAD_SIZE * 8
+    squares = np.frombuffer(blob, dtype=np.int64, count=4 * n_squares, offset=offset).reshape(-1, 4)
+    offset += squares.nbytes
+    dirty = np.frombuffer(blob, dtype=np.int64, count=2 * n_dirty, offset=offset).reshape(-1, 2)
+    offset += dirty.nbytes
+    grid = np.frombuffer(blob, dtype=np.int8, count=n_rows * n_cols, offset=offset).reshape(n_rows, n_cols)
+
+    env.n_rows, env.n_cols = n_rows, n_cols
+    env.map = grid.astype(env.grid_dtype)
+    env.map_shared = False
+    env.stamina = stamina
+    env.timestep = timestep
+    env.last_z = last_z or None
+    env.moving_positions = {(mi, mj): mz} if mz else {}
+    env.perfect_squares = PerfectSquareRegistry(
+        [PerfectSquare((int(i), int(j)), int(extend), int(birth)) for i, j, extend, birth in squares], clock
+    )
+    env.dirty_cells = [(int(i), int(j)) for i, j in dirty]
+    env.writes = []
+    env.reward = 0
+    env.terminated = bool(terminated)
+    env.truncated = bool(truncated)
+    env.recount_objects()
+    if env.undo_log is not None:
+        env.undo_log = []
+
+
+class TrajectoryRecorder:
+    """
+        Appends episodes to a trajectory directory. Steps are buffered and written
+        in blocks; call close() (or flush()) before reading the directory.
+    """
+
+    def __init__(self, path, chunk_steps=1 << 20, keyframe_every=256, buffer_steps=4096):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.path / "trajectory.json"
+        if meta_path.exists():
+            with open(meta_path) as file:
+                meta = json.load(file)
+            chunk_steps, keyframe_every = meta["chunk_steps"], meta["keyframe_every"]
+        else:
+            meta = {
+                "version": 1,
+                "chunk_steps": chunk_steps,
+                "keyframe_every": keyframe_every,
+                "settings": {key: getattr(settings.EnvironmentVars, key) for key in RULE_SETTINGS},
+            }
+            with open(meta_path, "w") as file:
+                json.dump(meta, file, indent=2)
+
+        self.chunk_steps = chunk_steps
+        self.keyframe_every = keyframe_every
+
+        self.total_steps = sum(os.path.getsize(p) for p in self.path.glob("steps_*.bin")) // STEP_DTYPE.itemsize
+        self._episodes = open(self.path / "episodes.bin", "ab")
+        self._keyframes = open(self.path / "keyframes.bin", "ab")
+        self._keyframe_index = open(self.path / "keyframe_index.bin", "ab")
+        self.total_keyframes = self._keyframe_index.tell() // KEYFRAME_DTYPE.itemsize
+
+        self._buffer = np.zeros(buffer_steps, dtype=STEP_DTYPE)
+        self._buffered = 0
+        self._episode = None # [first step, length, first keyframe, keyframes] of the open episode
+
+    def begin_episode(self, env):
+        """ starts an episode from the current (just reset) state of env """
+        self.end_episode()
+        self._episode = [self.total_steps + self._buffered, 0, self.total_keyframes, 0]
+        self._add_keyframe(env)
+
+    def record(self, env, action, reward, terminated, truncated):
+        """ logs a step that env just took, in the episode begin_episode() started """
+        if self._episode is None:
+            raise RuntimeError("record() called outside an episode, call begin_episode() after each reset")
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+        record = self._buffer[self._buffered]
+        record["action"] = (action["position"][0], action["position"][1], action["z"])
+        record["reward"] = reward
+        record["flags"] = TERMINATED * bool(terminated) | TRUNCATED * bool(truncated)
+        self._buffered += 1
+
+        self._episode[1] += 1
+        if terminated or truncated:
+            self.end_episode()
+        elif self._episode[1] % self.keyframe_every == 0:
+            self._add_keyframe(env)
+
+    def step(self, env, action):
+        """ env.step(action), recorded """
+        res = env.step(action)
+        self.record(env, action, res[1], res[2], res[3])
+        return res
+
+    def end_episode(self):
+        if self._episode is None:
+            return
+        self._episodes.write(np.array(tuple(self._episode), dtype=EPISODE_DTYPE).tobytes())
+        self._episode = None
+
+    def _add_keyframe(self, env):
+        blob = pack_state(env)
+        offset = self._keyframes.tell()
+        self._keyframes.write(blob)
+        self._keyframe_index.write(np.array((self._episode[1], offset, len(blob)), dtype=KEYFRAME_DTYPE).tobytes())
+        self.total_keyframes += 1
+        self._episode[3] += 1
+
+    def flush(self):
+        """ writes the buffered steps, each to the chunk file it belongs to """
+        done = 0
+        while done < self._buffered:
+            chunk, position = divmod(self.total_steps, self.chunk_steps)
+            count = min(self._buffered - done, self.chunk_steps - position)
+            with open(self.path / f"steps_{chunk:05d}.bin", "ab") as file:
+                file.write(self._buffer[done:done + count].tobytes())
+            self.total_steps += count
+            done += count
+        self._buffered = 0
+
+        for file in (self._episodes, self._keyframes, self._keyframe_index):
+            file.flush()
+
+    def close(self):
+        """ writes everything, an unfinished episode is kept with the steps it has """
+        self.end_episode()
+        self.flush()
+        for file in (self._episodes, self._keyframes, self._keyframe_index):
+            file.close()
+
+
+class TrajectoryReplayer:
+    """
+        Reads a trajectory directory and rebuilds the state of any step by
+        restoring the closest keyframe before it and replaying the actions after it.
+    """
+
+    def __init__(self, path, env=None):
+        self.path = Path(path)
+        with open(self.path / "trajectory.json") as file:
+            meta = json.load(file)
+        self.chunk_steps = meta["chunk_steps"]
+        self.keyframe_every = meta["keyframe_every"]
+
+        for key, value in meta["settings"].items():
+            if getattr(settings.EnvironmentVars, key) != value:
+                raise ValueError(f"recorded with {key}={value}, the current settings have {getattr(settings.EnvironmentVars, key)}")
+
+        self._chunks = [
+            _memmap(chunk_path, STEP_DTYPE) for chunk_path in sorted(self.path.glob("steps_*.bin"))
+        ]
+        self.episodes = _memmap(self.path / "episodes.bin", EPISODE_DTYPE)
+        self.keyframes = _memmap(self.path / "keyframe_index.bin", KEYFRAME_DTYPE)
+        self._blobs = _memmap(self.path / "keyframes.bin", np.uint8)
+
+        if env is None:
+            from core import ShoverWorldCore
+            env = ShoverWorldCore()
+        self.env = env
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def steps(self, episode):
+        """ the step records of an episode: action (i, j, z), reward and flags """
+        first, length = int(self.episodes[episode]["first_step"]), int(self.episodes[episode]["length"])
+        parts = []
+        while length > 0:
+            chunk, position = divmod(first, self.chunk_steps)
+            part = self._chunks[chunk][position:position + length]
+            parts.append(part)
+            first += len(part)
+            length -= len(part)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def state_at(self, episode, t):
+        """ self.env put in the state after the first t steps of the episode """
+        entry = self.episodes[episode]
+        if not 0 <= t <= entry["length"]:
+            raise IndexError(f"episode {episode} has {entry['length']} steps, no step {t}")
+
+        first = int(entry["first_keyframe"])
+        keyframes = self.keyframes[first:first + int(entry["keyframes"])]
+        k = int(np.searchsorted(keyframes["step"], t, side="right")) - 1
+        self._restore(keyframes[k])
+
+        steps = self.steps(episode)
+        for record in steps[int(keyframes[k]["step"]):t]:
+            self._step(record)
+        return self.env
+
+    def verify(self, episodes=None):
+        """
+            Replays the episodes from their first keyframe and checks every reward
+            and flag, and every later keyframe, against the recording.
+            Returns the number of steps checked.
+        """
+        checked = 0
+        for episode in range(len(self)) if episodes is None else episodes:
+            entry = self.episodes[episode]
+            first = int(entry["first_keyframe"])
+            keyframes = self.keyframes[first:first + int(entry["keyframes"])]
+            self._restore(keyframes[0])
+
+            next_keyframe = 1
+            for t, record in enumerate(self.steps(episode), 1):
+                reward, flags = self._step(record)
+                if reward != record["reward"] or flags != record["flags"]:
+                    raise RuntimeError(
+                        f"episode {episode} step {t - 1}: replay gave reward {reward} flags {flags}, "
+                        f"recorded reward {record['reward']} flags {record['flags']}"
+                    )
+                if next_keyframe < len(keyframes) and keyframes[next_keyframe]["step"] == t:
+                    if pack_state(self.env) != self._blob(keyframes[next_keyframe]):
+                        raise RuntimeError(f"episode {episode} step {t - 1}: replayed state differs from the keyframe")
+                    next_keyframe += 1
+                checked += 1
+        return checked
+
+    def _blob(self, keyframe):
+        offset, size = int(keyframe["offset"]), int(keyframe["size"])
+        return self._blobs[offset:offset + size].tobytes()
+
+    def _restore(self, keyframe):
+        unpack_state(self.env, self._blob(keyframe))
+
+    def _step(self, record):
+        i, j, z = (int(v) for v in record["action"])
+        _, reward, terminated, truncated, _ = self.env.step({"position": np.array([i, j]), "z": z})
+        return np.float32(reward), TERMINATED * bool(terminated) | TRUNCATED * bool(truncated)
+
+
+def _memmap(path, dtype):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
@@ -0,0 +1,458 @@
+import numpy as np
+from gymnasium import spaces
+from gymnasium.vector import VectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+from enums import Objects, Actions, Move_to_delta
+import settings
+from map_library import get_library
+from square_detection import SquareDetector
+from action_mask import action_mask
+from map_generator import MapGenerator
+import observation
+import observation_spaces
+
+# row/col delta of every action id, zero for the special actions
+DELTAS = np.zeros((len(Actions) + 1, 2), dtype=np.int64)
+for _z, _delta in Move_to_delta.items():
+    DELTAS[_z] = _delta
+
+
+class ShoverWorldVecEnv(VectorEnv):
+    """
+        Steps `num_envs` Shover-World grids at once. All grids live in one
+        (N, H, W) array and every rule of ShoverWorldEnv.step() is applied
+        to the whole batch with array operations.
+
+        Perfect squares are kept in fixed-capacity slot arrays of shape (N, K)
+        instead of per-env lists. The list order of ShoverWorldEnv is
+        (birth, start_i, start_j), which is what the selection keys below use.
+
+        Finished envs are reset in the same step; the last observation of
+        the finished episode is returned in info["final_obs"].
+    """
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(
+            self,
+            num_envs,
+            render_mode=None,
+            map_name=None
+        ):
+        self.num_envs = num_envs
+        self.render_mode = render_mode
+        self.map_name = map_name
+
+        self.n_rows = settings.EnvironmentVars.n_rows
+        self.n_cols = settings.EnvironmentVars.n_cols
+        self.max_timestep = settings.EnvironmentVars.max_timestep
+        self.number_of_boxes = settings.EnvironmentVars.number_of_boxes
+        self.number_of_barriers = settings.EnvironmentVars.number_of_barriers
+        self.number_of_lavas = settings.EnvironmentVars.number_of_lavas
+        self.initial_stamina = settings.EnvironmentVars.initial_stamina
+        self.initial_force = settings.EnvironmentVars.initial_force
+        self.unit_force = settings.EnvironmentVars.unit_force
+        self.perf_sq_initial_age = settings.EnvironmentVars.perf_sq_initial_age
+        self.map_path = settings.Paths.maps_path
+        self.grid_dtype = np.int8 if settings.EnvironmentVars.compact else np.int64
+        self.observation = settings.EnvironmentVars.observation
+        self.tensor_dtype = np.dtype(settings.EnvironmentVars.tensor_dtype)
+
+        self.map_template = None
+        self.generator = None
+        if map_name:
+            self.map_template = get_library(self.map_path).get(map_name)
+        if self.map_template is not None:
+            self.n_rows, self.n_cols = self.map_template.shape
+
+        N, H, W = num_envs, self.n_rows, self.n_cols
+        self.map = np.zeros((N, H, W), dtype=self.grid_dtype)
+        self.stamina = np.zeros(N, dtype=np.int64)
+        self.timestep = np.zeros(N, dtype=np.int64)
+        self.last_z = np.zeros(N, dtype=np.int64) # 0 stands for None
+        self.moving_position = np.full((N, 2), -1, dtype=np.int64)
+        self.moving_z = np.zeros(N, dtype=np.int64) # 0 means no moving position
+
+        # perfect square slots
+        self.capacity = 4
+        self.sq_i = np.zeros((N, self.capacity), dtype=np.int64)
+        self.sq_j = np.zeros((N, self.capacity), dtype=np.int64)
+        self.sq_extend = np.zeros((N, self.capacity), dtype=np.int64)
+        self.sq_birth = np.zeros((N, self.capacity), dtype=np.int64)
+        self.sq_alive = np.zeros((N, self.capacity), dtype=bool)
+        self.clock = np.zeros(N, dtype=np.int64)
+
+        # envs whose grid or squares changed since the last detection pass
+        self.dirty = np.ones(N, dtype=bool)
+
+        # legal actions, the moves are recomputed only for the envs whose grid changed
+        self.mask = np.zeros((N, H, W, len(Actions)), dtype=bool)
+        self.mask_stale = np.ones(N, dtype=bool)
+
+        # (N, C, H, W) planes of the "tensor" observations, the object planes are
+        # rebuilt only for the envs whose grid changed, the square planes for the
+        # envs that have or had squares
+        if self.observation == "tensor":
+            self.planes = np.zeros((N, len(observation.TENSOR_CHANNELS), H, W), dtype=self.tensor_dtype)
+            self.planes_stale = np.ones(N, dtype=bool)
+            self.planes_squares = np.zeros(N, dtype=bool) # envs with squares painted
+            self.max_square_age = observation.max_square_age(self.perf_sq_initial_age, self.tensor_dtype)
+
+        self.single_action_space = spaces.Dict({
+            "position": spaces.MultiDiscrete([H, W]),
+            "z": spaces.Discrete(len(Actions), start=1)
+        })
+        if self.observation == "tensor":
+            self.single_observation_space = observation_spaces.tensor_space((H, W), self.tensor_dtype, self.perf_sq_initial_age)
+        else:
+            self.single_observation_space = observation_spaces.dict_space((H, W), self.grid_dtype)
+        self.action_space = batch_space(self.single_action_space, N)
+        self.observation_space = batch_space(self.single_observation_space, N)
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        self._reset_envs(np.arange(self.num_envs))
+        return self._get_obs(), {}
+
+    def step(self, actions):
+        N = self.num_envs
+        position = np.asarray(actions["position"], dtype=np.int64).reshape(N, 2)
+        z = np.asarray(actions["z"], dtype=np.int64).reshape(N)
+
+        self.last_z[:] = z
+        rewards = np.zeros(N, dtype=np.float64)
+
+        move_idx = np.flatnonzero((z >= Actions.MoveUp.value) & (z <= Actions.MoveLeft.value))
+        if move_idx.size:
+            self._apply_move_actions(move_idx, position[move_idx], z[move_idx], rewards)
+
+        barrier_idx = np.flatnonzero(z == Actions.BarrierMaker.value)
+        if barrier_idx.size:
+            self._apply_barrier_maker_actions(barrier_idx, rewards)
+
+        hellify_idx = np.flatnonzero(z == Actions.Hellify.value)
+        if hellify_idx.size:
+            self._apply_hellify_actions(hellify_idx)
+
+        # increase the age of all perfect squares
+        self.clock += 1
+
+        # find new perfect squares
+        dirty_idx = np.flatnonzero(self.dirty)
+        if dirty_idx.size:
+            self._find_new_perfect_squares(dirty_idx)
+        self.mask_stale |= self.dirty
+        if self.observation == "tensor":
+            self.planes_stale |= self.dirty
+        self.dirty[:] = False
+
+        # Automatic Dissolution of Perfect Squares
+        self._dissolute_expired()
+        self.mask_stale |= self.dirty
+        if self.observation == "tensor":
+            self.planes_stale |= self.dirty
+
+        self.timestep += 1
+
+        done = self._check_termination()
+        obs = self._get_obs()
+        infos = {}
+
+        done_idx = np.flatnonzero(done)
+        if done_idx.size:
+            if self.observation == "tensor":
+                infos["final_obs"] = obs.copy()
+            else:
+                infos["final_obs"] = {key: value.copy() for key, value in obs.items()}
+            infos["_final_obs"] = done.copy()
+            self._reset_envs(done_idx)
+            obs = self._get_obs()
+
+        return obs, rewards, done.copy(), done.copy(), infos
+
+    def _apply_move_actions(self, idx, position, z, rewards):
+        """
+            Pushes the box chain starting at `position` for every env in `idx`.
+
+            The cells along the push direction are gathered into one (M, L) ray
+            per env, the end of the chain is the first non box cell on the ray,
+            and the whole chain is shifted by writing the ray back shifted by one.
+        """
+        H, W = self.n_rows, self.n_cols
+        L = max(H, W) + 1
+        M = idx.size
+
+        delta = DELTAS[z]
+        k = np.arange(L)
+        rows = position[:, :1] + k * delta[:, :1]
+        cols = position[:, 1:] + k * delta[:, 1:]
+        in_bound = (rows >= 0) & (rows < H) & (cols >= 0) & (cols < W)
+
+        env_idx = np.broadcast_to(idx[:, None], (M, L))
+        ray = self.map[env_idx, rows.clip(0, H - 1), cols.clip(0, W - 1)]
+        ray = np.where(in_bound, ray, Objects.Barrier.value) # out of bound cannot move
+
+        boxes = (ray >= Objects.Box1.value) & (ray <= Objects.Box10.value)
+        chain_end = np.argmin(boxes, axis=1) # the ray always ends out of bound
+        blocker = ray[np.arange(M), chain_end]
+        into_lava = blocker == Objects.Lava.value
+        moved = boxes[:, 0] & (into_lava | (blocker == Objects.Empty.value))
+
+        # every box of the chain costs a unit force, a box pushed into the lava refunds the initial force
+        stamina_delta = -self.unit_force * chain_end + into_lava * self.initial_force
+        self.stamina[idx] += np.where(moved, stamina_delta, 0)
+        rewards[idx] = np.where(moved & into_lava, self.initial_force, 0)
+
+        shifted = np.empty_like(ray)
+        shifted[:, 0] = Objects.Empty.value
+        shifted[:, 1:] = ray[:, :-1]
+        write = moved[:, None] & (k <= chain_end[:, None]) & ~(into_lava[:, None] & (k == chain_end[:, None]))
+        self.map[env_idx[write], rows[write], cols[write]] = shifted[write]
+
+        # the head box was moved
+        moved_idx = idx[moved]
+        same_push = (
+            (self.moving_z[moved_idx] == z[moved])
+            & (self.moving_position[moved_idx] == position[moved]).all(axis=1)
+        )
+        self.stamina[moved_idx] -= np.where(same_push, 0, self.initial_force)
+        self.moving_position[moved_idx] = position[moved] + delta[moved]
+        self.moving_z[moved_idx] = z[moved]
+
+        if moved_idx.size:
+            self._remove_first_including(moved_idx, position[moved])
+            self.dirty[moved_idx] = True
+
+        still_idx = idx[~moved]
+        self.moving_position[still_idx] = -1
+        self.moving_z[still_idx] = 0
+        self.stamina[still_idx] -= 1
+
+    def _apply_barrier_maker_actions(self, idx, rewards):
+        self._clear_moving_positions(idx)
+
+        slot, found = self._select_oldest(idx, self.sq_alive[idx])
+        self.stamina[idx[~found]] -= 1
+
+        idx, slot = idx[found], slot[found]
+        if idx.size == 0:
+            return
+
+        si, sj, extend = self.sq_i[idx, slot], self.sq_j[idx, slot], self.sq_extend[idx, slot]
+        self._fill_regions(idx, si, sj, extend, 1, extend - 2, Objects.Barrier.value)
+        self.sq_alive[idx, slot] = False
+        self.stamina[idx] += (extend - 2)**2
+        rewards[idx] = 10*(extend - 2)**2
+        self.dirty[idx] = True
+
+    def _apply_hellify_actions(self, idx):
+        self._clear_moving_positions(idx)
+
+        candidates = self.sq_alive[idx] & (self.sq_extend[idx] >= 5) # n > 2
+        slot, found = self._select_oldest(idx, candidates)
+        self.stamina[idx[~found]] -= 1
+
+        idx, slot = idx[found], slot[found]
+        if idx.size == 0:
+            return
+
+        si, sj, extend = self.sq_i[idx, slot], self.sq_j[idx, slot], self.sq_extend[idx, slot]
+        self._fill_regions(idx, si, sj, extend, 1, extend - 2, Objects.Empty.value)
+        self._fill_regions(idx, si, sj, extend, 2, extend - 3, Objects.Lava.value)
+        self.sq_alive[idx, slot] = False
+        self.stamina[idx] += (extend - 2)**2
+        self.dirty[idx] = True
+
+    def _clear_moving_positions(self, idx):
+        self.moving_position[idx] = -1
+        self.moving_z[idx] = 0
+
+    def _list_order(self, idx):
+        # position of every square in the equivalent ShoverWorldEnv.perfect_squares list
+        return (self.sq_birth[idx] * self.n_rows + self.sq_i[idx]) * self.n_cols + self.sq_j[idx]
+
+    def _select_oldest(self, idx, candidates):
+        """
+            Picks the oldest candidate square, ties go to the one that comes
+            last in the list (like sorting by age and reversing).
+        """
+        key = self.sq_birth[idx] * self.n_rows * self.n_cols - (self.sq_i[idx] * self.n_cols + self.sq_j[idx])
+        key = np.where(candidates, key, np.iinfo(np.int64).max)
+        return np.argmin(key, axis=1), candidates.any(axis=1)
+
+    def _remove_first_including(self, idx, position):
+        # uses the same inclusive bounds as PerfectSquare.includes
+        si, sj, extend = self.sq_i[idx], self.sq_j[idx], self.sq_extend[idx]
+        pi, pj = position[:, :1], position[:, 1:]
+        including = (
+            self.sq_alive[idx]
+            & (si <= pi) & (pi <= si + extend)
+            & (sj <= pj) & (pj <= sj + extend)
+        )
+        key = np.where(including, self._list_order(idx), np.iinfo(np.int64).max)
+        slot = np.argmin(key, axis=1)
+        found = including.any(axis=1)
+        self.sq_alive[idx[found], slot[found]] = False
+
+    def _region_cells(self, si, sj, lo, hi_offset):
+        """ square index, row and column of the cells (si + a, sj + b) with lo <= a, b <= hi_offset """
+        rr = np.arange(self.n_rows)[None, :, None] - si[:, None, None]
+        cc = np.arange(self.n_cols)[None, None, :] - sj[:, None, None]
+        hi = hi_offset[:, None, None]
+        inside = (rr >= lo) & (rr <= hi) & (cc >= lo) & (cc <= hi)
+        return np.nonzero(inside)
+
+    def _fill_regions(self, idx, si, sj, extend, lo, hi_offset, value):
+        """
+            Writes `value` into the cells (si + a, sj + b) with lo <= a, b <= hi_offset,
+            for every square of the envs in `idx` (an env may appear more than once).
+        """
+        square, r, c = self._region_cells(si, sj, lo, hi_offset)
+        self.map[idx[square], r, c] = value
+
+    def _find_new_perfect_squares(self, idx):
+        """
+            Sweeps every start and extend of the envs in `idx` using summed-area
+            tables of the empty and box masks, and registers the squares that
+            are not registered yet with the current clock as birth.
+        """
+        H, W = self.n_rows, self.n_cols
+        env, i, j, extend = SquareDetector(self.map[idx]).find_all()
+        env = idx[env]
+        if env.size == 0:
+            return
+
+        # drop the squares that are already registered
+        key = ((env * H + i) * W + j) * (max(H, W) + 1) + extend
+        alive_env, alive_slot = np.nonzero(self.sq_alive)
+        registered = ((alive_env * H + self.sq_i[alive_env, alive_slot]) * W + self.sq_j[alive_env, alive_slot]) \
+            * (max(H, W) + 1) + self.sq_extend[alive_env, alive_slot]
+        new = ~np.isin(key, registered)
+        env, i, j, extend = env[new], i[new], j[new], extend[new]
+        if env.size == 0:
+            return
+
+        order = np.argsort(env, kind="stable")
+        env, i, j, extend = env[order], i[order], j[order], extend[order]
+
+        # rank of each new square among the new squares of its env
+        counts = np.bincount(env, minlength=self.num_envs)
+        first = np.cumsum(counts) - counts
+        rank = np.arange(env.size) - first[env]
+
+        needed = int((self.sq_alive.sum(axis=1) + counts).max())
+        if needed > self.capacity:
+            self._grow_slots(max(needed, 2*self.capacity))
+
+        free_slots = np.argsort(self.sq_alive, axis=1, kind="stable") # free slots come first
+        slot = free_slots[env, rank]
+
+        self.sq_i[env, slot] = i
+        self.sq_j[env, slot] = j
+        self.sq_extend[env, slot] = extend
+        self.sq_birth[env, slot] = self.clock[env]
+        self.sq_alive[env, slot] = True
+
+    def _grow_slots(self, capacity):
+        extra = capacity - self.capacity
+        pad = ((0, 0), (0, extra))
+        self.sq_i = np.pad(self.sq_i, pad)
+        self.sq_j = np.pad(self.sq_j, pad)
+        self.sq_extend = np.pad(self.sq_extend, pad)
+        self.sq_birth = np.pad(self.sq_birth, pad)
+        self.sq_alive = np.pad(self.sq_alive, pad)
+        self.capacity = capacity
+
+    def _dissolute_expired(self):
+        expired = self.sq_alive & ((self.clock[:, None] - self.sq_birth) >= self.perf_sq_initial_age)
+        env, slot = np.nonzero(expired)
+        if env.size == 0:
+            return
+
+        extend = self.sq_extend[env, slot]
+        self._fill_regions(env, self.sq_i[env, slot], self.sq_j[env, slot], extend, 1, extend - 1, Objects.Empty.value)
+        self.sq_alive[env, slot] = False
+        self.dirty[env] = True
+
+    def _check_termination(self):
+        boxes = (self.map >= Objects.Box1.value) & (self.map <= Objects.Box10.value)
+        return (
+            (self.stamina <= 0)
+            | (self.timestep >= self.max_timestep)
+            | ~boxes.any(axis=(1, 2))
+        )
+
+    def _reset_envs(self, idx):
+        if self.map_template is not None:
+            self.map[idx] = self.map_template
+        else:
+            self.map[idx] = self._generate_random_maps(idx.size)
+
+        self.stamina[idx] = self.initial_stamina
+        self.timestep[idx] = 0
+        self.last_z[idx] = 0
+        self._clear_moving_positions(idx)
+
+        self.sq_alive[idx] = False
+        self.clock[idx] = 0
+        self._find_new_perfect_squares(idx)
+        self.mask_stale[idx] = True
+        if self.observation == "tensor":
+            self.planes_stale[idx] = True
+
+    def _generate_random_maps(self, count):
+        if self.generator is None:
+            self.generator = MapGenerator(
+                self.n_rows, self.n_cols,
+                boxes=self.number_of_boxes, lavas=self.number_of_lavas, barriers=self.number_of_barriers,
+                dtype=self.grid_dtype,
+            )
+        return self.generator.generate(count, self.np_random)
+
+    def action_mask(self):
+        """
+            (N, H, W, 6) booleans, mask[n, i, j, z - 1] is true when the action
+            (i, j, z) moves something in env n. Updated in place by the next steps.
+        """
+        stale_idx = np.flatnonzero(self.mask_stale)
+        if stale_idx.size:
+            self.mask[stale_idx] = action_mask(self.map[stale_idx])
+            self.mask_stale[:] = False
+
+        self.mask[..., Actions.BarrierMaker.value - 1] = self.sq_alive.any(axis=1)[:, None, None]
+        self.mask[..., Actions.Hellify.value - 1] = (self.sq_alive & (self.sq_extend >= 5)).any(axis=1)[:, None, None]
+        return self.mask
+
+    def _get_obs(self):
+        if self.observation == "tensor":
+            return self._get_planes()
+
+        obs = {
+            "grid": self.map.copy(),
+            "stamina": self.stamina.copy(),
+            "previous_selected_position": self.moving_position.copy(),
+            "previous_action": self.last_z.copy(),
+        }
+
+        return obs
+
+    def _get_planes(self):
+        """ (N, C, H, W) tensor observations, updated in place by the next steps """
+        stale_idx = np.flatnonzero(self.planes_stale)
+        if stale_idx.size:
+            self.planes[stale_idx, :observation.SQUARE] = observation.object_planes(self.map[stale_idx], self.tensor_dtype)
+            self.planes_stale[:] = False
+
+        # the ages change every step, so the square planes of the envs with squares are painted again
+        has_squares = self.sq_alive.any(axis=1)
+        self.planes[self.planes_squares | has_squares, observation.SQUARE:] = 0
+        self.planes_squares = has_squares
+
+        env, slot = np.nonzero(self.sq_alive)
+        if env.size:
+            extend = self.sq_extend[env, slot]
+            square, r, c = self._region_cells(self.sq_i[env, slot], self.sq_j[env, slot], 1, extend - 2)
+            age = np.minimum(self.clock[env] - self.sq_birth[env, slot], self.max_square_age)
+            self.planes[env[square], observation.SQUARE, r, c] = 1
+            self.planes[env[square], observation.SQUARE_AGE, r, c] = age[square]
+        return self.planes
@@ -0,0 +1,114 @@
+"""
+    Worker side of ShoverWorldProcVecEnv: the layout of the shared memory block
+    and the process stepping a shard of the envs. Kept apart from
+    process_vec_env.py so that spawned workers import numpy and the simulation
+    core only, not gymnasium.
+"""
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import settings
+
+OBS_KEYS = ("grid", "stamina", "previous_selected_position", "previous_action")
+
+
+def shared_layout(N, H, W, grid_dtype):
+    """ (name, shape, dtype) of every array of the shared block """
+    obs = [
+        ("grid", (N, H, W), grid_dtype),
+        ("stamina", (N,), np.int64),
+        ("previous_selected_position", (N, 2), np.int64),
+        ("previous_action", (N,), np.int64),
+    ]
+    return [
+        ("actions", (N, 3), np.int64), # i, j, z
+        *obs,
+        ("reward", (N,), np.float64),
+        ("terminated", (N,), np.bool_),
+        ("truncated", (N,), np.bool_),
+        *[("final_" + name, shape, dtype) for name, shape, dtype in obs],
+    ]
+
+def aligned_size(shape, dtype):
+    return -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // 8) * 8
+
+def block_size(layout):
+    return sum(aligned_size(shape, dtype) for _, shape, dtype in layout)
+
+def block_views(buf, layout):
+    """ numpy arrays over the shared block, in the order of the layout """
+    views = {}
+    offset = 0
+    for name, shape, dtype in layout:
+        views[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        offset += aligned_size(shape, dtype)
+    return views
+
+
+def write_obs(views, prefix, k, env):
+    views[prefix + "grid"][k] = env.map
+    views[prefix + "stamina"][k] = env.stamina
+    if env.moving_positions:
+        views[prefix + "previous_selected_position"][k] = next(iter(env.moving_positions))
+    else:
+        views[prefix + "previous_selected_position"][k] = -1
+    views[prefix + "previous_action"][k] = env.last_z or 0 # 0 stands for None
+
+
+def run_worker(remote, parent_remote, shm_name, layout, start, stop, map_name, env_vars, seeds):
+    """
+        Steps the envs start..stop of the batch, their random maps seeded by
+        `seeds`. Actions are read from and observations written to the shared
+        block, the pipe only carries commands.
+    """
+    parent_remote.close()
+    for key, value in env_vars.items():
+        setattr(settings.EnvironmentVars, key, value)
+
+    from core import ShoverWorldCore
+
+    shm = SharedMemory(name=shm_name)
+    views = block_views(shm.buf, layout)
+    try:
+        try:
+            envs = [ShoverWorldCore(map_name=map_name) for _ in range(start, stop)]
+            for env, seed in zip(envs, seeds):
+                env.reset(seed=seed)
+        except Exception:
+            remote.send(traceback.format_exc())
+            return
+        remote.send(None)
+
+        while True:
+            command, arg = remote.recv()
+            if command == "close":
+                break
+
+            try:
+                if command == "reset":
+                    for k, env in enumerate(envs, start):
+                        env.reset(seed=None if arg is None else arg + k)
+                        write_obs(views, "", k, env)
+
+                elif command == "step":
+                    actions = views["actions"]
+                    for k, env in enumerate(envs, start):
+                        _, reward, terminated, truncated, _ = env.step({"position": actions[k, :2].copy(), "z": int(actions[k, 2])})
+                        views["reward"][k] = reward
+                        views["terminated"][k] = terminated
+                        views["truncated"][k] = truncated
+                        if terminated or truncated:
+                            write_obs(views, "final_", k, env)
+                            env.reset()
+                        write_obs(views, "", k, env)
+
+                remote.send(None)
+            except Exception:
+                remote.send(traceback.format_exc())
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        del views
+        shm.close()
+        remote.close()
@@ -0,0 +1,118 @@
+import numpy as np
+from enums import Objects
+
+MASK = (1 << 64) - 1
+
+# index of each object value in the key table of a cell
+VALUE_INDEX = {obj.value: k for k, obj in enumerate(Objects)}
+INDEX_LOOKUP = np.zeros(Objects.Barrier.value - Objects.Lava.value + 1, dtype=np.int64)
+for _value, _k in VALUE_INDEX.items():
+    INDEX_LOOKUP[_value - Objects.Lava.value] = _k
+
+# grids with more cells than this hash their cells with HashedZobristTable, a
+# table would take 13 uint64 keys per cell (27 MB at 512x512)
+TABLE_MAX_CELLS = 1 << 18
+
+# tags keeping the keys of the different parts of the state apart
+STAMINA_TAG = 1
+MOVING_TAG = 2
+SQUARE_TAG = 3
+
+def mix(x):
+    """ splitmix64 finalizer, turns any integer into a well spread 64-bit key """
+    x = (x + 0x9E3779B97F4A7C15) & MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+class ZobristTable:
+    """
+        One random 64-bit key per (cell, object value). The key of an empty cell
+        is 0, so the hash of a grid is the xor of the keys of its non empty cells
+        and writing a cell is two xors.
+    """
+
+    def __init__(self, n_rows, n_cols, seed=0):
+        rng = np.random.default_rng(seed)
+        table = rng.integers(0, 2**64, size=(n_rows, n_cols, len(VALUE_INDEX)), dtype=np.uint64)
+        table[:, :, VALUE_INDEX[Objects.Empty.value]] = 0
+
+        self.table = table
+
+    def cell_key(self, i, j, value):
+        return int(self.table[i, j, VALUE_INDEX[value]])
+
+    def grid_hash(self, grid):
+        index = INDEX_LOOKUP[np.asarray(grid, dtype=np.int64) - Objects.Lava.value]
+        rows, cols = np.indices(grid.shape)
+        return int(np.bitwise_xor.reduce(self.table[rows, cols, index], axis=None))
+
+
+def stamina_key(stamina, bucket):
+    return mix((STAMINA_TAG << 56) ^ (stamina // bucket))
+
+def moving_key(position, z):
+    i, j = position
+    return mix((MOVING_TAG << 56) ^ (int(i) << 36) ^ (int(j) << 16) ^ int(z))
+
+def square_key(start, extend, age):
+    i, j = start
+    return mix((SQUARE_TAG << 56) ^ (i << 40) ^ (j << 24) ^ (extend << 12) ^ age)
+
+
+def mix_array(x):
+    """ mix() of every value of a uint64 array """
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class HashedZobristTable:
+    """
+        Keys computed from (cell, object value) instead of stored, for grids too
+        large for a table (above TABLE_MAX_CELLS, or chunked_grid.ChunkedGrid).
+        The grid hash only looks at the non empty cells.
+    """
+    table = None # no table to index, use cell_key()
+
+    def __init__(self, seed=0):
+        self.salt = mix(seed)
+
+    def cell_key(self, i, j, value):
+        if value == Objects.Empty.value:
+            return 0
+        return mix(self.salt ^ (int(i) << 40) ^ (int(j) << 16) ^ VALUE_INDEX[value])
+
+    def grid_hash(self, grid):
+        if isinstance(grid, np.ndarray):
+            rows, cols = np.nonzero(grid)
+            values = grid[rows, cols]
+        else:
+            rows, cols, values = grid.nonzero()
+        x = (
+            np.uint64(self.salt)
+            ^ (rows.astype(np.uint64) << np.uint64(40))
+            ^ (cols.astype(np.uint64) << np.uint64(16))
+            ^ INDEX_LOOKUP[values.astype(np.int64) - Objects.Lava.value].astype(np.uint64)
+        )
+        return int(np.bitwise_xor.reduce(mix_array(x))) if len(x) else 0
+
+
+_tables = {}
+
+def get_table(n_rows, n_cols, seed=0):
+    """ tables are shared, so equal states hash equal in every env and process """
+    key = (n_rows, n_cols, seed)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = ZobristTable(n_rows, n_cols, seed)
+    return table
+
+def get_hashed_table(seed=0):
+    key = ("hashed", seed)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = HashedZobristTable(seed)
+    return table